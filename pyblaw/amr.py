@@ -0,0 +1,848 @@
+"""PyBLAW block-structured adaptive mesh refinement (1D).
+
+"""
+
+import copy
+import os
+import numpy as np
+
+import pyblaw.base
+import pyblaw.boundary
+import pyblaw.cache
+import pyblaw.evolver
+import pyblaw.grid
+import pyblaw.parareal
+import pyblaw.uniformweno
+import pyblaw.wenoclaw
+
+
+######################################################################
+
+def slopes(q):
+    """Return the minmod limited slopes (per cell) of the interior
+    cells of *q* (q has one extra cell on either side)."""
+
+    dl = q[1:-1] - q[:-2]
+    dr = q[2:] - q[1:-1]
+
+    return np.where(dl*dr > 0.0, np.sign(dl) * np.minimum(abs(dl), abs(dr)), 0.0)
+
+
+def prolong(q, ratio):
+    """Return the conservative prolongation of the interior cells of
+    *q* (q has one extra cell on either side) onto a grid *ratio*
+    times finer (coarse to fine, uniform grids).
+
+    The fine cell averages are the averages of the minmod limited
+    linear reconstruction of each coarse cell, so that their mean is
+    the coarse cell average and no new extrema are created.
+
+    """
+
+    N = q.shape[0] - 2
+    p = q.shape[1]
+
+    xi = (np.arange(ratio) + 0.5) / ratio - 0.5
+    qf = q[1:-1,np.newaxis,:] + xi[np.newaxis,:,np.newaxis] * slopes(q)[:,np.newaxis,:]
+
+    return qf.reshape((N*ratio, p))
+
+
+def restrict(q, ratio):
+    """Return the conservative restriction (averages) of *q* onto a
+    grid *ratio* times coarser (see pyblaw.parareal.restrict)."""
+
+    return pyblaw.parareal.restrict(np.ascontiguousarray(q), ratio)
+
+
+######################################################################
+
+class GradientCriterion(object):
+    """Refinement criterion: large jumps.
+
+       **Arguments**
+
+       * *threshold*  - relative jump threshold (defaults to 0.05)
+       * *components* - components that are tested (defaults to all)
+
+       A cell is flagged if the magnitude of the difference of its
+       cell average and that of a neighbour is larger than
+       *threshold* times the range of the component over the whole
+       (coarsest) grid.  Jumps of smooth regions decrease as the grid
+       is refined, whereas jumps across discontinuities do not.
+
+    """
+
+    def __init__(self, threshold=0.05, components=None):
+        self.threshold  = threshold
+        self.components = components
+
+    def __call__(self, q, **kwargs):
+        c = pyblaw.base.columns(self.components)
+
+        jump = abs(np.diff(q[:,c], axis=0)) > self.threshold * kwargs['scale'][c]
+        jump = jump.any(axis=1)
+
+        flags = np.zeros(q.shape[0], dtype=np.bool)
+        flags[1:]  |= jump
+        flags[:-1] |= jump
+
+        return flags
+
+
+class SmoothnessCriterion(object):
+    """Refinement criterion: WENO smoothness indicators.
+
+       **Arguments**
+
+       * *threshold*  - weight deviation threshold (defaults to 0.2)
+       * *order*      - WENO order k (defaults to 3)
+       * *epsilon*    - WENO epsilon (defaults to 1e-6)
+       * *components* - components that are tested (defaults to all)
+
+       The WENO smoothness indicators of the k stencils of each cell
+       are computed as in pyblaw.uniformweno.UniformWENOReconstructor,
+       along with the nonlinear weights of the reconstruction at the
+       left boundary of the cell.  A cell is flagged if some
+       nonlinear weight differs from its optimal (linear) weight by
+       more than *threshold*, ie, if the WENO reconstruction would
+       switch stencils.  Nonlinear weights are close to the optimal
+       weights in smooth regions (and in flat regions, where epsilon
+       dominates), and close to zero for stencils that cross a
+       discontinuity.
+
+    """
+
+    def __init__(self, threshold=0.2, order=3, epsilon=1e-6, components=None):
+        self.threshold  = threshold
+        self.components = components
+        self.weno       = pyblaw.uniformweno.UniformWENOReconstructor(order, epsilon)
+
+    def __call__(self, q, **kwargs):
+        weno = self.weno
+        g    = weno.g
+        N    = q.shape[0]
+        c    = pyblaw.base.columns(self.components)
+
+        qb = q[:,c]
+        qb = np.concatenate((np.repeat(qb[:1], g, axis=0), qb, np.repeat(qb[-1:], g, axis=0)))
+
+        si = {}
+        for o in range(-g, g+1):
+            si[o] = qb[g+o:g+o+N]
+
+        beta  = weno.indicators(si)
+        d     = weno.d['left']
+        alpha = [ d[r] / (weno.epsilon + beta[r])**2 for r in range(weno.k) ]
+        total = sum(alpha)
+
+        deviation = np.zeros(qb[g:g+N].shape)
+        for r in range(weno.k):
+            deviation = np.maximum(deviation, abs(alpha[r] / total - d[r]))
+
+        return (deviation > self.threshold).any(axis=1)
+
+
+######################################################################
+
+class FluxRegister(object):
+    """Numerical flux register.
+
+       **Arguments**
+
+       * *flux*    - flux of a patch solver (see pyblaw.flux.Flux)
+       * *weights* - stage weights of the patch evolver (see
+         pyblaw.evolver.Evolver)
+
+       The register replaces the flux of the evolver of a patch
+       solver: it computes the net fluxes with *flux*, and
+       accumulates the numerical fluxes at the boundaries *faces*
+       (see *set_faces*) in *F*, weighted by the stage weights and
+       the time step, so that after a step each row of *F* is the
+       flux through a boundary integrated over the step (see
+       pyblaw.flux.Flux.interface_flux).  The first two faces are
+       the ends of the patch.
+
+    """
+
+    def __init__(self, flux, weights):
+        self.inner   = flux
+        self.weights = weights
+        self.stage   = 0
+
+    def set_faces(self, faces, p):
+        """Record the numerical fluxes at the ends of the patch and at
+        the boundaries *faces* (of p components)."""
+
+        F = np.zeros((2 + len(faces), p))
+        if getattr(self, 'F', None) is not None:
+            F[:2] = self.F[:2]
+
+        self.faces = np.array([ 0, -1 ] + list(faces), dtype=np.int)
+        self.F     = F
+        self.Fs    = np.zeros(F.shape)
+
+    def flux(self, qm, qp, f, **kwargs):
+        r = self.inner.flux(qm, qp, f, **kwargs)
+
+        self.inner.interface_flux(qm[self.faces], qp[self.faces], self.Fs, **kwargs)
+        self.F += self.weights[self.stage] * kwargs['dt'] * self.Fs
+        self.stage = (self.stage + 1) % len(self.weights)
+
+        return r
+
+
+######################################################################
+
+class Patch(object):
+    """A block (patch) of contiguous cells of one level of an
+    AMRSolver.
+
+       **Arguments**
+
+       * *level*  - level (0 is the coarsest)
+       * *lo*     - index of the first cell (within the level)
+       * *hi*     - index of the last cell plus one
+       * *parent* - patch of the next coarser level that contains
+         this patch (or None)
+       * *ratio*  - refinement ratio
+       * *size*   - number of cells of the (whole) level
+
+       **Instance variables**
+
+       * *solver*   - patch solver (see *set_solver*)
+       * *q*        - cell averages (a view of those of the solver)
+       * *old*      - cell averages at the beginning of the last step
+       * *t*, *dt*  - time and time step of the last step
+       * *children* - patches of the next finer level
+
+    """
+
+    def __init__(self, level, lo, hi, parent, ratio, size):
+        self.level    = level
+        self.lo       = lo
+        self.hi       = hi
+        self.N        = hi - lo
+        self.parent   = parent
+        self.ratio    = ratio
+        self.size     = size
+        self.children = []
+
+    def set_solver(self, solver, t):
+        """Use the (initialised) *solver* to evolve the patch and
+        record its fluxes (see FluxRegister)."""
+
+        evolver = solver.evolver
+        if evolver.fused or evolver.threshold is not None:
+            raise ValueError, 'patch evolvers must not be fused or track active cells'
+
+        self.solver   = solver
+        self.q        = solver.q
+        self.old      = self.q.copy()
+        self.t        = t
+        self.dt       = 0.0
+        self.dx       = solver.dx[0]
+        self.active   = evolver.active
+        self.register = FluxRegister(evolver.flux, evolver.weights)
+        self.register.set_faces([], self.q.shape[1])
+
+        evolver.set_flux(self.register)
+
+    def set_children(self, children):
+        """Set the patches of the next finer level, and record the
+        fluxes at their ends (see FluxRegister)."""
+
+        r = self.ratio
+
+        self.children = children
+
+        faces = []
+        for child in children:
+            faces += [ child.lo/r - self.lo, child.hi/r - self.lo ]
+
+        self.register.set_faces(faces, self.q.shape[1])
+
+    def cells(self, lo, hi, tau):
+        """Return the cell averages of cells lo to hi-1 (within the
+        level) at time *tau*.
+
+        The cell averages are linearly interpolated in time between
+        the beginning and end of the last step, and cells beyond the
+        ends of the patch are copies of the end cells.
+
+        """
+
+        i = np.clip(np.arange(lo, hi) - self.lo, 0, self.N - 1)
+
+        if self.dt == 0.0:
+            return self.q[i]
+
+        theta = min(max((tau - self.t) / self.dt, 0.0), 1.0)
+
+        return (1.0 - theta) * self.old[i] + theta * self.q[i]
+
+    def step(self, t, dt):
+        """Evolve the patch from *t* to *t* + *dt*."""
+
+        solver = self.solver
+
+        self.old[:,:] = self.q
+        self.t  = t
+        self.dt = dt
+        self.register.F[2:] = 0.0
+
+        kwargs = {'n': 0, 't': t, 'dt': dt}
+        if solver.source is not None:
+            solver.evolver.evolve(solver.qg, solver.qng, **kwargs)
+        else:
+            solver.evolver.evolve_homogeneous(solver.qg, solver.qng, **kwargs)
+
+        self.q[:,:] = solver.qn
+
+
+######################################################################
+
+class PatchBoundary(pyblaw.boundary.Boundary):
+    """Coarse-fine boundary conditions of a patch.
+
+       **Arguments**
+
+       * *patch*    - patch (see Patch)
+       * *boundary* - boundary conditions at the ends of the (whole)
+         domain (defaults to pyblaw.boundary.OutflowBoundary)
+
+       The ghost cells at the ends of the patch that are within the
+       domain are filled with the conservative prolongation (see
+       *prolong*) of the cell averages of the parent patch,
+       interpolated in time to the stage time (see Patch.cells).
+       The exterior reconstructions there are the ends of the limited
+       linear reconstructions of the adjacent parent cells.
+
+    """
+
+    def __init__(self, patch, boundary=None):
+        self.patch = patch
+
+        if boundary is None:
+            boundary = pyblaw.boundary.OutflowBoundary()
+        self.boundary = boundary
+
+    def set_grid(self, grid):
+        self.grid = grid
+        self.boundary.set_grid(grid)
+
+    def set_system(self, system):
+        self.system = system
+        self.boundary.set_system(system)
+
+    def allocate(self):
+        self.boundary.allocate()
+
+    def pre_run(self, **kwargs):
+        self.boundary.pre_run(**kwargs)
+
+    def post_run(self, **kwargs):
+        self.boundary.post_run(**kwargs)
+
+    def fill_left(self, qg, g, **kwargs):
+        patch = self.patch
+        if patch.lo == 0:
+            self.boundary.fill_left(qg, g, **kwargs)
+            return
+
+        r  = patch.ratio
+        c  = (patch.lo - g) / r
+        qf = prolong(patch.parent.cells(c - 1, patch.lo/r + 1, self.time(kwargs)), r)
+
+        qg[:g,:] = qf[patch.lo-g-c*r:]
+
+    def fill_right(self, qg, g, **kwargs):
+        patch = self.patch
+        if patch.hi == patch.size:
+            self.boundary.fill_right(qg, g, **kwargs)
+            return
+
+        r  = patch.ratio
+        c  = (patch.hi + g - 1) / r + 1
+        qf = prolong(patch.parent.cells(patch.hi/r - 1, c + 1, self.time(kwargs)), r)
+
+        qg[-g:,:] = qf[:g]
+
+    def close_left(self, qm, qp, **kwargs):
+        patch = self.patch
+        if patch.lo == 0:
+            self.boundary.close_left(qm, qp, **kwargs)
+            return
+
+        c  = patch.lo / patch.ratio - 1
+        qc = patch.parent.cells(c - 1, c + 2, self.time(kwargs))
+
+        qm[0,:] = qc[1] + 0.5 * slopes(qc)[0]
+
+    def close_right(self, qm, qp, **kwargs):
+        patch = self.patch
+        if patch.hi == patch.size:
+            self.boundary.close_right(qm, qp, **kwargs)
+            return
+
+        c  = patch.hi / patch.ratio
+        qc = patch.parent.cells(c - 1, c + 2, self.time(kwargs))
+
+        qp[-1,:] = qc[1] - 0.5 * slopes(qc)[0]
+
+
+######################################################################
+
+class AMRSolver(object):
+    """Block-structured adaptive mesh refinement solver.
+
+       **Arguments**
+
+       * *factory*   - patch solver factory (callable)
+       * *x*         - grid boundaries of the coarsest level (uniform)
+       * *times*     - times
+       * *criterion* - refinement criterion (eg, GradientCriterion or
+         SmoothnessCriterion)
+       * *levels*    - maximum number of levels (defaults to 2)
+       * *ratio*     - refinement ratio (defaults to 2)
+       * *buffer*    - number of cells added on either side of flagged
+         cells (defaults to 4)
+       * *regrid*    - number of coarse steps between regrids
+         (defaults to 2)
+       * *subcycle*  - subcycle the finer levels in time (defaults to
+         True)
+       * *cfl*       - CFL number of adaptive time steps (or None)
+
+       Level l has *ratio* ** l times as many cells as the coarsest
+       level, and consists of disjoint patches of contiguous cells
+       (see Patch) that are aligned with the cells of the next
+       coarser level and properly nested in its patches.  Each patch
+       is evolved by its own solver, built by calling the factory as
+       ``factory(grid, level)``, which should return a
+       pyblaw.solver.Solver over the same *times* (eg, with a
+       pyblaw.uniformweno.UniformWENOReconstructor, or see
+       WENOCLAWFactory).  Its reconstructor must use ghost cells, its
+       flux must compute interface fluxes (eg, pyblaw.flux.LFFlux),
+       and its *boundary* (if any) is used at the ends of the whole
+       domain (periodic boundary conditions are not supported).  The
+       dumpers and times of the patch solvers are not used.
+
+       Every *regrid* coarse steps (and initially), the cells of each
+       level are flagged by the *criterion*, called as
+       ``criterion(q, scale=scale, level=level)`` with the cell
+       averages of a patch and the range of each component over the
+       coarsest level.  The flagged cells, and *buffer* cells on
+       either side, are covered by the patches of the next level.
+       The cell averages of new fine cells are copied from the old
+       patches where possible, and prolonged from the coarser level
+       otherwise (see *prolong*); initially, they are the initial
+       conditions of the system.
+
+       Each coarse step advances the levels recursively: each patch
+       of a level is evolved, its ghost cells being filled from its
+       parent patch (see PatchBoundary), then the next level is
+       advanced with *ratio* steps of a *ratio* times smaller time
+       step if *subcycle* is True (or with one step of the same time
+       step otherwise).  The fine cell averages are then restricted
+       onto the coarse cells they cover, and the coarse cells next
+       to each fine patch are corrected with the difference of the
+       (time integrated) coarse and fine numerical fluxes through the
+       ends of the patch (see FluxRegister), so that the scheme is
+       conservative.
+
+       If *cfl* is given, the time steps are adaptive (see
+       pyblaw.solver.Solver), and follow the finest level if
+       *subcycle* is False.  Otherwise each interval between *times*
+       is one coarse step, which must then be stable on the finest
+       level if *subcycle* is False.
+
+       After *run*, the cell averages of the composite grid (the
+       finest cells available everywhere) are stored in *q*, its
+       boundaries in *x* and the level of each cell in *level*.  The
+       number of cell updates relative to those of a uniform grid as
+       fine as the finest level is stored in *work*.
+
+    """
+
+    def __init__(self, factory, x, times, criterion, levels=2, ratio=2,
+                 buffer=4, regrid=2, subcycle=True, cfl=None):
+
+        self.factory   = factory
+        self.x         = np.asarray(x, dtype=np.float64)
+        self.times     = np.asarray(times, dtype=np.float64)
+        self.criterion = criterion
+        self.maxlevels = levels
+        self.ratio     = ratio
+        self.buffer    = buffer
+        self.regrid_every = regrid
+        self.subcycle  = subcycle
+        self.cfl       = cfl
+
+        dx = np.diff(self.x)
+        if abs(dx - dx[0]).max() > 1e-10 * abs(dx[0]):
+            raise ValueError, 'AMRSolver requires a uniform coarse grid'
+
+        self.N0 = len(self.x) - 1
+        self.dx = [ dx[0] / ratio**l for l in range(levels) ]
+
+
+    ####################################################################
+    # patches
+    #
+
+    def size(self, level):
+        """Return the number of cells of (the whole) *level*."""
+
+        return self.N0 * self.ratio**level
+
+    def create(self, level, lo, hi, parent, t, initial=False):
+        """Create and return the patch of cells *lo* to *hi*-1 of
+        *level* at time *t*."""
+
+        r = self.ratio
+        x = self.x[0] + self.dx[level] * np.arange(lo, hi+1)
+
+        patch  = Patch(level, lo, hi, parent, r, self.size(level))
+        solver = self.factory(pyblaw.grid.Grid(x), level)
+
+        solver.dumper = None
+        if parent is not None:
+            solver.boundary = PatchBoundary(patch, solver.boundary)
+
+        if not initial:
+            q = prolong(parent.cells(lo/r - 1, hi/r + 1, t), r)
+            for old in self.patches[level]:
+                a, b = max(lo, old.lo), min(hi, old.hi)
+                if a < b:
+                    q[a-lo:b-lo] = old.q[a-old.lo:b-old.lo]
+            solver.initial_state = q
+
+        solver.initialise_and_allocate()
+        patch.set_solver(solver, t)
+
+        return patch
+
+    def scale(self):
+        """Return the range of each component over the coarsest
+        level."""
+
+        q = self.patches[0][0].q
+
+        return np.maximum(q.max(axis=0) - q.min(axis=0), np.finfo(np.float64).tiny)
+
+    def boxes(self, level):
+        """Return the (lo, hi, parent) cell ranges (within *level*) of
+        the patches of the next level."""
+
+        nest  = self.nest
+        N     = self.size(level)
+        scale = self.scale()
+
+        boxes = []
+        for patch in self.patches[level]:
+            flags = self.criterion(patch.q, scale=scale, level=level)
+            flags = pyblaw.evolver.dilate(flags, self.buffer)
+
+            # proper nesting
+            if patch.lo > 0:
+                flags[:nest] = False
+            if patch.hi < N:
+                flags[-nest:] = False
+
+            merged = []
+            for lo, hi in pyblaw.evolver.cell_ranges(flags):
+                lo, hi = patch.lo + lo, patch.lo + hi
+                if lo < nest:
+                    lo = 0
+                if hi > N - nest:
+                    hi = N
+
+                if merged and lo - merged[-1][1] < nest:
+                    merged[-1] = (merged[-1][0], hi)
+                else:
+                    merged.append((lo, hi))
+
+            boxes.extend([ (lo, hi, patch) for lo, hi in merged ])
+
+        return boxes
+
+    def regrid(self, t, initial=False):
+        """Rebuild the patches of the finer levels at time *t*."""
+
+        r = self.ratio
+
+        for level in range(self.maxlevels - 1):
+            patches = []
+            for lo, hi, parent in self.boxes(level):
+                lo, hi = lo*r, hi*r
+
+                same = [ p for p in self.patches[level+1] if (p.lo, p.hi) == (lo, hi) ]
+                if same:
+                    same[0].parent = parent
+                    patches.append(same[0])
+                else:
+                    patches.append(self.create(level+1, lo, hi, parent, t, initial))
+
+            for parent in self.patches[level]:
+                parent.set_children([ p for p in patches if p.parent is parent ])
+
+            self.patches[level+1] = patches
+
+        for patch in self.patches[-1]:
+            patch.set_children([])
+
+    def initialise(self):
+        """Create the coarsest level and refine the initial
+        conditions."""
+
+        t0 = self.times[0]
+
+        root = self.create(0, 0, self.N0, None, t0, initial=True)
+        self.patches = [ [ root ] ] + [ [] for l in range(self.maxlevels - 1) ]
+
+        g = max(root.solver.reconstructor.ghosts, 1)
+        self.nest = max(-(-g / self.ratio) + 1, 2)
+
+        self.regrid(t0, initial=True)
+
+        for level in reversed(range(self.maxlevels - 1)):
+            self.synchronise(level, reflux=False)
+
+
+    ####################################################################
+    # stepping
+    #
+
+    def finest(self):
+        """Return the finest level that has patches."""
+
+        return max([ l for l in range(self.maxlevels) if self.patches[l] ])
+
+    def time_step(self, tau, n):
+        """Return the coarse time step from *tau* (within interval
+        *n*), and whether it reaches the next time (see *cfl*)."""
+
+        dt = self.times[n+1] - tau
+        if self.cfl is None:
+            return dt, True
+
+        speed = 0.0
+        for patches in self.patches:
+            for patch in patches:
+                s = patch.solver.system.wave_speed(patch.q)
+                if s is None:
+                    raise ValueError, 'adaptive time steps require the wave speed of the system'
+                speed = max(speed, s)
+
+        dx = self.dx[0]
+        if not self.subcycle:
+            dx = self.dx[self.finest()]
+
+        steps = 1
+        if speed > 0.0:
+            steps = max(1, int(np.ceil(dt * speed / (self.cfl * dx))))
+
+        return dt / steps, steps == 1
+
+    def advance(self, level, t, dt):
+        """Advance *level* (and the finer levels) from *t* to *t* +
+        *dt*."""
+
+        for patch in self.patches[level]:
+            patch.step(t, dt)
+            self.updates += patch.N
+
+        if level + 1 < self.maxlevels and self.patches[level+1]:
+            steps = self.ratio if self.subcycle else 1
+            for s in range(steps):
+                self.advance(level + 1, t + s * dt / steps, dt / steps)
+
+            self.synchronise(level)
+
+    def synchronise(self, level, reflux=True):
+        """Restrict the patches of the next level onto *level*, and
+        correct the fluxes through their ends (see *advance*)."""
+
+        r = self.ratio
+        N = self.size(level + 1)
+
+        for parent in self.patches[level]:
+            for j, child in enumerate(parent.children):
+                lo, hi = child.lo/r - parent.lo, child.hi/r - parent.lo
+
+                parent.q[lo:hi] = restrict(child.q, r)
+
+                if reflux:
+                    a  = parent.active
+                    Fc = parent.register.F[2+2*j:4+2*j]
+                    Ff = child.register.F[:2]
+
+                    if child.lo > 0:
+                        parent.q[lo-1,a] += (Fc[0] - Ff[0])[a] / parent.dx
+                    if child.hi < N:
+                        parent.q[hi,a]   -= (Fc[1] - Ff[1])[a] / parent.dx
+
+                child.register.F[:2] = 0.0
+
+
+    ####################################################################
+    # run
+    #
+
+    def run(self):
+        """Run the solver and return the composite cell averages."""
+
+        self.initialise()
+        self.updates = 0
+        self.steps   = 0
+
+        T = self.times
+        for n in range(len(T) - 1):
+            tau  = T[n]
+            last = False
+            while not last:
+                dt, last = self.time_step(tau, n)
+                self.advance(0, tau, dt)
+                tau = tau + dt
+
+                self.steps += 1
+                if self.steps % self.regrid_every == 0:
+                    self.regrid(tau)
+
+        # work relative to a uniform run on the finest level
+        L = self.maxlevels - 1
+        uniform = self.steps * self.size(L)
+        if self.subcycle:
+            uniform *= self.ratio**L
+        self.work = float(self.updates) / uniform
+
+        self.composite()
+
+        return self.q
+
+
+    def composite(self):
+        """Gather the cells of the composite grid (see *run*)."""
+
+        r = self.ratio
+
+        lefts  = []
+        q      = []
+        levels = []
+        for level, patches in enumerate(self.patches):
+            for patch in patches:
+                covered = np.zeros(patch.N, dtype=np.bool)
+                for child in patch.children:
+                    covered[child.lo/r-patch.lo:child.hi/r-patch.lo] = True
+
+                x = patch.solver.x
+                for lo, hi in pyblaw.evolver.cell_ranges(~covered):
+                    lefts.append(x[lo:hi])
+                    q.append(patch.q[lo:hi])
+                    levels.append(level * np.ones(hi - lo, dtype=np.int))
+
+        lefts  = np.concatenate(lefts)
+        order  = np.argsort(lefts)
+
+        self.x     = np.concatenate((lefts[order], self.x[-1:]))
+        self.q     = np.concatenate(q)[order]
+        self.level = np.concatenate(levels)[order]
+
+
+    def report(self):
+        """Return a summary of the AMR run."""
+
+        cells = [ sum([ p.N for p in patches ]) for patches in self.patches ]
+
+        return ("amr: %d steps, cells per level = %s, work = %.1f%% of a uniform fine run"
+                % (self.steps, cells, 100.0 * self.work))
+
+
+######################################################################
+
+class WENOCLAWFactory(object):
+    """Factory of WENO CLAW patch solvers with a per level cache.
+
+       **Arguments**
+
+       * *system*    - system
+       * *flux*      - flux dictionary (see
+         pyblaw.wenoclaw.PeriodicWENOCLAWLFSolver)
+       * *times*     - times
+       * *order*     - WENO reconstruction order (defaults to 3)
+       * *evolver*   - evolver or None (defaults to
+         pyblaw.evolver.SSPERK3)
+       * *boundary*  - boundary conditions (defaults to
+         pyblaw.boundary.OutflowBoundary)
+       * *directory* - cache directory (defaults to 'cache')
+       * *processes* - number of processes used to build caches
+
+       The factory is called as ``factory(grid, level)`` (see
+       AMRSolver) and returns a
+       pyblaw.wenoclaw.PeriodicWENOCLAWLFSolver whose ghost cells are
+       filled by the boundary conditions.  The system, evolver and
+       boundary conditions are copied for each patch.
+
+       The WENO coefficients of a uniform grid only depend on the
+       number of cells and the cell size, so the patches of a level
+       with the same number of cells share a cache, which is built
+       once (for a reference grid that starts at zero) and kept in
+       the cache store (see pyblaw.cache.CacheStore) of the level,
+       in the subdirectory ``levelL`` of *directory*.  Loaded caches
+       are kept in memory by the factory (see *loaded* and
+       pyblaw.cache.load), since regridding creates many patch
+       solvers.
+
+    """
+
+    def __init__(self, system, flux, times, order=3, evolver=None, boundary=None,
+                 directory='cache', processes=1):
+
+        self.system    = system
+        self.flux      = flux
+        self.times     = times
+        self.order     = order
+        self.evolver   = evolver
+        self.boundary  = boundary or pyblaw.boundary.OutflowBoundary()
+        self.directory = directory
+        self.processes = processes
+        self.stores    = {}
+        self.wenos     = {}
+
+    def store(self, level):
+        """Return the cache store of *level*."""
+
+        if level not in self.stores:
+            self.stores[level] = pyblaw.cache.CacheStore(
+                os.path.join(self.directory, 'level%d' % level))
+
+        return self.stores[level]
+
+    def loaded(self, level):
+        """Return the loaded WENO objects of *level*."""
+
+        return self.wenos.setdefault(level, {})
+
+    def __call__(self, grid, level):
+        N = grid.size
+        x = grid.boundaries()
+
+        # reference grid (rounded so that every patch of a level with
+        # N cells has the same key)
+        h = float('%.12g' % ((x[-1] - x[0]) / N))
+        y = h * np.arange(N+1)
+
+        solver = pyblaw.wenoclaw.PeriodicWENOCLAWLFSolver(
+            flux=self.flux, order=self.order,
+            system=copy.deepcopy(self.system),
+            evolver=copy.deepcopy(self.evolver),
+            boundary=copy.deepcopy(self.boundary),
+            store=self.store(level), loaded=self.loaded(level), format=None,
+            times=self.times)
+
+        if not solver.load_cache(y):
+            solver.build_cache(y, self.processes)
+
+        solver.grid = grid
+
+        return solver
@@ -7,13 +7,17 @@ class Base(object):
 
        **Instance variables**
 
-       * *trace* - trace level
+       * *trace*  - trace level
+       * *layout* - memory layout of (cell, component) arrays: 'C'
+         (cell-major) or 'F' (component-major)
 
        **Methods that can be overridden**
 
        * *allocate* - allocate memory etc
        * *pre_run*  - pre run initialisation
+       * *post_run* - post run clean up
        * *debug*    - debug
+       * *kernel*   - describe the compiled kernel (see pyblaw.cstep)
 
        **Methods**
 
@@ -21,10 +25,27 @@ class Base(object):
 
     trace = 0                           # trace level
     debug = {}                          # debug information
+    layout = 'C'                        # array layout
 
     def set_trace(self, trace_level):
         self.trace = trace_level
 
+    def set_layout(self, layout):
+        """Set the memory layout of (cell, component) arrays.
+
+        Arrays are always indexed as ``q[i,m]`` (cell i, component m),
+        but are stored cell-major ('C', ie, the components of each
+        cell are contiguous) or component-major ('F', ie, each
+        component ``q[:,m]`` is contiguous).  Pass ``order=self.layout``
+        when allocating such arrays.
+
+        """
+
+        if layout not in ('C', 'F'):
+            raise ValueError, 'unknown layout: %s' % layout
+
+        self.layout = layout
+
     def debug(self, **kwargs):
         """Perform any debugging checks (assertions) or display
         debugging information (this is called by the various PyBLAW
@@ -39,3 +60,31 @@ class Base(object):
         """Perform any last minute initialisations (this is called by
         the solver after the initial condtions have been set)."""
         pass
+
+    def post_run(self, **kwargs):
+        """Release any resources held for the run, eg, worker threads
+        (this is called by the solver at the end of each run)."""
+        pass
+
+    def kernel(self):
+        """Return the description (a tuple) of the compiled kernel
+        that is equivalent to this component, or None if there isn't
+        one (see pyblaw.solver.Solver regarding *compiled*)."""
+        return None
+
+
+def columns(components):
+    """Return an index that selects the columns *components* of an
+    array (a slice if *components* is None, empty or contiguous)."""
+
+    if components is None:
+        return slice(None)
+
+    components = list(components)
+    if not components:
+        return slice(0, 0)
+
+    if components == range(components[0], components[-1]+1):
+        return slice(components[0], components[-1]+1)
+
+    return components
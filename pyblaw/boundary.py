@@ -0,0 +1,292 @@
+"""PyBLAW abstract Boundary class and a few concrete boundary conditions.
+
+"""
+
+import numpy as np
+import pyblaw.base
+
+
+######################################################################
+
+class Boundary(pyblaw.base.Base):
+    """Abstract boundary conditions.
+
+       Fill the ghost cells on either side of the domain, and set the
+       exterior reconstructions at the ends of the domain.
+
+       Boundary conditions are applied by the reconstructor (see
+       pyblaw.reconstructor.Reconstructor.set_boundary):
+       reconstructors that use ghost cells call *fill* before
+       reconstructing, and all reconstructors call *close* after
+       reconstructing.  The ghost cells are filled in place and all
+       operations are vectorised across components, so that the
+       reconstruction, flux and source kernels can treat every cell
+       alike.
+
+       The MUSCL, uniform WENO and periodic WENO CLAW reconstructors
+       use ghost cells.  The (non-periodic) WENO CLAW reconstructor
+       (pyblaw.wenoclaw.WENOCLAWReconstructor) does not, since its
+       stencils are fixed by the WENO cache: only *close* is applied,
+       and the reconstructions of the cells near the ends are
+       one-sided.  Use pyblaw.wenoclaw.PeriodicWENOCLAWReconstructor
+       (whose cache includes ghost cells) to apply the ghost cell
+       fills with a WENO CLAW reconstructor.
+
+       The keyword arguments passed to *fill* and *close* are those of
+       the reconstructor, and contain the current time ``t`` and stage
+       time ``tau`` (see *time*).
+
+       **Instance variables pulled from elsewhere**
+
+       * *grid*   - pyblaw.grid.Grid
+       * *system* - pyblaw.system.System
+
+       **Methods that should be overridden**
+
+       * *fill_left*   - fill the ghost cells on the left
+       * *fill_right*  - fill the ghost cells on the right
+       * *close_left*  - set ``qm[0]`` given ``qp[0]``
+       * *close_right* - set ``qp[-1]`` given ``qm[-1]``
+
+       **Methods**
+
+    """
+
+    grid   = None
+    system = None
+
+    def set_grid(self, grid):
+        self.grid = grid
+
+    def set_system(self, system):
+        self.system = system
+
+    def time(self, kwargs):
+        """Return the (stage) time given the keyword arguments
+        *kwargs* of the reconstructor."""
+
+        return kwargs.get('tau', kwargs.get('t', 0.0))
+
+    def fill(self, qg, g, **kwargs):
+        """Fill the *g* ghost cells on either side of the ghost cell
+        padded cell averages *qg* (in place)."""
+
+        if g > 0:
+            self.fill_left(qg, g, **kwargs)
+            self.fill_right(qg, g, **kwargs)
+
+    def close(self, qm, qp, **kwargs):
+        """Set the exterior reconstructions ``qm[0]`` and ``qp[-1]`` at
+        the ends of the domain (in place)."""
+
+        self.close_left(qm, qp, **kwargs)
+        self.close_right(qm, qp, **kwargs)
+
+    def fill_left(self, qg, g, **kwargs):
+        raise NotImplementedError
+
+    def fill_right(self, qg, g, **kwargs):
+        raise NotImplementedError
+
+    def close_left(self, qm, qp, **kwargs):
+        raise NotImplementedError
+
+    def close_right(self, qm, qp, **kwargs):
+        raise NotImplementedError
+
+
+######################################################################
+
+class OutflowBoundary(Boundary):
+    """Outflow (zero gradient) boundary conditions.
+
+       The ghost cells are set to the end values, and the exterior
+       reconstructions are set to the interior reconstructions.
+
+    """
+
+    def kernel(self):
+        return ('outflow',)
+
+    def fill_left(self, qg, g, **kwargs):
+        qg[:g,:] = qg[g,:]
+
+    def fill_right(self, qg, g, **kwargs):
+        qg[-g:,:] = qg[-g-1,:]
+
+    def close_left(self, qm, qp, **kwargs):
+        qm[0,:] = qp[0,:]
+
+    def close_right(self, qm, qp, **kwargs):
+        qp[-1,:] = qm[-1,:]
+
+
+######################################################################
+
+class ReflectiveBoundary(Boundary):
+    """Reflective (solid wall) boundary conditions.
+
+       **Arguments**
+
+       * *odd* - components that change sign on reflection (eg, the
+         momentum)
+
+       The ghost cells are the mirror images of the interior cells,
+       and the exterior reconstructions are the mirror images of the
+       interior reconstructions.
+
+    """
+
+    def __init__(self, odd=[]):
+        self.odd  = list(odd)
+        self.sign = None
+
+    def allocate(self):
+        self.sign = np.ones(self.system.p)
+        self.sign[self.odd] = -1.0
+
+    def kernel(self):
+        return ('reflective', self.sign)
+
+    def fill_left(self, qg, g, **kwargs):
+        qg[:g,:] = self.sign * qg[2*g-1:g-1:-1,:]
+
+    def fill_right(self, qg, g, **kwargs):
+        N = qg.shape[0]
+        qg[N-g:,:] = self.sign * qg[N-g-1:N-2*g-1:-1,:]
+
+    def close_left(self, qm, qp, **kwargs):
+        qm[0,:] = self.sign * qp[0,:]
+
+    def close_right(self, qm, qp, **kwargs):
+        qp[-1,:] = self.sign * qm[-1,:]
+
+
+######################################################################
+
+class PeriodicBoundary(Boundary):
+    """Periodic boundary conditions."""
+
+    def kernel(self):
+        return ('periodic',)
+
+    def fill_left(self, qg, g, **kwargs):
+        qg[:g,:] = qg[-2*g:-g,:]
+
+    def fill_right(self, qg, g, **kwargs):
+        qg[-g:,:] = qg[g:2*g,:]
+
+    def close_left(self, qm, qp, **kwargs):
+        qm[0,:] = qm[-1,:]
+
+    def close_right(self, qm, qp, **kwargs):
+        qp[-1,:] = qp[0,:]
+
+
+######################################################################
+
+class InflowBoundary(Boundary):
+    """Inflow (prescribed state) boundary conditions.
+
+       **Arguments**
+
+       * *state*      - prescribed state (sequence), or a callable that
+         returns the prescribed state at time t (time-dependent
+         inflow)
+       * *components* - prescribed components (defaults to None, ie,
+         all)
+
+       The prescribed components of the ghost cells and the exterior
+       reconstructions are set to the prescribed state, and the other
+       components are extrapolated (as for OutflowBoundary).  If
+       *state* is callable, it is called as ``state(t)`` with the
+       stage time (see Boundary.time) and should return the full
+       state vector.
+
+    """
+
+    def __init__(self, state, components=None):
+        self.state = state
+        self.components = components
+
+    def value(self, **kwargs):
+        """Return the prescribed state."""
+
+        if callable(self.state):
+            return np.asarray(self.state(self.time(kwargs)), dtype=np.float64)
+
+        return np.asarray(self.state, dtype=np.float64)
+
+    def fill_left(self, qg, g, **kwargs):
+        c = pyblaw.base.columns(self.components)
+        qg[:g,:] = qg[g,:]
+        qg[:g,c] = self.value(**kwargs)[c]
+
+    def fill_right(self, qg, g, **kwargs):
+        c = pyblaw.base.columns(self.components)
+        qg[-g:,:] = qg[-g-1,:]
+        qg[-g:,c] = self.value(**kwargs)[c]
+
+    def close_left(self, qm, qp, **kwargs):
+        c = pyblaw.base.columns(self.components)
+        qm[0,:] = qp[0,:]
+        qm[0,c] = self.value(**kwargs)[c]
+
+    def close_right(self, qm, qp, **kwargs):
+        c = pyblaw.base.columns(self.components)
+        qp[-1,:] = qm[-1,:]
+        qp[-1,c] = self.value(**kwargs)[c]
+
+
+######################################################################
+
+class MixedBoundary(Boundary):
+    """Different boundary conditions on either side of the domain.
+
+       **Arguments**
+
+       * *left*  - boundary conditions on the left (Boundary)
+       * *right* - boundary conditions on the right (Boundary)
+
+       For example, ``MixedBoundary(InflowBoundary(q_in),
+       OutflowBoundary())``.
+
+    """
+
+    def __init__(self, left, right):
+        self.left  = left
+        self.right = right
+
+    def set_grid(self, grid):
+        self.grid = grid
+        self.left.set_grid(grid)
+        self.right.set_grid(grid)
+
+    def set_system(self, system):
+        self.system = system
+        self.left.set_system(system)
+        self.right.set_system(system)
+
+    def allocate(self):
+        self.left.allocate()
+        self.right.allocate()
+
+    def pre_run(self, **kwargs):
+        self.left.pre_run(**kwargs)
+        self.right.pre_run(**kwargs)
+
+    def post_run(self, **kwargs):
+        self.left.post_run(**kwargs)
+        self.right.post_run(**kwargs)
+
+    def fill_left(self, qg, g, **kwargs):
+        self.left.fill_left(qg, g, **kwargs)
+
+    def fill_right(self, qg, g, **kwargs):
+        self.right.fill_right(qg, g, **kwargs)
+
+    def close_left(self, qm, qp, **kwargs):
+        self.left.close_left(qm, qp, **kwargs)
+
+    def close_right(self, qm, qp, **kwargs):
+        self.right.close_right(qm, qp, **kwargs)
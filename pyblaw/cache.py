@@ -0,0 +1,603 @@
+"""PyBLAW WENO cache store.
+
+"""
+
+import cPickle
+import fnmatch
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import h5py
+import pyweno.grid
+import pyweno.weno
+
+
+######################################################################
+
+class CacheStore(object):
+    """Content-addressed WENO cache store.
+
+       **Arguments**
+
+       * *directory* - cache directory (defaults to 'cache')
+       * *size*      - size budget in bytes (None for no budget)
+
+       Cache entries are keyed by a hash of the grid boundaries, the
+       WENO order, the reconstruction points and the number of
+       (periodic) ghost cells.  Each entry consists of a WENO cache
+       file (``KEY.h5``) and a metadata file (``KEY.npz``).  The
+       metadata file is written once the cache has been built, and is
+       used to validate the entry when it is looked up: invalid or
+       incomplete entries are removed.
+
+       Entries are touched (their metadata file) when they are used,
+       and the least recently used entries are evicted when an entry
+       is committed and the store is larger than *size*.  The size of
+       an entry includes its memory-mapped export (``KEY.h5.mmap``,
+       see *load_mapped*), which is removed along with the entry.
+
+       A typical use is::
+
+         cache = store.lookup(x, k, points)
+         if cache is None:
+             cache = store.reserve(x, k, points)
+             # build and save the WENO cache to 'cache'
+             store.commit(x, k, points)
+
+    """
+
+    def __init__(self, directory='cache', size=None):
+        self.directory = directory
+        self.size = size
+
+
+    ####################################################################
+    # keys and paths
+    #
+
+    def key(self, x, order, points, ghosts=0):
+        """Return the key of the cache for the grid boundaries *x*,
+        WENO order *order*, reconstruction points *points*, and number
+        of ghost cells *ghosts*."""
+
+        sha = hashlib.sha1()
+        sha.update(np.ascontiguousarray(x, dtype=np.float64).tostring())
+        sha.update(repr((int(order), tuple(points), int(ghosts))))
+
+        return sha.hexdigest()
+
+    def path(self, key):
+        """Return the cache file name of entry *key*."""
+        return os.path.join(self.directory, key + '.h5')
+
+    def meta_path(self, key):
+        """Return the metadata file name of entry *key*."""
+        return os.path.join(self.directory, key + '.npz')
+
+
+    ####################################################################
+    # lookup and build
+    #
+
+    def lookup(self, x, order, points, ghosts=0):
+        """Return the cache file name of a valid entry, or None."""
+
+        key  = self.key(x, order, points, ghosts)
+        meta = self.meta_path(key)
+
+        if not (os.access(self.path(key), os.F_OK) and os.access(meta, os.F_OK)):
+            return None
+
+        try:
+            m = np.load(meta)
+            valid = (int(m['order']) == int(order)
+                     and int(m['ghosts']) == int(ghosts)
+                     and list(m['points']) == list(points)
+                     and m['x'].shape == np.shape(x)
+                     and np.all(m['x'] == x))
+        except:
+            valid = False
+
+        if not valid:
+            self.remove(key)
+            return None
+
+        self.touch(key)
+
+        return self.path(key)
+
+    def reserve(self, x, order, points, ghosts=0):
+        """Return the cache file name that a new entry should be built
+        in (see *commit*)."""
+
+        if not os.access(self.directory, os.F_OK):
+            os.makedirs(self.directory)
+
+        key = self.key(x, order, points, ghosts)
+        if os.access(self.meta_path(key), os.F_OK):
+            os.remove(self.meta_path(key))
+
+        return self.path(key)
+
+    def commit(self, x, order, points, ghosts=0):
+        """Mark the (freshly built) entry as valid and evict least
+        recently used entries if necessary."""
+
+        key = self.key(x, order, points, ghosts)
+        np.savez(self.meta_path(key),
+                 x=np.asarray(x, dtype=np.float64),
+                 order=int(order),
+                 points=np.array(points),
+                 ghosts=int(ghosts))
+
+        self.evict(keep=key)
+
+
+    ####################################################################
+    # eviction
+    #
+
+    def touch(self, key):
+        """Mark entry *key* as recently used.
+
+           Only the metadata file is touched: the modification time of
+           the cache file is left alone, since it marks the version of
+           the cache (see *load*).
+
+        """
+
+        if os.access(self.meta_path(key), os.F_OK):
+            os.utime(self.meta_path(key), None)
+
+    def remove(self, key):
+        """Remove entry *key* (and its memory-mapped export)."""
+
+        path = self.path(key)
+        for name in (self.meta_path(key), path, path + '.sha1'):
+            if os.access(name, os.F_OK):
+                os.remove(name)
+
+        if os.access(path + '.mmap', os.F_OK):
+            shutil.rmtree(path + '.mmap', ignore_errors=True)
+
+    def entries(self):
+        """Return a list of (last used, size, key) tuples of all
+        entries in the store."""
+
+        entries = []
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext != '.npz':
+                continue
+
+            size = (_size(self.meta_path(key)) + _size(self.path(key))
+                    + _size(self.path(key) + '.mmap'))
+
+            entries.append((os.path.getmtime(self.meta_path(key)), size, key))
+
+        return entries
+
+    def evict(self, keep=None):
+        """Evict least recently used entries (but not *keep*) until the
+        store is smaller than its size budget."""
+
+        if self.size is None:
+            return
+
+        entries = sorted(self.entries())
+        total = sum([ size for used, size, key in entries ])
+
+        for used, size, key in entries:
+            if total <= self.size:
+                break
+            if key == keep:
+                continue
+
+            self.remove(key)
+            total = total - size
+
+
+def _size(path):
+    """Return the size of the file or directory *path* in bytes (0 if
+    it does not exist)."""
+
+    if os.path.isdir(path):
+        return sum([ os.path.getsize(os.path.join(root, name))
+                     for root, dirs, names in os.walk(path)
+                     for name in names ])
+
+    if os.access(path, os.F_OK):
+        return os.path.getsize(path)
+
+    return 0
+
+
+######################################################################
+
+# HDF5 paths (fnmatch patterns) in a PyWENO cache of the datasets that
+# are indexed by cell or cell boundary, and of the attributes that hold
+# the number of cells (see build)
+cell_datasets   = [ 'grid/*', 'smoothness/*', 'weights/*', 'reconstruction/*' ]
+cell_attributes = [ 'N', 'grid/N' ]
+
+def build(x, order, points, cache, processes=None, blocks=None):
+    """Build a WENO cache in parallel.
+
+       **Arguments**
+
+       * *x*         - grid boundaries
+       * *order*     - WENO order
+       * *points*    - reconstruction points (eg, ('left', 'right'))
+       * *cache*     - cache file name
+       * *processes* - number of processes (defaults to the number of
+         cores)
+       * *blocks*    - number of cell blocks per reconstruction point
+         (defaults to the number of processes)
+
+       Each reconstruction point, and each contiguous block of cells
+       within each point, is precomputed by a separate task in a
+       process pool.  Each task builds a WENO object on a sub-grid
+       that is padded by *order* cells on either side (so that the
+       reconstruction stencils of the block are the same as on the
+       full grid) and caches it to a temporary file.  The temporary
+       files are then assembled into a single HDF5 cache.
+
+       The datasets of the (HDF5) cache that are indexed by cell (or
+       cell boundary) along their first axis are named by
+       *cell_datasets*, and the attributes that hold the number of
+       cells are named by *cell_attributes*.  The other datasets and
+       attributes must be the same in every part.  See *verify* to
+       compare an assembled cache with a serially built one.
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    N = x.size - 1
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if blocks is None:
+        blocks = processes
+    blocks = max(1, min(blocks, N / (4*order)))
+
+    # split cells into blocks and create tasks
+    edges = [ N*b/blocks for b in range(blocks+1) ]
+
+    tasks = []
+    for point in points:
+        for b in range(blocks):
+            lo, hi = edges[b], edges[b+1]
+            ilo, ihi = max(lo-order, 0), min(hi+order, N)
+            part = '%s.%d.part' % (cache, len(tasks))
+            tasks.append((x[ilo:ihi+1], order, point, part, lo, hi, lo-ilo))
+
+    # build parts
+    pool = multiprocessing.Pool(processes)
+    try:
+        parts = pool.map(_build_part, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    # assemble
+    _assemble(cache, N, parts)
+
+
+def _build_part(task):
+    """Build (and cache) one part of a WENO cache."""
+
+    x, order, point, part, lo, hi, offset = task
+
+    grid = pyweno.grid.Grid(x)
+    weno = pyweno.weno.WENO(grid=grid, order=order)
+    weno.precompute_reconstruction(point)
+    weno.cache(part)
+
+    return (part, lo, hi, offset, x.size - 1)
+
+
+def _match(name, patterns):
+    """Return True if the HDF5 path *name* matches one of *patterns*."""
+
+    return any([ fnmatch.fnmatchcase(name, pattern) for pattern in patterns ])
+
+
+def _assemble(cache, N, parts):
+    """Assemble cache *parts* into the cache file *cache*."""
+
+    hdf = h5py.File(cache, 'w')
+
+    def copy_attrs(name, src, dst, n):
+        for key, value in src.attrs.iteritems():
+            if _match(name + key, cell_attributes):
+                dst.attrs[key] = value - n + N
+            elif key not in dst.attrs:
+                dst.attrs[key] = value
+            elif np.any(dst.attrs[key] != value):
+                raise ValueError, 'attribute %s%s differs between cache parts' % (name, key)
+
+    for part, lo, hi, offset, n in parts:
+        phdf = h5py.File(part, 'r')
+
+        def copy(name, obj):
+            if isinstance(obj, h5py.Group):
+                copy_attrs(name + '/', obj, hdf.require_group(name), n)
+                return
+
+            if _match(name, cell_datasets):
+                extra = obj.shape[0] - n
+                if extra not in (0, 1):
+                    raise ValueError, 'dataset %s is not indexed by cell' % name
+                if name not in hdf:
+                    hdf.create_dataset(name, (N+extra,) + obj.shape[1:], dtype=obj.dtype)
+                hdf[name][lo:hi+extra] = obj[offset:offset+hi-lo+extra]
+            elif name not in hdf:
+                hdf.create_dataset(name, data=obj[()])
+            elif hdf[name].shape != obj.shape or np.any(hdf[name][()] != obj[()]):
+                raise ValueError, 'dataset %s differs between cache parts' % name
+
+            copy_attrs(name + '/', obj, hdf[name], n)
+
+        phdf.visititems(copy)
+        copy_attrs('', phdf, hdf, n)
+
+        phdf.close()
+        os.remove(part)
+
+    hdf.close()
+
+
+def verify(x, order, points, processes=None, blocks=None):
+    """Return True if a WENO cache built by *build* is the same as one
+    built serially.
+
+       **Arguments**
+
+       * *x*         - grid boundaries
+       * *order*     - WENO order
+       * *points*    - reconstruction points (eg, ('left', 'right'))
+       * *processes* - number of processes (see *build*)
+       * *blocks*    - number of cell blocks per point (see *build*)
+
+       Both caches are built in a temporary directory, and every
+       dataset and attribute is compared.  This checks *cell_datasets*
+       and *cell_attributes* against the installed version of PyWENO
+       (a small non-uniform grid is enough).
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    directory = tempfile.mkdtemp()
+
+    try:
+        serial = os.path.join(directory, 'serial.h5')
+        weno = pyweno.weno.WENO(grid=pyweno.grid.Grid(x), order=order)
+        for point in points:
+            weno.precompute_reconstruction(point)
+        weno.cache(serial)
+        del weno
+
+        parallel = os.path.join(directory, 'parallel.h5')
+        build(x, order, points, parallel, processes, blocks)
+
+        a = h5py.File(serial, 'r')
+        b = h5py.File(parallel, 'r')
+        same = _equal(a, b)
+        a.close()
+        b.close()
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return same
+
+
+def _equal(a, b):
+    """Return True if the HDF5 files *a* and *b* hold the same
+    datasets and attributes."""
+
+    names, other = [], []
+    a.visit(names.append)
+    b.visit(other.append)
+
+    if sorted(names) != sorted(other):
+        return False
+
+    for name in [ '/' ] + names:
+        src, dst = a[name], b[name]
+
+        if isinstance(src, h5py.Dataset):
+            if src.shape != dst.shape or np.any(src[()] != dst[()]):
+                return False
+
+        if sorted(src.attrs.keys()) != sorted(dst.attrs.keys()):
+            return False
+
+        for key in src.attrs.keys():
+            if np.any(src.attrs[key] != dst.attrs[key]):
+                return False
+
+    return True
+
+
+######################################################################
+
+memoize = False                         # reuse loaded WENO objects
+_loaded = {}                            # loaded WENO objects
+
+def load(cache, order, mmap=False, loaded=None):
+    """Return a WENO object loaded from a cache.
+
+       **Arguments**
+
+       * *cache*  - cache file name
+       * *order*  - WENO order
+       * *mmap*   - memory-map the cache (see *load_mapped*)
+       * *loaded* - dictionary of loaded WENO objects or None
+
+       If the module variable *memoize* is True, WENO objects are kept
+       once loaded and are reused by subsequent loads of the same cache
+       (in this process) unless the contents of the cache file have
+       changed (see *digest*).  This keeps caches warm when many short
+       runs are performed by one process (see pyblaw.sweep), even if
+       the cache is looked up in a CacheStore before each run.  If
+       *loaded* is given, WENO objects
+       are kept in (and reused from) *loaded* instead, regardless of
+       *memoize*.
+
+    """
+
+    key = (os.path.abspath(cache), int(order), bool(mmap))
+
+    if loaded is None and memoize:
+        loaded = _loaded
+
+    if loaded is not None:
+        version = digest(cache)
+        if key in loaded and loaded[key][0] == version:
+            return loaded[key][1]
+
+    if mmap:
+        weno = load_mapped(cache, order)
+    else:
+        weno = pyweno.weno.WENO(order=order, cache=cache)
+
+    if loaded is not None:
+        loaded[key] = (version, weno)
+
+    return weno
+
+
+def digest(cache):
+    """Return the SHA-1 digest of the contents of the cache file
+    *cache*.
+
+       The digest identifies the version of the cache (see
+       *load_mapped*).  It is kept in the file ``cache.sha1`` along
+       with the size and modification time of the cache, so that it
+       is only computed again when the cache is rebuilt.
+
+    """
+
+    info  = os.stat(cache)
+    stamp = '%d %r' % (info.st_size, info.st_mtime)
+    name  = cache + '.sha1'
+
+    try:
+        f = open(name, 'r')
+        lines = f.read().split()
+        f.close()
+        if ' '.join(lines[:2]) == stamp:
+            return lines[2]
+    except (IOError, IndexError):
+        pass
+
+    sha = hashlib.sha1()
+    f = open(cache, 'rb')
+    for block in iter(lambda: f.read(1 << 20), ''):
+        sha.update(block)
+    f.close()
+
+    # write the digest atomically (other processes may be reading it)
+    try:
+        tmp = '%s.%d.tmp' % (name, os.getpid())
+        f = open(tmp, 'w')
+        f.write('%s %s\n' % (stamp, sha.hexdigest()))
+        f.close()
+        os.rename(tmp, name)
+    except (IOError, OSError):
+        pass
+
+    return sha.hexdigest()
+
+
+def load_mapped(cache, order):
+    """Return a WENO object whose tables are memory-mapped.
+
+       **Arguments**
+
+       * *cache* - cache file name
+       * *order* - WENO order
+
+       The first time a cache is loaded this way, the WENO object is
+       loaded from the cache and exported to a subdirectory of
+       ``cache.mmap`` named after the digest of the cache (see *digest*
+       and *export_mapped*).  Subsequent loads (by any process) of
+       the same cache memory-map the exported tables copy-on-write,
+       so that concurrent solvers on a node share one physical copy
+       of the tables (through the page cache) and start almost
+       instantly.
+       Putting the cache in a RAM-backed directory (eg, /dev/shm)
+       avoids disk I/O altogether.
+
+       If the cache file is rebuilt, it is exported again to a new
+       subdirectory.  Published exports are never removed (other
+       solvers may still be mapping them), so old subdirectories of
+       ``cache.mmap`` can be removed by hand once no solver uses them.
+
+    """
+
+    directory = os.path.join(cache + '.mmap', '%s-%d' % (digest(cache), order))
+    skeleton  = os.path.join(directory, 'weno.pickle')
+
+    if not os.access(skeleton, os.F_OK):
+        weno = pyweno.weno.WENO(order=order, cache=cache)
+        export_mapped(weno, directory)
+        del weno
+
+    def persistent_load(name):
+        return np.load(os.path.join(directory, name), mmap_mode='c')
+
+    f = open(skeleton, 'rb')
+    unpickler = cPickle.Unpickler(f)
+    unpickler.persistent_load = persistent_load
+    weno = unpickler.load()
+    f.close()
+
+    return weno
+
+
+def export_mapped(weno, directory):
+    """Export the WENO object *weno* to *directory*.
+
+       The arrays held by *weno* are saved as ``.npy`` files, and the
+       rest of the object is pickled (to ``weno.pickle``) with
+       references to the saved arrays.  The export is written to a
+       temporary directory and renamed, so that concurrent exports
+       are safe: if *directory* already exists (eg, another process
+       exported first), it is kept and the new export is discarded.
+
+    """
+
+    tmp = '%s.%d.tmp' % (directory, os.getpid())
+    os.makedirs(tmp)
+
+    names = {}
+    def persistent_id(obj):
+        if isinstance(obj, np.ndarray) and obj.dtype != object:
+            if id(obj) not in names:
+                name = '%d.npy' % len(names)
+                np.save(os.path.join(tmp, name), obj)
+                names[id(obj)] = (name, obj)
+            return names[id(obj)][0]
+        return None
+
+    f = open(os.path.join(tmp, 'weno.pickle'), 'wb')
+    pickler = cPickle.Pickler(f, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump(weno)
+    f.close()
+
+    if os.access(directory, os.F_OK):
+        shutil.rmtree(tmp, ignore_errors=True)  # already exported
+        return
+
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another process won
@@ -0,0 +1,470 @@
+"""PyBLAW domain decomposition.
+
+"""
+
+import multiprocessing
+import traceback
+import Queue
+import numpy as np
+
+import h5py
+import pyblaw.boundary
+import pyblaw.grid
+
+
+######################################################################
+
+class SharedMemoryCommunicator(object):
+    """Local (shared memory) stand-in for an MPI communicator.
+
+       **Arguments**
+
+       * *size*  - number of processes
+       * *count* - maximum number of doubles per message
+
+       The communicator is created by the parent process before the
+       worker processes are started, and each worker calls *attach*
+       with its rank.  It implements the subset of the (mpi4py)
+       MPI communicator interface used by ExchangeBoundary:
+       *Get_rank*, *Get_size*, *Barrier* and *Sendrecv*.
+
+       *Sendrecv* must be called collectively (ie, by all processes
+       the same number of times), with tags 0 or 1.  Messages are
+       written to per-process mailboxes in shared memory, followed by
+       a barrier after which they are read.  The mailboxes are double
+       buffered (alternate calls use alternate buffers), so that one
+       barrier per exchange suffices.
+
+       If a process fails it should call *abort*, so that the other
+       processes do not wait forever at the next barrier.
+
+    """
+
+    PROC_NULL = -1
+
+    def __init__(self, size, count):
+        self.size  = size
+        self.count = count
+        self.rank  = None
+
+        self.mailboxes  = multiprocessing.RawArray('d', size*2*2*count)
+        self.waiting    = multiprocessing.RawValue('i', 0)
+        self.generation = multiprocessing.RawValue('i', 0)
+        self.aborted    = multiprocessing.RawValue('i', 0)
+        self.condition  = multiprocessing.Condition()
+
+    def attach(self, rank):
+        """Attach the calling process as *rank*."""
+
+        self.rank   = rank
+        self.parity = 0
+        self.boxes  = np.frombuffer(self.mailboxes, dtype=np.float64).reshape(
+            (self.size, 2, 2, self.count))
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def abort(self):
+        """Abort all processes waiting at (or arriving at) a barrier."""
+
+        with self.condition:
+            self.aborted.value = 1
+            self.condition.notify_all()
+
+    def Barrier(self):
+        with self.condition:
+            generation = self.generation.value
+
+            self.waiting.value += 1
+            if self.waiting.value == self.size:
+                self.waiting.value = 0
+                self.generation.value += 1
+                self.condition.notify_all()
+                return
+
+            while generation == self.generation.value:
+                if self.aborted.value:
+                    raise RuntimeError, 'communicator aborted'
+                self.condition.wait(1.0)
+
+    def Sendrecv(self, sendbuf, dest=-1, sendtag=0, recvbuf=None,
+                 source=-1, recvtag=0):
+
+        parity = self.parity
+        self.parity = 1 - parity
+
+        if dest != self.PROC_NULL:
+            data = np.ravel(sendbuf)
+            if data.size > self.count:
+                raise ValueError, 'message too large'
+            self.boxes[self.rank,sendtag,parity,:data.size] = data
+
+        self.Barrier()
+
+        if source != self.PROC_NULL:
+            recvbuf[...] = self.boxes[source,recvtag,parity,:recvbuf.size].reshape(recvbuf.shape)
+
+
+class MPICommunicator(object):
+    """Adapter for an mpi4py MPI communicator.
+
+       **Arguments**
+
+       * *comm* - mpi4py communicator (defaults to MPI.COMM_WORLD)
+
+    """
+
+    def __init__(self, comm=None):
+        from mpi4py import MPI
+
+        if comm is None:
+            comm = MPI.COMM_WORLD
+
+        self.comm = comm
+        self.PROC_NULL = MPI.PROC_NULL
+
+    def Get_rank(self):
+        return self.comm.Get_rank()
+
+    def Get_size(self):
+        return self.comm.Get_size()
+
+    def abort(self):
+        self.comm.Abort(1)
+
+    def Barrier(self):
+        self.comm.Barrier()
+
+    def Sendrecv(self, sendbuf, dest=-1, sendtag=0, recvbuf=None,
+                 source=-1, recvtag=0):
+        self.comm.Sendrecv(np.ascontiguousarray(sendbuf), dest=dest, sendtag=sendtag,
+                           recvbuf=recvbuf, source=source, recvtag=recvtag)
+
+
+######################################################################
+
+class ExchangeBoundary(pyblaw.boundary.Boundary):
+    """Subdomain boundary conditions.
+
+       **Arguments**
+
+       * *comm*     - communicator (see SharedMemoryCommunicator)
+       * *left*     - rank of the left neighbour (or comm.PROC_NULL)
+       * *right*    - rank of the right neighbour (or comm.PROC_NULL)
+       * *boundary* - boundary conditions at the ends of the (global)
+         domain (defaults to pyblaw.boundary.OutflowBoundary)
+
+       The ghost cells and exterior reconstructions at the ends of the
+       subdomain that are shared with a neighbour are received from
+       the neighbour: the ghost cells are the neighbour's interior
+       cells, and the exterior reconstructions are the neighbour's
+       (interior) reconstructions.  Hence both subdomains compute the
+       same numerical flux at the shared boundary, and the
+       decomposed scheme is conservative.
+
+    """
+
+    def __init__(self, comm, left, right, boundary=None):
+        self.comm  = comm
+        self.left  = left
+        self.right = right
+
+        if boundary is None:
+            boundary = pyblaw.boundary.OutflowBoundary()
+        self.boundary = boundary
+
+    def set_grid(self, grid):
+        self.grid = grid
+        self.boundary.set_grid(grid)
+
+    def set_system(self, system):
+        self.system = system
+        self.boundary.set_system(system)
+
+    def allocate(self):
+        self.boundary.allocate()
+        self.buf = {}
+
+    def pre_run(self, **kwargs):
+        self.boundary.pre_run(**kwargs)
+
+    def post_run(self, **kwargs):
+        self.boundary.post_run(**kwargs)
+
+    def buffer(self, rows):
+        """Return a receive buffer with *rows* rows."""
+
+        if rows not in self.buf:
+            self.buf[rows] = np.zeros((rows, self.system.p))
+
+        return self.buf[rows]
+
+    def exchange(self, first, last, head, tail):
+        """Send *first* to the left and *last* to the right, and
+        receive *tail* from the right and *head* from the left (if
+        there are neighbours)."""
+
+        comm = self.comm
+        null = comm.PROC_NULL
+
+        buf = self.buffer(tail.shape[0])
+        comm.Sendrecv(first, dest=self.left, sendtag=0,
+                      recvbuf=buf, source=self.right, recvtag=0)
+        if self.right != null:
+            tail[...] = buf
+
+        buf = self.buffer(head.shape[0])
+        comm.Sendrecv(last, dest=self.right, sendtag=1,
+                      recvbuf=buf, source=self.left, recvtag=1)
+        if self.left != null:
+            head[...] = buf
+
+    def fill(self, qg, g, **kwargs):
+        if g == 0:
+            return
+
+        null = self.comm.PROC_NULL
+        if self.left == null:
+            self.boundary.fill_left(qg, g, **kwargs)
+        if self.right == null:
+            self.boundary.fill_right(qg, g, **kwargs)
+
+        self.exchange(qg[g:2*g], qg[-2*g:-g], qg[:g], qg[-g:])
+
+    def close(self, qm, qp, **kwargs):
+        null = self.comm.PROC_NULL
+        if self.left == null:
+            self.boundary.close_left(qm, qp, **kwargs)
+        if self.right == null:
+            self.boundary.close_right(qm, qp, **kwargs)
+
+        self.exchange(qp[:1], qm[-1:], qm[:1], qp[-1:])
+
+
+######################################################################
+
+def partition(N, size):
+    """Return the cell index boundaries of *size* contiguous
+    subdomains of a grid with *N* cells."""
+
+    return [ N*r/size for r in range(size+1) ]
+
+
+def run_subdomain(factory, x, comm, periodic=False):
+    """Build and run the solver of the subdomain of the calling
+    process.
+
+       **Arguments**
+
+       * *factory*  - solver factory (see DecomposedSolver)
+       * *x*        - grid boundaries (of the whole domain)
+       * *comm*     - communicator
+       * *periodic* - connect the ends of the domain
+
+       This is called by each worker process of a DecomposedSolver,
+       and may be called directly by each process of an MPI job (with
+       an MPICommunicator).  Returns the solver and the cell index
+       boundaries of its subdomain.
+
+    """
+
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    edges = partition(len(x) - 1, size)
+    lo, hi = edges[rank], edges[rank+1]
+
+    solver = factory(pyblaw.grid.Grid(x[lo:hi+1]), rank)
+    if solver.cfl is not None:
+        raise ValueError, 'decomposed solvers do not support adaptive time steps'
+
+    left, right = rank - 1, rank + 1
+    if periodic:
+        left, right = left % size, right % size
+    if left < 0:
+        left = comm.PROC_NULL
+    if right >= size:
+        right = comm.PROC_NULL
+
+    solver.boundary = ExchangeBoundary(comm, left, right, solver.boundary)
+    solver.run()
+
+    return solver, lo, hi
+
+
+######################################################################
+
+class DecomposedSolver(object):
+    """Domain decomposed solver.
+
+       **Arguments**
+
+       * *factory*   - solver factory (callable)
+       * *x*         - grid boundaries
+       * *processes* - number of processes (subdomains), defaults to
+         the number of cores
+       * *periodic*  - connect the ends of the domain
+
+       The grid is split into *processes* contiguous subdomains, and
+       each subdomain is solved by a separate local process.  The
+       solver factory is called (in each process) as ``factory(grid,
+       rank)`` and should return a pyblaw.solver.Solver for the
+       subdomain *grid*.  Its reconstructor should use ghost cells
+       (eg, pyblaw.uniformweno.UniformWENOReconstructor or
+       pyblaw.muscl.MUSCLReconstructor), and its *boundary* (if any)
+       is used at the ends of the whole domain.
+       The subdomains take the same time steps, so adaptive time
+       steps (see pyblaw.solver.Solver) are not supported.
+       The subdomain ghost cells are exchanged with neighbouring
+       subdomains through shared memory (see ExchangeBoundary and
+       SharedMemoryCommunicator).
+
+       Each subdomain solver dumps its own slab of the solution, so
+       the factory should give each rank its own output file (eg,
+       ``'output.%d.h5' % rank``); see *merge* to assemble HDF5 dumps.
+       After *run*, the final solution of the whole domain is stored
+       in *q*.
+
+       The same factory can be used within an MPI job by calling
+       *run_subdomain* in each process with an MPICommunicator.
+
+    """
+
+    def __init__(self, factory, x, processes=None, periodic=False):
+        self.factory   = factory
+        self.x         = np.asarray(x, dtype=np.float64)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.periodic  = periodic
+
+
+    def run(self):
+        """Run the subdomain solvers and gather the final solution."""
+
+        N    = len(self.x) - 1
+        size = self.processes
+
+        # probe the number of unknowns and ghost cells
+        edges  = partition(N, size)
+        solver = self.factory(pyblaw.grid.Grid(self.x[edges[0]:edges[1]+1]), 0)
+        p      = solver.system.p
+        g      = max(solver.reconstructor.ghosts, 1)
+        del solver
+
+        if min(np.diff(edges)) < 2*g:
+            raise ValueError, 'too many subdomains for the ghost cell width'
+
+        comm   = SharedMemoryCommunicator(size, g*p)
+        result = multiprocessing.RawArray('d', N*p)
+        errors = multiprocessing.Queue()
+
+        workers = []
+        for rank in range(size):
+            worker = multiprocessing.Process(
+                target=_run_worker,
+                args=(self.factory, self.x, comm, rank, self.periodic, result, errors))
+            worker.start()
+            workers.append(worker)
+
+        # wait for the workers, draining the error queue as they run
+        # (a worker that has written to the queue may not exit until
+        # it is read).  If a worker dies without reporting (eg, it is
+        # killed by a signal), abort the communicator and terminate
+        # the other workers, which would otherwise wait for it at the
+        # next barrier.
+        failures = []
+        running  = list(workers)
+        while running:
+            failures.extend(_drain(errors))
+
+            for worker in running[:]:
+                if worker.exitcode is None:
+                    continue
+                running.remove(worker)
+
+                if worker.exitcode != 0:
+                    comm.abort()
+                    for other in running:
+                        other.terminate()
+
+            if running:
+                running[0].join(0.05)
+
+        for worker in workers:
+            worker.join()
+        failures.extend(_drain(errors))
+
+        for rank, worker in enumerate(workers):
+            if worker.exitcode != 0:
+                failures.append('rank %d: exited with code %d' % (rank, worker.exitcode))
+
+        if failures:
+            raise RuntimeError, 'subdomain solver failed:\n' + '\n'.join(failures)
+
+        self.q = np.frombuffer(result, dtype=np.float64).reshape((N, p)).copy()
+
+        return self.q
+
+
+def _drain(queue):
+    """Return the messages waiting in *queue*."""
+
+    messages = []
+    while True:
+        try:
+            messages.append(queue.get_nowait())
+        except Queue.Empty:
+            return messages
+
+
+def _run_worker(factory, x, comm, rank, periodic, result, errors):
+    """Run one subdomain of a DecomposedSolver."""
+
+    comm.attach(rank)
+
+    try:
+        solver, lo, hi = run_subdomain(factory, x, comm, periodic)
+
+        p = solver.system.p
+        q = np.frombuffer(result, dtype=np.float64).reshape((len(x) - 1, p))
+        q[lo:hi,:] = solver.q
+
+    except Exception:
+        errors.put('rank %d: %s' % (rank, traceback.format_exc()))
+        comm.abort()
+
+
+######################################################################
+
+def merge(parts, output):
+    """Merge the HDF5 dumps *parts* of consecutive subdomains (see
+    pyblaw.h5dumper.H5PYDumper) into the HDF5 file *output*.
+
+       Note that each subdomain is decimated (in space) separately, so
+       the merged grid is the union of the decimated subdomain grids.
+
+    """
+
+    hdfs = [ h5py.File(part, 'r') for part in parts ]
+    first = hdfs[0]
+
+    hdf = h5py.File(output, 'w')
+
+    sgrp = hdf.create_group('dims')
+    sgrp.create_dataset('xdim', data=np.concatenate([ h['dims/xdim'][...] for h in hdfs ]))
+    sgrp.create_dataset('tdim', data=first['dims/tdim'][...])
+
+    sgrp = hdf.create_group('parameters')
+    for key, value in first['parameters'].attrs.iteritems():
+        sgrp.attrs[key] = value
+
+    sgrp = hdf.create_group('data')
+    dset = sgrp.create_dataset('q', data=np.concatenate([ h['data/q'][...] for h in hdfs ], axis=-2))
+    for key, value in first['data/q'].attrs.iteritems():
+        dset.attrs[key] = value
+
+    hdf.close()
+    for h in hdfs:
+        h.close()
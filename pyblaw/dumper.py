@@ -13,6 +13,24 @@ class Dumper(object):
 
        Dump the cell averages q to a file.
 
+       **Keyword arguments**
+
+       * *components* - components of q to dump (defaults to all)
+       * *dtype*      - storage type (eg, 'float32' or 'float16',
+         defaults to *default_dtype*)
+       * *tolerance*  - absolute error bound for quantisation
+       * *decimate*   - spatial decimation stride (defaults to 1)
+
+       If *tolerance* is set, q is quantised and stored as integer
+       codes of type *dtype* (which must be an integer type, defaults
+       to 'int32') such that ``q ~ scale * code`` where ``scale = 2 *
+       tolerance``.  The transform applied to q is recorded in the
+       dump file (see *metadata*).
+
+       Ensembles (see pyblaw.ensemble) are dumped with an extra
+       ensemble axis, and *components* selects components of each
+       member.
+
        **Instance variables**
 
        * *x* - cell centers
@@ -20,8 +38,9 @@ class Dumper(object):
 
        **Methods that should be overridden**
 
-       * *init_dump* - init and create dump file etc
-       * *dump*      - dump solution q
+       * *init_dump*       - init and create dump file etc
+       * *dump*            - dump solution q
+       * *dump_reductions* - dump final reductions
 
        **Methods**
 
@@ -30,6 +49,28 @@ class Dumper(object):
     x = []
     t = []
 
+    components = None                   # components to dump
+    dtype      = None                   # storage type
+    default_dtype = 'float64'           # storage type if dtype is None
+    tolerance  = None                   # quantisation error bound
+    decimate   = 1                      # spatial decimation stride
+
+    def set_options(self, components=None, dtype=None, tolerance=None,
+                    decimate=1):
+        """Set the component selection, storage type, quantisation
+        tolerance and spatial decimation options."""
+
+        self.components = components
+        self.dtype      = dtype
+        self.tolerance  = tolerance
+        self.decimate   = int(decimate)
+
+        if self.decimate < 1:
+            raise ValueError, 'decimate must be a positive integer'
+
+        if self.tolerance is not None and self.storage_type().kind not in 'iu':
+            raise ValueError, 'quantisation (tolerance) requires an integer dtype'
+
     def set_system(self, system):
         self.system = system
 
@@ -37,6 +78,93 @@ class Dumper(object):
         self.x = x
         self.t = t
 
+    def xdim(self):
+        """Return the (decimated) cell centres."""
+
+        return self.x[::self.decimate]
+
+    def storage_type(self):
+        """Return the storage type of dumped data."""
+
+        if self.tolerance is not None:
+            return np.dtype(self.dtype or 'int32')
+
+        return np.dtype(self.dtype or self.default_dtype)
+
+    def members(self):
+        """Return the number of ensemble members."""
+
+        return self.system.members
+
+    def shape(self):
+        """Return the shape of the dumped data (including the time
+        dimension, and the ensemble dimension for ensembles)."""
+
+        M = self.members()
+
+        if self.components is None:
+            p = self.system.p / M
+        else:
+            p = len(self.components)
+
+        if M > 1:
+            return (len(self.t), M, len(self.xdim()), p)
+
+        return (len(self.t), len(self.xdim()), p)
+
+    def metadata(self):
+        """Return a dictionary describing the transform applied to q
+        before it is dumped."""
+
+        M = self.members()
+
+        if self.components is None:
+            components = range(self.system.p / M)
+        else:
+            components = self.components
+
+        meta = {
+            'components': np.array(components, dtype=int),
+            'decimate':   self.decimate,
+            'dtype':      self.storage_type().name,
+            }
+
+        if M > 1:
+            meta['members'] = M
+
+        if self.tolerance is not None:
+            meta['tolerance'] = self.tolerance
+            meta['scale']     = 2.0 * self.tolerance
+
+        return meta
+
+    def transform(self, q):
+        """Return the decimated, component selected, and quantised or
+        down-cast version of *q* to be dumped."""
+
+        M = self.members()
+        if M > 1:
+            q = q.reshape((q.shape[0], M, q.shape[1] / M)).swapaxes(0, 1)
+
+        if self.decimate > 1:
+            q = q[...,::self.decimate,:]
+
+        if self.components is not None:
+            q = q[...,self.components]
+
+        dtype = self.storage_type()
+
+        if self.tolerance is not None:
+            code = np.round(q / (2.0 * self.tolerance))
+            if abs(code).max() > np.iinfo(dtype).max:
+                raise ValueError, 'quantisation overflow (increase tolerance or use a wider dtype)'
+            return code.astype(dtype)
+
+        if dtype != q.dtype:
+            return q.astype(dtype)
+
+        return q
+
     def init_dump(self):
         """Initialise dumper instance, create dump file, etc."""
 
@@ -47,6 +175,12 @@ class Dumper(object):
 
         raise NotImplementedError
 
+    def dump_reductions(self, reductions):
+        """Dump *reductions* (dictionary of dictionaries, keyed by
+        reducer name, see pyblaw.reducer.Reducer)."""
+
+        raise NotImplementedError
+
 
 ######################################################################
 
@@ -60,35 +194,46 @@ class MATDumper(Dumper):
        * ``dims.tdim`` - dump times
        * ``parameters.X`` - parameters
        * ``data.q`` - cell averages of solution q
+       * ``transform.X`` - transform applied to q (see Dumper.metadata)
+       * ``reductions.R.X`` - final reductions (see pyblaw.reducer)
 
        The parameters are taken from the system (pyblaw.system.System).
 
-       **Note:** The H5Dumper in pyblaw.h5dumper is much more efficient.
+       **Note:** The H5Dumper in pyblaw.h5dumper is much more
+       efficient.  The MAT format does not support 'float16'.
 
        **Arguments**
 
        * *output* - output file name
 
+       Any keyword arguments are passed to *set_options* (see
+       pyblaw.dumper.Dumper).
+
     """
 
-    def __init__(self, output='output.mat'):
+    def __init__(self, output='output.mat', **kwargs):
 
         self.output = output
+        self.set_options(**kwargs)
 
     def init_dump(self):
 
         mat = {}
 
         # x and t dimensions
-        mat['dims.xdim'] = self.x
+        mat['dims.xdim'] = self.xdim()
         mat['dims.tdim'] = self.t
 
         # parameters
         for key in self.system.parameters:
             mat[key] = self.system.parameters[key]
 
+        # transform
+        for key, value in self.metadata().iteritems():
+            mat['transform.' + key] = value
+
         # data
-        mat['data.q'] = np.zeros((len(self.t), len(self.x), self.system.p))
+        mat['data.q'] = np.zeros(self.shape(), dtype=self.storage_type())
 
         # done
         sio.savemat(self.output, mat)
@@ -100,7 +245,17 @@ class MATDumper(Dumper):
         """Dump solution to MAT data file."""
 
         mat = sio.loadmat(self.output, struct_as_record=True)
-        mat['data.q'][self.last,:,:] = q[:,:]
+        mat['data.q'][self.last] = self.transform(q)
         sio.savemat(self.output, mat)
 
         self.last = self.last + 1
+
+
+    def dump_reductions(self, reductions):
+        """Dump reductions to MAT data file."""
+
+        mat = sio.loadmat(self.output, struct_as_record=True)
+        for name, result in reductions.iteritems():
+            for key, value in result.iteritems():
+                mat['reductions.' + name + '.' + key] = value
+        sio.savemat(self.output, mat)
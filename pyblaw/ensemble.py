@@ -0,0 +1,178 @@
+"""PyBLAW ensemble (batched) systems, fluxes and sources.
+
+"""
+
+import numpy as np
+
+import pyblaw.system
+
+
+######################################################################
+
+def rows(a, p):
+    """Return a ``(rows, p)`` view of the ensemble array *a* (eg, a
+    ``(N, M*p)`` array is viewed as an ``(N*M, p)`` array), or None if
+    the layout of *a* does not allow it (eg, component-major)."""
+
+    v = a.view()
+    try:
+        v.shape = (a.shape[0] * (a.shape[1] / p), p)
+    except AttributeError:
+        return None
+
+    return v
+
+
+######################################################################
+
+class EnsembleSystem(pyblaw.system.System):
+    """Ensemble of systems solved together.
+
+       **Arguments**
+
+       * *systems* - list of M member systems (pyblaw.system.System)
+         with the same number of unknowns p0
+
+       The members share the grid and all other components of the
+       solver (reconstructor, flux, source, evolver and WENO cache),
+       and are stored side by side in the cell averages: the
+       ensemble system has ``p = M*p0`` unknowns, and component j of
+       member m is stored in column ``m*p0 + j``.  As such, every
+       reconstructor, flux and evolver processes the whole ensemble
+       in each (vectorised) call.  The ``(M, N, p0)`` view of an
+       ensemble array is returned by *ensemble*.
+
+       Pointwise flux functions should be wrapped with PointwiseFlux,
+       and source functions with MemberSource.
+
+       Note that a shared smoothness *indicator* (see
+       pyblaw.wenoclaw.WENOCLAWReconstructor) would couple the
+       members and should not be used with ensembles.
+
+       The dumpers store ensembles with an extra ensemble axis (see
+       pyblaw.dumper.Dumper.shape).  The parameters are taken from the
+       first member, the 'mass' is the total mass of the members, and
+       the frozen components are those of the members.
+
+    """
+
+    def __init__(self, systems):
+        pyblaw.system.System.__init__(self, systems[0].parameters)
+
+        self.systems = systems
+        self.members = len(systems)
+        self.p0      = systems[0].p
+        self.p       = self.members * self.p0
+
+        for system in systems:
+            if system.p != self.p0:
+                raise ValueError, 'ensemble members must have the same number of unknowns'
+
+        self.frozen = [ m*self.p0 + j
+                        for m, system in enumerate(systems)
+                        for j in system.frozen ]
+
+    def member(self, q, m):
+        """Return the columns of member *m* of *q*."""
+
+        return q[...,m*self.p0:(m+1)*self.p0]
+
+    def ensemble(self, q):
+        """Return the ``(M, N, p0)`` view of the ``(N, M*p0)`` ensemble
+        array *q*."""
+
+        return q.reshape((q.shape[0], self.members, self.p0)).swapaxes(0, 1)
+
+    def set_grid(self, grid):
+        self.grid = grid
+        for system in self.systems:
+            system.set_grid(grid)
+
+    def allocate(self):
+        for system in self.systems:
+            system.allocate()
+
+    def pre_run(self, **kwargs):
+        for system in self.systems:
+            system.pre_run(**kwargs)
+
+    def post_run(self, **kwargs):
+        for system in self.systems:
+            system.post_run(**kwargs)
+
+    def initial_conditions(self, t, q):
+        for m, system in enumerate(self.systems):
+            system.initial_conditions(t, self.member(q, m))
+
+    def mass(self, q):
+        mass = 0.0
+        for m, system in enumerate(self.systems):
+            mass = mass + (system.mass(self.member(q, m)) or 0.0)
+        return mass
+
+
+######################################################################
+
+class PointwiseFlux(object):
+    """Ensemble wrapper for pointwise flux functions.
+
+       **Arguments**
+
+       * *flux* - pointwise flux function (see pyblaw.flux.LFFlux)
+       * *p*    - number of unknowns of each member
+
+       The ensemble arrays are viewed as ``(N*M, p)`` arrays so that
+       *flux* is called once for the whole ensemble, eg::
+
+         flux = pyblaw.flux.LFFlux(PointwiseFlux(f, p0), alpha)
+
+       If the arrays are stored component-major (see
+       pyblaw.solver.Solver), *flux* is called once per member.
+
+    """
+
+    def __init__(self, flux, p):
+        self.flux = flux
+        self.p = p
+
+    def __call__(self, q, f, **kwargs):
+        p  = self.p
+        qr = rows(q, p)
+        fr = rows(f, p)
+
+        if qr is not None and fr is not None:
+            self.flux(qr, fr, **kwargs)
+            return
+
+        for m in range(q.shape[1] / p):
+            self.flux(q[:,m*p:(m+1)*p], f[:,m*p:(m+1)*p], **kwargs)
+
+
+######################################################################
+
+class MemberSource(object):
+    """Ensemble wrapper for source functions.
+
+       **Arguments**
+
+       * *source* - source function (see pyblaw.source.SimpleSource)
+       * *p*      - number of unknowns of each member
+
+       Source functions typically depend on neighbouring cell
+       boundaries, so *source* is called once per member with (column)
+       views of the ensemble arrays, eg::
+
+         source = pyblaw.source.SimpleSource(MemberSource(s, p0))
+
+    """
+
+    def __init__(self, source, p):
+        self.source = source
+        self.p = p
+
+    def __call__(self, qm, qp, qq, dx, s, **kwargs):
+        p = self.p
+
+        for m in range(s.shape[1] / p):
+            c = slice(m*p, (m+1)*p)
+            self.source(qm[:,c], qp[:,c], qq[:,:,c], dx, s[:,c], **kwargs)
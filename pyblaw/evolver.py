@@ -4,6 +4,28 @@
 
 import numpy as np
 import pyblaw.base
+import pyblaw.cstep
+
+
+######################################################################
+
+def dilate(mask, width):
+    """Return the cells within *width* cells of a cell of *mask*."""
+
+    N = len(mask)
+    c = np.concatenate(([ 0 ], np.cumsum(mask)))
+    i = np.arange(N)
+
+    return c[np.minimum(i + width + 1, N)] - c[np.maximum(i - width, 0)] > 0
+
+
+def cell_ranges(mask):
+    """Return the list of (lo, hi) ranges of consecutive cells of
+    *mask* (cells lo to hi-1)."""
+
+    edges = np.nonzero(np.diff(np.concatenate(([ 0 ], mask.astype(np.int8), [ 0 ]))))[0]
+
+    return zip(edges[0::2], edges[1::2])
 
 
 ######################################################################
@@ -13,10 +35,66 @@ class Evolver(pyblaw.base.Base):
 
        Evolve the cell averages q given at time t^n to time t^{n+1}.
 
+       The time of each stage is passed to the reconstructor, flux and
+       source as the keyword argument ``tau`` (eg, for time-dependent
+       boundary conditions).
+
+       **Arguments**
+
+       * *fused*     - use fused stage kernels (defaults to False)
+       * *threshold* - active set tracking threshold (defaults to
+         None, ie, update every cell)
+
+       If *fused* is True, each stage of a homogeneous system is
+       computed by a fused compiled kernel (pyblaw.cstep.stage) that
+       reconstructs, computes the numerical flux and updates each
+       cell in a single sweep over memory, instead of making separate
+       passes (and storing the reconstructions and fluxes) for each
+       step.  The reconstructor and flux must then have compiled
+       kernels (see pyblaw.solver.Solver regarding *compiled*), eg,
+       a UniformWENOReconstructor with an LFFlux of one of the
+       built-in pointwise fluxes (linear advection, Burgers, LWR
+       traffic or flat bottom shallow water).  The results are
+       identical to those of the unfused stages.  Systems with a
+       source use the unfused stages.
+
+       If *threshold* is given, only the cells near the cells that
+       changed during the last step are reconstructed and updated
+       (active set tracking).  At the beginning of each step, the
+       cells in which some component changed by more than
+       *threshold* during the last step are marked, and the updated
+       cells are those within the domain of dependence of one step
+       of a marked cell, ie, within ``stages * (width + 1)`` cells
+       where *width* is the stencil width of the reconstructor (see
+       pyblaw.reconstructor.Reconstructor.width).  The cells near the
+       ends of the domain are always updated (for time-dependent and
+       periodic boundary conditions).  As such the active set grows
+       as waves arrive, and shrinks as they leave.  The ranges of
+       cells to reconstruct and update are passed to the
+       reconstructor, flux and source as the keyword argument
+       ``cells`` (a list of (lo, hi) ranges), and only these cells
+       are updated by the stages (see *rows*).  Components that do
+       not support ``cells`` compute every cell (which gives the same
+       results).  This is an approximation: quiet cells (whose
+       states change by less than *threshold* per step) are frozen,
+       so it suits problems that are mostly at rest (eg, still water
+       or traffic at rest) and whose fluxes and sources vanish at
+       rest.  The number of updated cells of the last step is stored
+       in *updated*.  Active set tracking is not supported by the
+       fused kernels.
+
+       The net flux of a step is a combination of the net fluxes of
+       its stages: the step is ``q + dt * sum(weights[s] * f_s)``
+       where *weights* are the stage weights of the evolver (used to
+       integrate the numerical fluxes over a step, see pyblaw.amr).
+
        **Instance variables**
 
        * *t*             - times
        * *dt*            - time step sizes
+       * *active*        - index of the components that are updated
+       * *ghosts*        - number of ghost cells of the stage arrays
+       * *interior*      - index of the interior cells of the stage arrays
 
        * *grid*          - grid
        * *system*        - system
@@ -36,10 +114,25 @@ class Evolver(pyblaw.base.Base):
     t  = []                             # times
     dt = []                             # time steps
 
+    active = slice(None)                # updated components
+
+    ghosts   = 0                        # number of ghost cells
+    interior = slice(None)              # interior cells
+
     grid   = None
     system = None
     flux   = None
 
+    fused   = False                     # fused stage kernels
+    stages  = 1                         # number of stages
+    weights = (1.0,)                    # stage weights (see below)
+
+    threshold = None                    # active set tracking
+
+    def __init__(self, fused=False, threshold=None):
+        self.fused = fused
+        self.threshold = threshold
+
     def set_grid(self, grid):
         self.grid = grid
 
@@ -55,6 +148,20 @@ class Evolver(pyblaw.base.Base):
     def set_source(self, source):
         self.source = source
 
+    def set_ghosts(self, ghosts):
+        """Use ghost cell padded arrays with *ghosts* ghost cells on
+        either side (see pyblaw.solver.Solver).
+
+        When padded, the arrays q and qn passed to *evolve* (and the
+        stage arrays) have *ghosts* extra cells on either side, and
+        only their *interior* cells are updated.  The padded arrays
+        are passed to the reconstructor, and the flux and source are
+        passed interior views of the reconstructions.
+
+        """
+
+        self.ghosts = ghosts
+
     def set_times(self, times):
         """Set times at which the solution is computed to *times* and
         compute time step sizes."""
@@ -78,12 +185,134 @@ class Evolver(pyblaw.base.Base):
         N = self.grid.N
         p = self.system.p
         n = self.reconstructor.n
+        g = self.ghosts
+
+        self.f   = np.zeros((N,p), order=self.layout)
+        self.qlg = np.zeros((N+2*g+1,p), order=self.layout)
+        self.qrg = np.zeros((N+2*g+1,p), order=self.layout)
+        self.ql  = self.qlg[g:g+N+1]
+        self.qr  = self.qrg[g:g+N+1]
+        self.qq  = np.zeros((N,n,p), order=self.layout)
+        self.s   = np.zeros((N,p), order=self.layout)
+
+        if g > 0:
+            self.interior = slice(g, g+N)
+
+    def pre_run(self, **kwargs):
+        """Reconstruct the frozen components of the system (see
+        pyblaw.system.System.frozen) once, and restrict the
+        reconstructor and the updates to the other components.
+        Gather the fused kernels (see *fused*)."""
+
+        self.freeze(**kwargs)
+
+        if self.fused:
+            self.kernels = (self.reconstructor.kernel(), self.flux.kernel())
+            if None in self.kernels:
+                raise ValueError, 'the reconstructor and flux do not have fused kernels'
+            self.mask = self.active_mask()
+
+        if self.threshold is not None:
+            if self.fused:
+                raise ValueError, 'active set tracking is not supported by the fused kernels'
+            self.previous = None
+
+
+    def freeze(self, **kwargs):
+        """Reconstruct the frozen components once (see *pre_run*)."""
+
+        frozen = self.system.frozen
+        if not frozen:
+            return
+
+        p  = self.system.p
+        q0 = kwargs.get('qg0', kwargs['q0'])
+
+        self.reconstructor.reconstruct(q0, self.qlg, self.qrg, self.qq, n=0, t=kwargs['t0'])
+
+        components = [ m for m in range(p) if m not in frozen ]
+        self.reconstructor.set_components(components)
+        self.active = pyblaw.base.columns(components)
+
+
+    def active_mask(self):
+        """Return the (integer) mask of the components that are
+        updated."""
+
+        mask = np.zeros(self.system.p, dtype=np.int)
+        mask[self.active] = 1
+
+        return mask
+
+
+    def track(self, q):
+        """Update the active cells given the cell averages *q* at the
+        beginning of a step (see *threshold*)."""
+
+        if self.threshold is None:
+            return
+
+        q = q[self.interior]
+        N = q.shape[0]
+
+        if self.previous is None:
+            changed = np.ones(N, dtype=np.bool)
+            self.previous = q.copy()
+            self.active_cells = changed
+        elif self.active_mask().any():
+            changed = abs(q - self.previous)[:,self.active].max(axis=1) > self.threshold
+            self.previous[:,:] = q
+        else:
+            # every component is frozen, nothing changes
+            changed = np.zeros(N, dtype=np.bool)
+
+        w = self.stages * (self.reconstructor.width + 1)
+        changed[:w]  = True
+        changed[-w:] = True
+
+        updated = dilate(changed, w)
+
+        # the stage arrays of cells that are no longer updated hold
+        # stale stage values, reset them
+        g = self.ghosts
+        for lo, hi in cell_ranges(self.active_cells & ~updated):
+            for qs in self.stage_arrays():
+                qs[g+lo:g+hi] = q[lo:hi]
+
+        self.active_cells = updated
+        self.cells   = cell_ranges(updated)
+        self.rcells  = cell_ranges(dilate(updated, 1))
+        self.updated = updated.sum()
+
+
+    def stage_arrays(self):
+        """Return the list of (intermediate) stage arrays."""
+
+        return []
+
+
+    def rows(self):
+        """Return the list of the (stage array, flux) row indices of
+        the cells that are updated by the stages (see
+        *threshold*)."""
+
+        if self.threshold is None:
+            return [ (self.interior, slice(None)) ]
+
+        g = self.ghosts
+
+        return [ (slice(g+lo, g+hi), slice(lo, hi)) for lo, hi in self.cells ]
+
+
+    def fused_stage(self, qin, q0, qout, dt, a, b, c):
+        """Compute the stage ``qout = a q0 + b qin + c dt f(qin)`` of
+        the interior cells with the fused kernel (see *fused*)."""
+
+        i = self.interior
+
+        pyblaw.cstep.stage(qin[i], q0[i], qout[i], dt, a, b, c,
+                           self.kernels[0], self.kernels[1], self.mask)
 
-        self.f  = np.zeros((N,p))
-        self.ql = np.zeros((N+1,p))
-        self.qr = np.zeros((N+1,p))
-        self.qq = np.zeros((N,n,p))
-        self.s  = np.zeros((N,p))
 
     def reconstruct_and_compute_flux_and_source(self, q, **kwargs):
         """Helper function to reconstruct and compute the flux and
@@ -95,10 +324,16 @@ class Evolver(pyblaw.base.Base):
         qq = self.qq
         s  = self.s
 
-        r = self.reconstructor.reconstruct(q, ql, qr, qq, **kwargs)
+        if self.threshold is not None:
+            kwargs['cells'] = self.rcells
+
+        r = self.reconstructor.reconstruct(q, self.qlg, self.qrg, qq, **kwargs)
         if isinstance(r, dict):
             kwargs.update(r)
 
+        if self.threshold is not None:
+            kwargs['cells'] = self.cells
+
         r = self.flux.flux(ql, qr, f, **kwargs)
         if isinstance(r, dict):
             kwargs.update(r)
@@ -107,6 +342,9 @@ class Evolver(pyblaw.base.Base):
         if isinstance(r, dict):
             kwargs.update(r)
 
+        if self.threshold is not None:
+            del kwargs['cells']
+
         return kwargs
 
 
@@ -119,14 +357,23 @@ class Evolver(pyblaw.base.Base):
         qr = self.qr
         qq = self.qq
 
-        r = self.reconstructor.reconstruct(q, ql, qr, qq, **kwargs)
+        if self.threshold is not None:
+            kwargs['cells'] = self.rcells
+
+        r = self.reconstructor.reconstruct(q, self.qlg, self.qrg, qq, **kwargs)
         if isinstance(r, dict):
             kwargs.update(r)
 
+        if self.threshold is not None:
+            kwargs['cells'] = self.cells
+
         r = self.flux.flux(ql, qr, f, **kwargs)
         if isinstance(r, dict):
             kwargs.update(r)
 
+        if self.threshold is not None:
+            del kwargs['cells']
+
         return kwargs
 
 
@@ -135,15 +382,26 @@ class Evolver(pyblaw.base.Base):
 class FE(Evolver):
     """Forward-Euler evolver."""
 
+    def kernel(self):
+        if self.threshold is not None:
+            return None
+
+        return ('fe', self.active_mask())
+
     def evolve(self, q, qn, **kwargs):
 
         f  = self.f
         s  = self.s
-        dt = self.dt[kwargs['n']]
+        a  = self.active
+        dt = kwargs.get('dt', self.dt[kwargs['n']])
+
+        self.track(q)
 
         # qn
+        kwargs['tau'] = kwargs['t']
         kwargs = self.reconstruct_and_compute_flux_and_source(q, **kwargs)
-        qn[:,:] = q[:,:] + dt * (f[:,:] + s[:,:])
+        for i, r in self.rows():
+            qn[i,a] = q[i,a] + dt * (f[r,a] + s[r,a])
 
         # done
         if __debug__:
@@ -154,11 +412,20 @@ class FE(Evolver):
     def evolve_homogeneous(self, q, qn, **kwargs):
 
         f  = self.f
-        dt = self.dt[kwargs['n']]
+        a  = self.active
+        dt = kwargs.get('dt', self.dt[kwargs['n']])
+
+        if self.fused:
+            self.fused_stage(q, q, qn, dt, 0.0, 1.0, 1.0)
+            return kwargs
+
+        self.track(q)
 
         # qn
+        kwargs['tau'] = kwargs['t']
         kwargs = self.reconstruct_and_compute_flux(q, **kwargs)
-        qn[:,:] = q[:,:] + dt * f[:,:]
+        for i, r in self.rows():
+            qn[i,a] = q[i,a] + dt * f[r,a]
 
         # done
         if __debug__:
@@ -172,15 +439,38 @@ class FE(Evolver):
 class SSPERK3(Evolver):
     """Strong stability-conserving explicit three-stage Runge-Kutta evolver."""
 
+    stages  = 3
+    weights = (1.0/6.0, 1.0/6.0, 2.0/3.0)
+
     def allocate(self):
 
         Evolver.allocate(self)
 
         N = self.grid.N
         p = self.system.p
+        g = self.ghosts
+
+        self.q1 = np.zeros((N+2*g, p), order=self.layout)
+        self.q2 = np.zeros((N+2*g, p), order=self.layout)
+
 
-        self.q1 = np.zeros((N, p))
-        self.q2 = np.zeros((N, p))
+    def kernel(self):
+        if self.threshold is not None:
+            return None
+
+        return ('ssperk3', self.active_mask())
+
+
+    def stage_arrays(self):
+        return [ self.q1, self.q2 ]
+
+
+    def pre_run(self, **kwargs):
+
+        Evolver.pre_run(self, **kwargs)
+
+        self.q1[self.interior,:] = kwargs['q0']
+        self.q2[self.interior,:] = kwargs['q0']
 
 
     def evolve(self, q, qn, **kwargs):
@@ -189,19 +479,28 @@ class SSPERK3(Evolver):
         s  = self.s
         q1 = self.q1
         q2 = self.q2
-        dt = self.dt[kwargs['n']]
+        a  = self.active
+        dt = kwargs.get('dt', self.dt[kwargs['n']])
+
+        self.track(q)
 
         # q1
+        kwargs['tau'] = kwargs['t']
         kwargs = self.reconstruct_and_compute_flux_and_source(q, **kwargs)
-        q1[:,:] = q[:,:] + dt * (f[:,:] + s[:,:])
+        for i, r in self.rows():
+            q1[i,a] = q[i,a] + dt * (f[r,a] + s[r,a])
 
         # q2
+        kwargs['tau'] = kwargs['t'] + dt
         kwargs = self.reconstruct_and_compute_flux_and_source(q1, **kwargs)
-        q2[:,:] = 3.0/4.0 * q[:,:] + 1.0/4.0 * q1[:,:] + 1.0/4.0 * dt * (f[:,:] + s[:,:])
+        for i, r in self.rows():
+            q2[i,a] = 3.0/4.0 * q[i,a] + 1.0/4.0 * q1[i,a] + 1.0/4.0 * dt * (f[r,a] + s[r,a])
 
         # qn
+        kwargs['tau'] = kwargs['t'] + 0.5*dt
         kwargs = self.reconstruct_and_compute_flux_and_source(q2, **kwargs)
-        qn[:,:] = 1.0/3.0 * q[:,:] + 2.0/3.0 * q2[:,:] + 2.0/3.0 * dt * (f[:,:] + s[:,:])
+        for i, r in self.rows():
+            qn[i,a] = 1.0/3.0 * q[i,a] + 2.0/3.0 * q2[i,a] + 2.0/3.0 * dt * (f[r,a] + s[r,a])
 
         # done
         if __debug__:
@@ -215,19 +514,34 @@ class SSPERK3(Evolver):
         s  = self.s
         q1 = self.q1
         q2 = self.q2
-        dt = self.dt[kwargs['n']]
+        a  = self.active
+        dt = kwargs.get('dt', self.dt[kwargs['n']])
+
+        if self.fused:
+            self.fused_stage(q, q, q1, dt, 0.0, 1.0, 1.0)
+            self.fused_stage(q1, q, q2, dt, 3.0/4.0, 1.0/4.0, 1.0/4.0)
+            self.fused_stage(q2, q, qn, dt, 1.0/3.0, 2.0/3.0, 2.0/3.0)
+            return kwargs
+
+        self.track(q)
 
         # q1
+        kwargs['tau'] = kwargs['t']
         kwargs = self.reconstruct_and_compute_flux(q, **kwargs)
-        q1[:,:] = q[:,:] + dt * f[:,:]
+        for i, r in self.rows():
+            q1[i,a] = q[i,a] + dt * f[r,a]
 
         # q2
+        kwargs['tau'] = kwargs['t'] + dt
         kwargs = self.reconstruct_and_compute_flux(q1, **kwargs)
-        q2[:,:] = 3.0/4.0 * q[:,:] + 1.0/4.0 * q1[:,:] + 1.0/4.0 * dt * f[:,:]
+        for i, r in self.rows():
+            q2[i,a] = 3.0/4.0 * q[i,a] + 1.0/4.0 * q1[i,a] + 1.0/4.0 * dt * f[r,a]
 
         # qn
+        kwargs['tau'] = kwargs['t'] + 0.5*dt
         kwargs = self.reconstruct_and_compute_flux(q2, **kwargs)
-        qn[:,:] = 1.0/3.0 * q[:,:] + 2.0/3.0 * q2[:,:] + 2.0/3.0 * dt * f[:,:]
+        for i, r in self.rows():
+            qn[i,a] = 1.0/3.0 * q[i,a] + 2.0/3.0 * q2[i,a] + 2.0/3.0 * dt * f[r,a]
 
         # done
         if __debug__:
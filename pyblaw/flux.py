@@ -30,6 +30,11 @@ class Flux(pyblaw.base.Base):
        * *allocate* - allocate memory etc
        * *flux*     - compute net fluxes
 
+       **Methods that may be overridden**
+
+       * *interface_flux* - compute numerical fluxes at given
+         boundaries (required for flux correction, see pyblaw.amr)
+
        **Methods**
 
     """
@@ -54,6 +59,12 @@ class Flux(pyblaw.base.Base):
 
         raise NotImplementedError
 
+    def interface_flux(self, qm, qp, F, **kwargs):
+        """Store the numerical fluxes at the boundaries whose left (-)
+           and right (+) reconstructions are *qm* and *qp* in *F*."""
+
+        raise NotImplementedError, 'the flux does not compute interface fluxes'
+
 
 ######################################################################
 
@@ -127,6 +138,19 @@ class LFFlux(Flux):
          * ``t``: the current time, and
          * any entries passed to the solver or set by the reconstructor.
 
+       If *flux* is one of the built-in pointwise fluxes below (eg,
+       BurgersFlux), the flux has a compiled kernel (see
+       pyblaw.solver.Solver regarding *compiled*).
+
+       If the keyword argument ``cells`` is given (see
+       pyblaw.evolver.Evolver regarding *threshold*), the net flux is
+       only computed for the cells of its (lo, hi) ranges, and *flux*
+       is called once per range with the states at the boundaries of
+       the range.
+
+       The numerical fluxes at arbitrary boundaries are computed by
+       *interface_flux* (eg, for flux correction, see pyblaw.amr).
+
     """
 
     def __init__(self, flux, alpha):
@@ -140,8 +164,8 @@ class LFFlux(Flux):
 
         self.fl = np.zeros((N+1,p))
         self.fr = np.zeros((N+1,p))
-        self.fm = np.zeros((N+1,p))
-        self.fp = np.zeros((N+1,p))
+        self.fm = np.zeros((N+1,p), order=self.layout)
+        self.fp = np.zeros((N+1,p), order=self.layout)
 
 
     def pre_run(self, **kwargs):
@@ -152,12 +176,121 @@ class LFFlux(Flux):
 
     def flux(self, qm, qp, f, **kwargs):
 
-        self.f(qm, self.fm, **kwargs)
-        self.f(qp, self.fp, **kwargs)
+        cells = kwargs.get('cells')
+        if cells is None:
+            cells = [ (0, f.shape[0]) ]
 
-        pyblaw.clfflux.lf_flux(qm, qp, self.fm, self.fp, f)
+        for lo, hi in cells:
+            b  = slice(lo, hi+1)
+            fm = self.fm[b]
+            fp = self.fp[b]
+
+            self.f(qm[b], fm, **kwargs)
+            self.f(qp[b], fp, **kwargs)
+
+            pyblaw.clfflux.lf_flux(qm[b], qp[b], fm, fp, f[lo:hi], lo, self.alpha, self.dx)
 
         if __debug__:
             self.debug(qm=qm, qp=qp, f=f, **kwargs)
 
         return kwargs
+
+
+    def interface_flux(self, qm, qp, F, **kwargs):
+        fm = np.zeros(qm.shape)
+        fp = np.zeros(qp.shape)
+
+        self.f(qm, fm, **kwargs)
+        self.f(qp, fp, **kwargs)
+
+        F[:,:] = 0.5 * (fm + fp - self.alpha * (qp - qm))
+
+
+    def kernel(self):
+        if not hasattr(self.f, 'kernel'):
+            return None
+
+        name, params = self.f.kernel(self.system.p)
+
+        return ('lf', self.alpha, name, params, self.dx)
+
+
+######################################################################
+
+class LinearFlux(object):
+    """Linear advection flux f(q) = a q (pointwise flux function).
+
+       **Arguments**
+
+       * *a* - advection speed (scalar, or one per component)
+
+    """
+
+    def __init__(self, a):
+        self.a = a
+
+    def __call__(self, q, f, **kwargs):
+        f[:,:] = np.asarray(self.a, dtype=np.float64) * q
+
+    def kernel(self, p):
+        return ('linear', np.asarray(self.a, dtype=np.float64) * np.ones(p))
+
+
+class BurgersFlux(object):
+    """Burgers flux f(q) = q**2/2 (pointwise flux function)."""
+
+    def __call__(self, q, f, **kwargs):
+        f[:,:] = 0.5 * q * q
+
+    def kernel(self, p):
+        return ('burgers', np.zeros(0))
+
+
+class TrafficFlux(object):
+    """LWR traffic flux f(q) = v q (1 - q/q_max) (pointwise flux
+    function).
+
+       **Arguments**
+
+       * *v*     - free flow speed (defaults to 1)
+       * *q_max* - maximum (jam) density (defaults to 1)
+
+    """
+
+    def __init__(self, v=1.0, q_max=1.0):
+        self.v = v
+        self.q_max = q_max
+
+    def __call__(self, q, f, **kwargs):
+        f[:,:] = self.v * q * (1.0 - q / self.q_max)
+
+    def kernel(self, p):
+        return ('traffic', np.array([self.v, self.q_max], dtype=np.float64))
+
+
+class ShallowWaterFlux(object):
+    """Shallow-water flux f(h, hu) = (hu, hu**2/h + g h**2/2) over a
+    flat bottom (pointwise flux function).
+
+       **Arguments**
+
+       * *g* - gravitational acceleration (defaults to 9.81)
+
+       The components are the depth h and the discharge hu (or
+       consecutive (h, hu) pairs, eg, for ensembles).  The depth must
+       remain positive.
+
+    """
+
+    def __init__(self, g=9.81):
+        self.g = g
+
+    def __call__(self, q, f, **kwargs):
+        h  = q[:,0::2]
+        hu = q[:,1::2]
+
+        f[:,0::2] = hu
+        f[:,1::2] = hu**2 / h + 0.5 * self.g * h**2
+
+    def kernel(self, p):
+        return ('shallowwater', np.array([self.g], dtype=np.float64))
@@ -18,18 +18,28 @@ class H5PYDumper(pyblaw.dumper.Dumper):
        * ``/dims/tdim`` - dump times
        * ``/parameters/X`` - parameters
        * ``/data/q`` - cell averages of solution q
+       * ``/reductions/R/X`` - final reductions (see pyblaw.reducer)
 
        The parameters are taken from the system (pyblaw.system.System).
+       The transform applied to q (see pyblaw.dumper.Dumper.metadata)
+       is stored in the attributes of ``/data/q``.
 
        **Arguments**
 
        * *output* - output file name
 
+       Any keyword arguments are passed to *set_options* (see
+       pyblaw.dumper.Dumper).  Unless *dtype* is given, q is stored
+       as 'float32'.
+
     """
 
-    def __init__(self, output='output.h5'):
+    default_dtype = 'float32'           # storage type if dtype is None
+
+    def __init__(self, output='output.h5', **kwargs):
 
         self.output = output
+        self.set_options(**kwargs)
 
     def init_dump(self):
 
@@ -38,7 +48,7 @@ class H5PYDumper(pyblaw.dumper.Dumper):
 
         # x and t dimensions
         sgrp = hdf.create_group("dims")
-        sgrp.create_dataset("xdim", data=self.x)
+        sgrp.create_dataset("xdim", data=self.xdim())
         sgrp.create_dataset("tdim", data=self.t)
 
         # parameters
@@ -48,7 +58,9 @@ class H5PYDumper(pyblaw.dumper.Dumper):
 
         # data sets (solution q)
         sgrp = hdf.create_group("data")
-        dset = sgrp.create_dataset("q", (len(self.t), len(self.x), self.system.p))
+        dset = sgrp.create_dataset("q", self.shape(), dtype=self.storage_type())
+        for key, value in self.metadata().iteritems():
+            dset.attrs[key] = value
 
         # done
         hdf.close()
@@ -61,7 +73,21 @@ class H5PYDumper(pyblaw.dumper.Dumper):
 
         hdf = h5py.File(self.output, "a")
         dset = hdf["data/q"]
-        dset[self.last,:,:] = q[:,:]
+        dset[self.last] = self.transform(q)
         hdf.close()
 
         self.last = self.last + 1
+
+
+    def dump_reductions(self, reductions):
+        """Dump reductions to HDF5 data file."""
+
+        hdf = h5py.File(self.output, "a")
+        sgrp = hdf.require_group("reductions")
+        for name, result in reductions.iteritems():
+            rgrp = sgrp.require_group(name)
+            for key, value in result.iteritems():
+                if key in rgrp:
+                    del rgrp[key]
+                rgrp.create_dataset(key, data=value)
+        hdf.close()
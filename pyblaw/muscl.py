@@ -0,0 +1,111 @@
+"""PyBLAW MUSCL reconstructor.
+
+"""
+
+import numpy as np
+
+import pyblaw.reconstructor
+import pyblaw.cmuscl
+
+
+######################################################################
+
+class MUSCLReconstructor(pyblaw.reconstructor.Reconstructor):
+    """MUSCL (second order TVD) reconstructor.
+
+       This reconstructor uses piecewise linear reconstructions with
+       limited slopes, and is implemented in C (cmuscl).  It is much
+       cheaper than the WENO reconstructors, and is well suited to
+       exploratory runs and large ensembles.
+
+       **Arguments**
+
+       * *limiter* - slope limiter: 'minmod', 'vanleer', 'mc' or
+         'superbee' (defaults to 'minmod')
+       * *n*       - number of Gauss points per cell (defaults to 0)
+
+       If *n* is non-zero, q is also reconstructed at the *n*
+       Gauss-Legendre points of each cell and stored in *qq* (for use
+       by the source).  The corresponding quadrature weights
+       (normalised to sum to one) are stored in *wq*.
+
+       If boundary conditions are set (see pyblaw.boundary), one
+       ghost cell on either side is filled by the boundary conditions
+       and is used to compute the slopes in the first and last cells
+       (so that, eg, periodic runs are second order across the
+       seam).  Otherwise the slopes in the first and last cells are
+       zero, and the reconstructions at the ends of the domain are
+       taken to be continuous.
+
+    """
+
+    limiters = { 'minmod': 0, 'vanleer': 1, 'mc': 2, 'superbee': 3 }
+
+    ghosts = 1                          # number of ghost cells
+
+    def __init__(self, limiter='minmod', n=0):
+        if limiter not in self.limiters:
+            raise ValueError, 'unknown limiter: %s' % limiter
+
+        self.limiter = limiter
+        self.n = n
+
+        if n > 0:
+            xi, w = np.polynomial.legendre.leggauss(n)
+            self.xi = 0.5 * xi
+            self.wq = 0.5 * w
+        else:
+            self.xi = np.zeros(0)
+            self.wq = np.zeros(0)
+
+
+    def allocate(self):
+        N = self.grid.size
+        p = self.system.p
+
+        if not self.padded:
+            self.qg = np.zeros((N+2, p), order=self.layout)
+
+
+    def pre_run(self, **kwargs):
+        self.x  = self.grid.centers()
+        self.dx = self.grid.sizes()
+
+
+    def kernel(self):
+        boundary = self.boundary_kernel()
+        if boundary is None:
+            return None
+
+        return ('muscl', self.limiters[self.limiter], self.x, self.dx, boundary)
+
+
+    def reconstruct(self, q, qm, qp, qq, **kwargs):
+
+        if self.padded:
+            N  = q.shape[0] - 2
+            qg = q
+            q  = qg[1:N+1]
+            qm = qm[1:N+2]
+            qp = qp[1:N+2]
+        else:
+            N  = q.shape[0]
+
+        limiter = self.limiters[self.limiter]
+
+        if self.boundary is None:
+            pyblaw.cmuscl.reconstruct(q, qm, qp, qq, self.x, self.dx, self.xi,
+                                      limiter, 0)
+        else:
+            if not self.padded:
+                qg = self.qg
+                qg[1:N+1,:] = q[:,:]
+            self.boundary.fill(qg, 1, **kwargs)
+
+            pyblaw.cmuscl.reconstruct(qg, qm, qp, qq, self.x, self.dx, self.xi,
+                                      limiter, 1)
+
+            self.boundary.close(qm, qp, **kwargs)
+
+        if __debug__:
+            self.debug(q=q, qp=qp, qm=qm, qq=qq, **kwargs)
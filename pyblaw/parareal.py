@@ -0,0 +1,216 @@
+"""PyBLAW Parareal (parallel in time) driver.
+
+"""
+
+import multiprocessing
+import time
+import numpy as np
+
+import pyblaw.cache
+
+
+######################################################################
+
+def restrict(q, ratio):
+    """Return the averages of consecutive blocks of *ratio* cells of
+    *q* (fine to coarse, uniform grids)."""
+
+    if ratio == 1:
+        return q.copy()
+
+    N, p = q.shape
+
+    return q.reshape((N/ratio, ratio, p)).mean(axis=1)
+
+
+def prolong(q, ratio):
+    """Return the piecewise constant prolongation of *q* onto a grid
+    *ratio* times finer (coarse to fine, uniform grids)."""
+
+    if ratio == 1:
+        return q.copy()
+
+    return np.repeat(q, ratio, axis=0)
+
+
+######################################################################
+
+class Parareal(object):
+    """Parareal (parallel in time) driver.
+
+       **Arguments**
+
+       * *fine*        - fine (accurate) solver factory (callable)
+       * *coarse*      - coarse (cheap) solver factory (callable)
+       * *times*       - time slice boundaries
+       * *processes*   - number of processes (defaults to the number
+         of cores)
+       * *tolerance*   - relative tolerance (defaults to 1e-8)
+       * *iterations*  - maximum number of iterations (defaults to the
+         number of time slices)
+       * *ratio*       - grid coarsening ratio of the coarse solver
+         (defaults to 1, ie, the same grid)
+       * *initializer* - worker initializer (callable or None)
+       * *initargs*    - arguments of the worker initializer
+
+       The solver factories are called as ``factory(t0, t1)`` and
+       should return a pyblaw.solver.Solver whose times go from *t0*
+       to *t1* (usually without a dumper).  The driver sets the
+       *initial_state* of each solver before running it.  The fine
+       solver is usually a WENO reconstructor with the SSPERK3
+       evolver, and the coarse solver a cheaper reconstructor, the FE
+       evolver, larger time steps and/or a coarser grid.  If *ratio*
+       is greater than one, the coarse solver should use a uniform
+       grid *ratio* times coarser than the (uniform) fine grid, and
+       states are transferred with *restrict* and *prolong*.
+
+       The initial state is taken from the initial conditions of the
+       first fine solver.  The state at the slice boundaries is first
+       propagated by the coarse solver.  Each Parareal iteration then
+       runs the fine solver over all (unconverged) time slices
+       concurrently in a pool of worker processes, and corrects the
+       states with a sequential sweep of the coarse solver:
+
+         :math:`U^{k+1}_{n+1} = G(U^{k+1}_n) + F(U^k_n) - G(U^k_n)`.
+
+       The iterations stop when the relative change of the states
+       is less than *tolerance*.  The factories and initializer must
+       be picklable (eg, module level functions).
+
+       **Instance variables**
+
+       * *q*          - final state
+       * *states*     - states at the time slice boundaries
+       * *iterations* - number of iterations performed
+       * *errors*     - relative change of each iteration
+       * *fine_time*  - total run time of the fine solvers over all
+         time slices (ie, the run time of a serial fine run)
+       * *wall_time*  - wall time of the Parareal run
+       * *speedup*    - speedup with respect to a serial fine run
+
+    """
+
+    def __init__(self, fine, coarse, times, processes=None, tolerance=1e-8,
+                 iterations=None, ratio=1, initializer=None, initargs=()):
+
+        self.fine        = fine
+        self.coarse      = coarse
+        self.times       = np.asarray(times, dtype=np.float64)
+        self.processes   = processes or multiprocessing.cpu_count()
+        self.tolerance   = tolerance
+        self.maxiter     = iterations or (len(times) - 1)
+        self.ratio       = ratio
+        self.initializer = initializer
+        self.initargs    = initargs
+
+
+    def propagate_coarse(self, q, n):
+        """Return the state *q* propagated over time slice *n* by the
+        coarse solver."""
+
+        solver = self.coarse(self.times[n], self.times[n+1])
+        solver.initial_state = restrict(q, self.ratio)
+        solver.run()
+
+        return prolong(solver.q, self.ratio)
+
+
+    def run(self):
+        """Run the Parareal iterations and return the final state."""
+
+        T = self.times
+        K = len(T) - 1
+
+        start = time.time()
+
+        solver = self.fine(T[0], T[1])
+        solver.initialise_and_allocate()
+
+        U = np.zeros((K+1,) + solver.q.shape)
+        U[0] = solver.q
+        del solver
+
+        # coarse prediction
+        G = np.zeros(U.shape)
+        t0 = time.time()
+        for n in range(K):
+            G[n+1] = self.propagate_coarse(U[n], n)
+            U[n+1] = G[n+1]
+        self.coarse_time = time.time() - t0
+
+        self.errors    = []
+        self.fine_time = 0.0
+
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (self.initializer, self.initargs))
+        try:
+            for k in range(self.maxiter):
+
+                # fine propagation (concurrent), the first k slices
+                # have converged
+                tasks = [ (self.fine, T[n], T[n+1], U[n]) for n in range(k, K) ]
+                results = pool.map(_propagate_fine, tasks)
+
+                if k == 0:
+                    self.fine_time = sum([ elapsed for q, elapsed in results ])
+
+                # coarse correction (sequential)
+                V = U.copy()
+                for n in range(k, K):
+                    q, elapsed = results[n-k]
+                    g = self.propagate_coarse(V[n], n)
+                    V[n+1] = g + q - G[n+1]
+                    G[n+1] = g
+
+                error = abs(V - U).max() / max(abs(V).max(), np.finfo(np.float64).tiny)
+                self.errors.append(error)
+
+                U = V
+                if error < self.tolerance:
+                    break
+
+        finally:
+            pool.close()
+            pool.join()
+
+        self.states     = U
+        self.q          = U[-1]
+        self.iterations = len(self.errors)
+        self.wall_time  = time.time() - start
+        self.speedup    = self.fine_time / self.wall_time
+
+        return self.q
+
+
+    def report(self):
+        """Return a summary of the Parareal run."""
+
+        return ("parareal: %d iterations, error = %.3e, speedup = %.2f "
+                "(fine = %.2fs, coarse = %.2fs, wall = %.2fs)"
+                % (self.iterations, self.errors[-1], self.speedup,
+                   self.fine_time, self.coarse_time, self.wall_time))
+
+
+######################################################################
+
+def _init_worker(initializer, initargs):
+    """Initialise a Parareal worker process."""
+
+    pyblaw.cache.memoize = True
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _propagate_fine(task):
+    """Propagate a state over a time slice with the fine solver."""
+
+    fine, t0, t1, q = task
+
+    solver = fine(t0, t1)
+    solver.initial_state = q
+
+    start = time.time()
+    solver.run()
+
+    return solver.q.copy(), time.time() - start
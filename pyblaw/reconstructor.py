@@ -2,6 +2,7 @@
 
 """
 
+import numpy as np
 import pyblaw.base
 
 
@@ -16,6 +17,12 @@ class Reconstructor(pyblaw.base.Base):
        **Instance variables**
 
        * *n*          - number of quadrature points per cell (for source)
+       * *components* - components to reconstruct (None for all)
+       * *ghosts*     - number of ghost cells required on either side
+       * *width*      - number of neighbouring cells on either side
+         that the reconstruction of a cell depends on
+       * *padded*     - True if q, qm and qp are ghost cell padded
+       * *boundary*   - boundary conditions (pyblaw.boundary.Boundary or None)
 
        **Instance variables pulled from elsewhere**
 
@@ -32,6 +39,11 @@ class Reconstructor(pyblaw.base.Base):
     """
 
     n = 0                               # number of quadrature points
+    components = None                   # components to reconstruct
+    ghosts = 0                          # number of ghost cells
+    width = 1                           # stencil width
+    padded = False                      # padded layout
+    boundary = None                     # boundary conditions
 
     grid   = None
     system = None
@@ -42,9 +54,78 @@ class Reconstructor(pyblaw.base.Base):
     def set_system(self, system):
         self.system = system
 
+    def set_components(self, components):
+        """Only reconstruct the components *components* from now on
+        (None for all).  The reconstructions of the other components
+        are left untouched (see pyblaw.system.System.frozen)."""
+
+        self.components = components
+
+    def set_boundary(self, boundary):
+        """Apply the boundary conditions *boundary* (see
+        pyblaw.boundary.Boundary).  If *boundary* is None, the
+        reconstructor applies its own (default) boundary
+        conditions."""
+
+        self.boundary = boundary
+
+    def set_padded(self, padded):
+        """Use the ghost cell padded layout (see *reconstruct*)."""
+
+        self.padded = padded
+
+    def boundary_kernel(self):
+        """Return the description of the compiled kernel of the
+        boundary conditions (see pyblaw.base.Base.kernel), or None."""
+
+        if self.boundary is None:
+            return ('outflow',)
+
+        return self.boundary.kernel()
+
+    def active(self, p):
+        """Return the list of components to reconstruct."""
+
+        if self.components is None:
+            return range(p)
+
+        return self.components
+
     def reconstruct(self, q, qm, qp, qq, **kwargs):
         """Reconstruct *q* at the cell boundaries and quadrature
         points, and store the result in *qm* (-), *qp* (+), and *qq*
-        (quadrature)."""
+        (quadrature).
+
+        If the keyword argument ``cells`` is given, only the cells in
+        its (lo, hi) ranges need to be reconstructed (see
+        pyblaw.evolver.Evolver regarding *threshold*).
+
+        If *padded* is True, *q* has *ghosts* extra (ghost) cells on
+        either side, and *qm* and *qp* have *ghosts* extra boundaries
+        on either side: the reconstructions at boundary j of the
+        interior cells are stored in ``qm[ghosts+j]`` and
+        ``qp[ghosts+j]``.  The reconstructor fills the ghost cells of
+        *q* in place, so that the cell averages need not be copied.
+
+        """
 
         raise NotImplementedError
+
+
+######################################################################
+
+def indicator_field(q, indicator):
+    """Return the field used to compute shared smoothness indicators.
+
+       If *indicator* is an integer, the field is the component
+       ``q[:,indicator]``.  Otherwise *indicator* is a sequence of
+       weights (one per component) and the field is the combination
+       ``sum_m indicator[m] * q[:,m]`` (eg, the free surface ``h + b``
+       of the shallow-water equations).
+
+    """
+
+    if isinstance(indicator, (int, long)):
+        return q[:,indicator]
+
+    return np.dot(q, np.asarray(indicator, dtype=np.float64))
@@ -0,0 +1,186 @@
+"""PyBLAW abstract Reducer class and a few concrete reducers.
+
+"""
+
+import numpy as np
+import pyblaw.base
+
+
+######################################################################
+
+class Reducer(pyblaw.base.Base):
+    """Abstract reducer (in-situ analysis).
+
+       Incrementally reduce the cell averages q while the solver is
+       running so that only the final reductions (instead of the full
+       solution history) need to be dumped.
+
+       **Instance variables**
+
+       * *name* - name of the reduction (used by the dumper)
+
+       **Instance variables pulled from elsewhere**
+
+       * *grid*   - pyblaw.grid.Grid
+       * *system* - pyblaw.system.System
+
+       **Methods that should be overridden**
+
+       * *allocate* - allocate memory etc
+       * *reduce*   - update the reduction given q
+       * *result*   - return the reductions
+
+       **Methods**
+
+    """
+
+    name = 'reduction'
+
+    grid   = None
+    system = None
+
+    def set_grid(self, grid):
+        self.grid = grid
+
+    def set_system(self, system):
+        self.system = system
+
+    def reduce(self, q, **kwargs):
+        """Update the reduction given the cell averages *q*.
+
+           The keyword arguments contain the current step ``n`` and
+           time ``t``."""
+
+        raise NotImplementedError
+
+    def result(self):
+        """Return the reductions (dictionary of arrays)."""
+
+        raise NotImplementedError
+
+
+######################################################################
+
+class StatisticsReducer(Reducer):
+    """Per-cell time statistics.
+
+       Computes the minimum, maximum, mean and variance (using
+       Welford's algorithm) of each component in each cell.
+
+       **Arguments**
+
+       * *name* - name of the reduction (defaults to 'statistics')
+
+    """
+
+    def __init__(self, name='statistics'):
+        self.name = name
+
+    def allocate(self):
+        N = self.grid.size
+        p = self.system.p
+
+        self.count = 0
+        self.min   = np.zeros((N,p), order=self.layout)
+        self.max   = np.zeros((N,p), order=self.layout)
+        self.mean  = np.zeros((N,p), order=self.layout)
+        self.m2    = np.zeros((N,p), order=self.layout)
+        self.delta = np.zeros((N,p), order=self.layout)
+
+    def reduce(self, q, **kwargs):
+
+        if self.count == 0:
+            self.min[:,:] = q
+            self.max[:,:] = q
+        else:
+            np.minimum(self.min, q, self.min)
+            np.maximum(self.max, q, self.max)
+
+        self.count = self.count + 1
+
+        delta = self.delta
+        np.subtract(q, self.mean, delta)
+        self.mean += delta / self.count
+        delta *= q - self.mean
+        self.m2 += delta
+
+    def result(self):
+        return {
+            'count':    self.count,
+            'min':      self.min,
+            'max':      self.max,
+            'mean':     self.mean,
+            'variance': self.m2 / max(self.count, 1),
+            }
+
+
+######################################################################
+
+class ArrivalTimeReducer(Reducer):
+    """Front arrival times.
+
+       Records, for each cell, the first time at which component
+       *component* deviates from its initial value by more than
+       *threshold*.  Cells that the front never reaches have an
+       arrival time of ``inf``.
+
+       **Arguments**
+
+       * *component* - component to track (defaults to 0)
+       * *threshold* - deviation threshold
+       * *name*      - name of the reduction (defaults to 'arrival')
+
+    """
+
+    def __init__(self, component=0, threshold=1e-3, name='arrival'):
+        self.component = component
+        self.threshold = threshold
+        self.name      = name
+
+    def allocate(self):
+        N = self.grid.size
+
+        self.q0      = None
+        self.arrival = np.zeros(N)
+
+    def reduce(self, q, **kwargs):
+        m = self.component
+
+        if self.q0 is None:
+            self.q0 = q[:,m].copy()
+            self.arrival[:] = np.inf
+
+        hit = (abs(q[:,m] - self.q0) > self.threshold) & np.isinf(self.arrival)
+        self.arrival[hit] = kwargs['t']
+
+    def result(self):
+        return { 'arrival': self.arrival }
+
+
+######################################################################
+
+class MassReducer(Reducer):
+    """Mass history.
+
+       Records the 'mass' of the system (see pyblaw.system.System.mass)
+       each time the reducer is called.
+
+       **Arguments**
+
+       * *name* - name of the reduction (defaults to 'mass')
+
+    """
+
+    def __init__(self, name='mass'):
+        self.name = name
+
+    def allocate(self):
+        self.t    = []
+        self.mass = []
+
+    def reduce(self, q, **kwargs):
+        self.t.append(kwargs['t'])
+        self.mass.append(self.system.mass(q))
+
+    def result(self):
+        return { 't': np.array(self.t), 'mass': np.array(self.mass) }
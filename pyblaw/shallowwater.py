@@ -0,0 +1,324 @@
+"""PyBLAW well-balanced shallow-water equations.
+
+"""
+
+import numpy as np
+
+import pyblaw.flux
+import pyblaw.grid
+import pyblaw.source
+import pyblaw.solver
+import pyblaw.system
+import pyblaw.uniformweno
+import pyblaw.evolver
+import pyblaw.cshallowwater
+
+
+######################################################################
+
+class ShallowWaterSystem(pyblaw.system.SimpleSystem):
+    """Shallow-water equations with bed topography.
+
+       The shallow-water equations
+
+         :math:`h_t + (hu)_x = 0`
+
+         :math:`(hu)_t + (hu^2 + g h^2 / 2)_x = - g h b_x`
+
+       are solved for the depth h and discharge hu over the bed b.
+       The unknowns are (h, hu, b), where the bed is frozen (see
+       pyblaw.system.System.frozen).
+
+       **Arguments**
+
+       * *bed*        - bed elevation b(x) (callable)
+       * *depth*      - initial depth h(x) (callable)
+       * *surface*    - initial free surface elevation h(x) + b(x)
+         (callable), instead of *depth*
+       * *velocity*   - initial velocity u(x) (callable, defaults to
+         still water)
+       * *g*          - gravitational acceleration (defaults to 9.81)
+       * *dry*        - dry depth tolerance (defaults to 1e-8)
+       * *quadrature* - number of Gauss points per cell used to
+         average the initial conditions (defaults to 3)
+
+       The callables are called with an array of points (they may
+       also return constants).  If *surface* is given, the depth of
+       each cell is the difference of the cell averages of the
+       surface and the bed (or zero if the surface is below the bed),
+       so that a lake at rest with dry shores is set with a constant
+       *surface*.  The
+       velocity in cells shallower than *dry* is taken to be zero.
+
+    """
+
+    def __init__(self, bed, depth=None, surface=None, velocity=None,
+                 g=9.81, dry=1e-8, quadrature=3, parameters={}):
+
+        if (depth is None) == (surface is None):
+            raise ValueError, 'specify either the initial depth or the initial surface'
+
+        self.bed     = bed
+        self.depth   = depth
+        self.surface = surface
+        self.u0      = velocity
+        self.g       = g
+        self.dry     = dry
+
+        parameters = dict(parameters, g=g)
+
+        pyblaw.system.SimpleSystem.__init__(self, self.initial_state, parameters,
+                                            vectorized=True, quadrature=quadrature,
+                                            frozen=[2])
+
+    def initial_state(self, x, t):
+        """Return the initial (h, hu, b) at the points *x*."""
+
+        zero = np.zeros(len(x))
+
+        b = zero + self.bed(x)
+        if self.depth is not None:
+            h = zero + self.depth(x)
+        else:
+            h = zero + self.surface(x) - b
+
+        u = zero
+        if self.u0 is not None:
+            u = zero + self.u0(x)
+
+        return np.column_stack((h, np.maximum(h, 0.0)*u, b))
+
+    def initial_conditions(self, t, q):
+        pyblaw.system.SimpleSystem.initial_conditions(self, t, q)
+        q[:,0] = np.maximum(q[:,0], 0.0)
+
+    def velocity(self, q):
+        """Return the (desingularised) velocity of the cells of q."""
+
+        h = q[:,0]
+        u = np.zeros(len(h))
+
+        wet = h > self.dry
+        u[wet] = q[wet,1] / h[wet]
+
+        return u
+
+    def wave_speed(self, q):
+        return (abs(self.velocity(q)) + np.sqrt(self.g * np.maximum(q[:,0], 0.0))).max()
+
+
+######################################################################
+
+class ShallowWaterReconstructor(pyblaw.uniformweno.UniformWENOReconstructor):
+    """Well-balanced WENO reconstructor for the shallow-water
+    equations on uniform grids.
+
+       **Arguments**
+
+       * *order*      - WENO reconstruction order k (2, 3 or 4)
+       * *epsilon*    - WENO epsilon (defaults to 1e-6)
+       * *quadrature* - number of Gauss points per cell (defaults to 3)
+
+       The depth, discharge and bed are reconstructed with the same
+       nonlinear weights, which are computed from the smoothness of
+       the free surface h + b, so that the reconstructed free surface
+       of a lake at rest is constant (to round-off).  For the same
+       reason, the bed is reconstructed at every stage (with the
+       current weights) even though it is frozen.
+
+       The values at the *quadrature* Gauss points of each cell (for
+       the source) are reconstructed with the same smoothness
+       indicators and equal linear weights.  The bed slope at the
+       Gauss points is computed once (before the run) from the linear
+       big stencil reconstruction of the bed, and stored in *bx*.
+
+       Cells with a (nearly) dry cell in their stencil, or in which
+       the reconstructed depth is negative somewhere, are
+       reconstructed with constants (first order), since the free
+       surface of dry cells is meaningless.  The number of such
+       cells in the last reconstruction is stored in *troubled*.
+
+    """
+
+    def __init__(self, order=3, epsilon=1e-6, quadrature=3):
+        pyblaw.uniformweno.UniformWENOReconstructor.__init__(
+            self, order, epsilon, indicator=[ 1.0, 0.0, 1.0 ], quadrature=quadrature)
+
+
+    def set_components(self, components):
+        """Ignored: every component is reconstructed (see above)."""
+
+        pass
+
+
+    def pre_run(self, **kwargs):
+        pyblaw.uniformweno.UniformWENOReconstructor.pre_run(self, **kwargs)
+
+        if self.system.p != 3:
+            raise ValueError, 'ShallowWaterReconstructor requires a (h, hu, b) system'
+
+        k  = self.k
+        g  = self.g
+        N  = self.grid.size
+        dx = self.grid.sizes()
+
+        qg = np.zeros((N+2*g, 3))
+        qg[g:g+N] = kwargs['q0']
+        self.fill_ghosts(qg, t=kwargs['t0'], n=0)
+
+        self.bx = np.zeros((N, self.n))
+        for l in range(self.n):
+            D = pyblaw.uniformweno.big_stencil_coefficients(k, self.xi[l], True)
+            for j in range(2*g+1):
+                self.bx[:,l] += D[j] * qg[j:j+N,2]
+            self.bx[:,l] /= dx
+
+
+    def reconstruct_block(self, qg, qm, qp, qq, lo, hi):
+        """Reconstruct the cells lo to hi-1 (see
+        pyblaw.uniformweno.UniformWENOReconstructor.reconstruct_block).
+        Returns the number of cells reconstructed with constants."""
+
+        g = self.g
+        n = hi - lo
+
+        # shifted views and free surface smoothness indicators
+        qb  = qg[lo:hi+2*g]
+        eta = (qb[:,0] + qb[:,2])[:,np.newaxis]
+
+        s  = {}
+        si = {}
+        for o in range(-g, g+1):
+            s[o]  = qb[g+o:g+o+n]
+            si[o] = eta[g+o:g+o+n]
+
+        beta = self.indicators(si)
+
+        q     = s[0]
+        left  = qp[lo:hi]
+        right = qm[lo+1:hi+1]
+        gauss = qq[lo:hi]
+
+        left[:,:]  = self.combine(s, beta, 'left')
+        right[:,:] = self.combine(s, beta, 'right')
+        for l in range(self.n):
+            gauss[:,l,:] = self.combine(s, beta, l)
+
+        # first order near (nearly) dry cells
+        dry  = qb[:,0] <= self.system.dry
+        flat = (left[:,0] < 0.0) | (right[:,0] < 0.0) | (gauss[:,:,0].min(axis=1) < 0.0)
+        for o in range(-g, g+1):
+            flat |= dry[g+o:g+o+n]
+
+        if flat.any():
+            left[flat]  = q[flat]
+            right[flat] = q[flat]
+            gauss[flat] = q[flat][:,np.newaxis,:]
+
+        return flat.sum()
+
+
+######################################################################
+
+class WellBalancedFlux(pyblaw.flux.Flux):
+    """Well-balanced shallow-water flux.
+
+       The interface states are modified by the hydrostatic
+       reconstruction of Audusse et al: the depths on either side are
+       recomputed relative to the higher of the two bed values (and
+       clipped at zero), and the numerical (Rusanov) flux is
+       evaluated with these depths and the local maximum wave speed.
+       The pressure difference between the reconstructed and modified
+       depths is added to the cells on either side.  This keeps the
+       depths non-negative, and (with WellBalancedSource) preserves
+       still water exactly, including at dry shores.
+
+       The maximum wave speed over all (computed) interfaces is
+       stored in *speed*.  The flux and WellBalancedSource support
+       active set tracking (see pyblaw.evolver.Evolver).
+
+    """
+
+    def pre_run(self, **kwargs):
+        self.dx = self.grid.sizes()
+
+    def flux(self, qm, qp, f, **kwargs):
+        cells = kwargs.get('cells')
+        if cells is None:
+            cells = [ (0, f.shape[0]) ]
+
+        self.speed = 0.0
+        for lo, hi in cells:
+            speed = pyblaw.cshallowwater.flux(qm[lo:hi+1], qp[lo:hi+1], self.dx[lo:hi],
+                                              f[lo:hi], self.system.g, self.system.dry)
+            self.speed = max(self.speed, speed)
+
+        if __debug__:
+            self.debug(qm=qm, qp=qp, f=f, **kwargs)
+
+
+######################################################################
+
+class WellBalancedSource(pyblaw.source.Source):
+    """Well-balanced shallow-water bed source.
+
+       The source -g h b_x of each cell is split into
+
+         :math:`-g \\bar\\eta b_x + g b b_x - g (\\eta - \\bar\\eta) b_x`
+
+       where :math:`\\eta = h + b` is the free surface and
+       :math:`\\bar\\eta` is the mean of its reconstructions at the
+       ends of the cell.  The first two terms are integrated exactly
+       from the reconstructions at the ends of the cell, and the last
+       (which vanishes for still water) with the Gauss points and bed
+       slopes of the ShallowWaterReconstructor.  This balances the
+       pressure terms of WellBalancedFlux for still water.
+
+    """
+
+    def pre_run(self, **kwargs):
+        self.dx = self.grid.sizes()
+
+    def source(self, qm, qp, qq, s, **kwargs):
+        cells = kwargs.get('cells')
+        if cells is None:
+            cells = [ (0, s.shape[0]) ]
+
+        bx = self.reconstructor.bx
+        for lo, hi in cells:
+            pyblaw.cshallowwater.source(qm[lo:hi+1], qp[lo:hi+1], qq[lo:hi], bx[lo:hi],
+                                        self.reconstructor.wq, self.dx[lo:hi], s[lo:hi],
+                                        self.system.g)
+
+        if __debug__:
+            self.debug(qm=qm, qp=qp, qq=qq, s=s, **kwargs)
+
+
+######################################################################
+
+class ShallowWaterSolver(pyblaw.solver.Solver):
+    """Well-balanced shallow-water solver on a uniform grid.
+
+       **Arguments**
+
+       * *x*        - grid boundaries (uniform)
+       * *system*   - ShallowWaterSystem
+       * *order*    - WENO reconstruction order (defaults to 3)
+       * *cfl*      - CFL number (defaults to 0.4)
+
+       Other keyword arguments (eg, *times*, *boundary*, *dumper*)
+       are passed to pyblaw.solver.Solver.  The solver uses the
+       ShallowWaterReconstructor, WellBalancedFlux,
+       WellBalancedSource, the SSPERK3 evolver and adaptive time
+       steps (see pyblaw.solver.Solver).  Walls are set with a
+       reflective boundary that flips the discharge, ie,
+       ``pyblaw.boundary.ReflectiveBoundary(odd=[1])``.
+
+    """
+
+    def __init__(self, x, system, order=3, cfl=0.4, **kwargs):
+        pyblaw.solver.Solver.__init__(
+            self, grid=pyblaw.grid.Grid(x), system=system,
+            reconstructor=ShallowWaterReconstructor(order),
+            flux=WellBalancedFlux(), source=WellBalancedSource(),
+            evolver=pyblaw.evolver.SSPERK3(), cfl=cfl, **kwargs)
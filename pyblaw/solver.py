@@ -6,6 +6,7 @@ import os
 import numpy as np
 
 import pyblaw.base
+import pyblaw.cstep
 import pyblaw.dumper
 import pyblaw.evolver
 
@@ -35,16 +36,85 @@ class Solver(pyblaw.base.Base):
        * *reconstructor*  - pyblaw.system.Reconstructor
        * *flux*           - pyblaw.flux.Flux
        * *source*         - pyblaw.source.Source
+       * *boundary*       - pyblaw.boundary.Boundary (or None)
        * *evolver*        - pyblaw.evolver.Evolver
-       * *dumper*         - pyblaw.dumper.Dumper
+       * *dumper*         - pyblaw.dumper.Dumper (or None)
        * *dump_times*     - dump times
+       * *reducers*       - list of pyblaw.reducer.Reducer
+       * *reduce_every*   - reduce every *reduce_every* steps
+       * *padded*         - use ghost cell padded arrays
+       * *layout*         - array layout: 'C' (cell-major, the default)
+         or 'F' (component-major)
+       * *initial_state*  - initial cell averages (or None)
+       * *compiled*       - use the compiled time stepping loop
+       * *cfl*            - CFL number of adaptive time steps (or None)
        * *times*          - times
 
+       If *initial_state* is given, it is used as the initial cell
+       averages instead of the initial conditions of the system (eg,
+       to restart a run or to propagate a state over a time slice, see
+       pyblaw.parareal.Parareal).
+
+       If *compiled* is True, the time steps are taken by a compiled
+       loop (pyblaw.cstep) that runs many steps per call, and Python
+       is only re-entered at dump, reduction, diagnostic (and trace)
+       steps.  This removes the per step overhead of the Python loop,
+       which dominates for small grids (hundreds of cells).  Every
+       component must then have a compiled kernel (see
+       pyblaw.base.Base.kernel): the reconstructor must be a
+       MUSCLReconstructor or a UniformWENOReconstructor (without
+       *indicator* or *hybrid*), the boundary conditions must be
+       outflow, periodic or reflective, the flux must be an LFFlux with
+       a built-in pointwise flux (pyblaw.flux.LinearFlux, BurgersFlux
+       or TrafficFlux), the evolver must be FE or SSPERK3, and there
+       must be no source.  The results are identical to those of the
+       Python loop.
+
+       If *cfl* is given, each interval between *times* is split into
+       (equal) time steps no larger than ``cfl * min(dx) / speed``,
+       where the speed is the maximum wave speed of the current
+       solution (see pyblaw.system.System.wave_speed), so that the
+       time steps follow the waves (eg, shallow-water flows that
+       speed up or slow down).  The times then only set the dump,
+       reduction and diagnostic steps.  Adaptive time steps are not
+       supported by the compiled loop.
+
+       If *reducers* are given they are updated every *reduce_every*
+       steps (and at the final time), and their final reductions are
+       stored in *reductions* and dumped using the dumper.  Combined
+       with sparse *dump_times* (or no dumper at all), this avoids
+       dumping the full solution history.
+
+       If *boundary* is given, it is passed to the reconstructor,
+       which applies it to fill ghost cells and set the
+       reconstructions at the ends of the domain.  Otherwise the
+       reconstructor applies its own boundary conditions.
+
+       If *layout* is 'F', the cell averages, reconstructions, fluxes
+       and sources (and the work arrays of the various components) are
+       stored component-major, so that each component ``q[:,m]`` is
+       contiguous (see pyblaw.base.Base.set_layout).  The arrays are
+       still indexed as ``q[i,m]``, so that flux and source functions,
+       and the dumpers (whose output is unchanged), work with either
+       layout.  Compiled flux and source functions must handle strided
+       arrays.
+
+       If *padded* is True, the cell averages q and qn (and the stage
+       arrays of the evolver) are allocated with the number of ghost
+       cells required by the reconstructor (see
+       pyblaw.reconstructor.Reconstructor.ghosts) on either side.  The
+       reconstructor fills the ghost cells in place, which avoids
+       copying the cell averages into (and the reconstructions out
+       of) separate ghost cell arrays at every stage.  The padded
+       arrays are stored in *qg* and *qng*, and *q* and *qn* are views
+       of their interior cells.
+
        **Instance variables**
 
        * *t*             - times
        * *dt*            - time steps
        * *t_dump*        - dump times
+       * *reductions*    - final reductions (dictionary)
 
        **Instance variables pulled from elsewhere**
 
@@ -66,16 +136,31 @@ class Solver(pyblaw.base.Base):
     system  = None                      # pyblaw.system.System
     flux    = None                      # pyblaw.flux.Flux
     source  = None                      # pyblaw.source.Source
+    boundary = None                     # pyblaw.boundary.Boundary
     evolver = None                      # pyblaw.evolver.Evolver
     dumper  = None                      # pyblaw.dumper.Dumper
 
+    reducers     = []                   # list of pyblaw.reducer.Reducer
+    reduce_every = 1                    # reduction frequency
+    reductions   = {}                   # final reductions
+
+    padded = False                      # ghost cell padded arrays
+    layout = 'C'                        # array layout
+
+    initial_state = None                # initial cell averages
+    compiled = False                    # compiled time stepping
+    cfl = None                          # adaptive time steps
+
 
     def __init__(self,
                  grid=None, system=None,
                  reconstructor=None, evolver=None,
-                 flux=None, source=None,
+                 flux=None, source=None, boundary=None,
                  dumper=None, dump_times=None,
                  diagnostic_times=None,
+                 reducers=None, reduce_every=1,
+                 padded=False, layout='C',
+                 initial_state=None, compiled=False, cfl=None,
                  times=[],
                  **kwargs):
 
@@ -95,7 +180,15 @@ class Solver(pyblaw.base.Base):
         self.flux           = flux
         self.evolver        = evolver
         self.source         = source
+        self.boundary       = boundary
         self.dumper         = dumper
+        self.reducers       = reducers or []
+        self.reduce_every   = reduce_every
+        self.padded         = padded
+        self.initial_state  = initial_state
+        self.compiled       = compiled
+        self.cfl            = cfl
+        self.set_layout(layout)
 
         self.initialised = False
 
@@ -108,8 +201,8 @@ class Solver(pyblaw.base.Base):
         """Initialise the solver.
 
            Call all allocate methods, set the initial condtions
-           (defined by *system.initial_conditions*), call pre-run
-           hooks.
+           (defined by *system.initial_conditions*, or
+           *initial_state*), call pre-run hooks.
 
         """
 
@@ -118,10 +211,20 @@ class Solver(pyblaw.base.Base):
         self.dx = self.grid.sizes()
         self.p  = self.system.p
 
+        if self.padded:
+            g = self.reconstructor.ghosts
+        else:
+            g = 0
+
         # link everything up
         self.system.set_grid(self.grid)
         self.reconstructor.set_grid(self.grid)
         self.reconstructor.set_system(self.system)
+        self.reconstructor.set_padded(self.padded)
+        self.reconstructor.set_boundary(self.boundary)
+        if self.boundary is not None:
+            self.boundary.set_grid(self.grid)
+            self.boundary.set_system(self.system)
         self.flux.set_grid(self.grid)
         self.flux.set_system(self.system)
         self.flux.set_reconstructor(self.reconstructor)
@@ -135,36 +238,66 @@ class Solver(pyblaw.base.Base):
         self.evolver.set_flux(self.flux)
         self.evolver.set_source(self.source)
         self.evolver.set_times(self.t)
-        self.dumper.set_dims(self.grid.centers(), self.t_dump)
-        self.dumper.set_system(self.system)
+        self.evolver.set_ghosts(g)
+        if self.dumper is not None:
+            self.dumper.set_dims(self.grid.centers(), self.t_dump)
+            self.dumper.set_system(self.system)
+        for reducer in self.reducers:
+            reducer.set_grid(self.grid)
+            reducer.set_system(self.system)
+
+        # set layouts
+        for component in [ self.system, self.reconstructor, self.flux,
+                           self.source, self.evolver, self.boundary ] + self.reducers:
+            if component is not None:
+                component.set_layout(self.layout)
 
         # allocate
         self.system.allocate()
+        if self.boundary is not None:
+            self.boundary.allocate()
         self.reconstructor.allocate()
         self.flux.allocate()
         if self.source is not None:
             self.source.allocate()
         self.evolver.allocate()
+        for reducer in self.reducers:
+            reducer.allocate()
         self.allocate()
 
-        self.q  = np.zeros((self.N, self.p))
-        self.qn = np.zeros((self.N, self.p))
+        self.qg  = np.zeros((self.N+2*g, self.p), order=self.layout)
+        self.qng = np.zeros((self.N+2*g, self.p), order=self.layout)
+        self.q   = self.qg[g:g+self.N]
+        self.qn  = self.qng[g:g+self.N]
 
         # apply initial conditions
-        self.system.initial_conditions(self.t[0], self.q)
+        if self.initial_state is not None:
+            self.q[:,:] = self.initial_state
+        else:
+            self.system.initial_conditions(self.t[0], self.q)
+        self.qn[:,:] = self.q
 
         # run pre-run hooks
-        pre_run_args = {'t0': self.t[0], 'q0': self.q}
+        pre_run_args = {'t0': self.t[0], 'q0': self.q, 'qg0': self.qg}
         self.system.pre_run(**pre_run_args)
+        if self.boundary is not None:
+            self.boundary.pre_run(**pre_run_args)
         self.reconstructor.pre_run(**pre_run_args)
         self.flux.pre_run(**pre_run_args)
         if self.source is not None:
             self.source.pre_run(**pre_run_args)
         self.evolver.pre_run(**pre_run_args)
+        for reducer in self.reducers:
+            reducer.pre_run(**pre_run_args)
         self.pre_run(**pre_run_args)
 
+        # gather compiled kernels
+        if self.compiled:
+            self.kernels = self.compiled_kernels()
+
         # init the dumper
-        self.dumper.init_dump()
+        if self.dumper is not None:
+            self.dumper.init_dump()
 
         # done
         self.initialised = True
@@ -189,6 +322,72 @@ class Solver(pyblaw.base.Base):
         raise NotImplementedError, 'build_cache not implemented'
 
 
+    ####################################################################
+    # compiled stepping
+    #
+
+    def compiled_kernels(self):
+        """Return the compiled kernels of the reconstructor, flux and
+        evolver (see *compiled*)."""
+
+        if self.source is not None:
+            raise ValueError, 'compiled stepping does not support sources'
+
+        if self.cfl is not None:
+            raise ValueError, 'compiled stepping does not support adaptive time steps'
+
+        kernels = []
+        for name in ('reconstructor', 'flux', 'evolver'):
+            kernel = getattr(self, name).kernel()
+            if kernel is None:
+                raise ValueError, 'the %s does not have a compiled kernel' % name
+            kernels.append(kernel)
+
+        return kernels
+
+    def next_stop(self, n):
+        """Return the next step (after step *n*) at which Python must
+        be re-entered (dumps, reductions, diagnostics and tracing)."""
+
+        stops = [ len(self.t) - 1 ]
+
+        if self.dumper is not None and len(self.t_dump) > 0:
+            stops.append(np.searchsorted(self.t, self.t_dump[0]))
+
+        if self.reducers:
+            stops.append((n / self.reduce_every + 1) * self.reduce_every)
+
+        if self.t_diag is not None and len(self.t_diag) > 0:
+            stops.append(np.searchsorted(self.t, self.t_diag[0]))
+
+        if self.trace != 0:
+            stops.append(n + 1)
+
+        return max(n + 1, min(stops))
+
+
+    def time_step(self, q, tau, n):
+        """Return the time step from *tau* given the cell averages
+        *q* at step *n*, and whether it reaches the next time (see
+        *cfl*)."""
+
+        if self.cfl is None:
+            return self.dt[n], True
+
+        speed = self.system.wave_speed(q)
+        if speed is None:
+            raise ValueError, 'adaptive time steps require the wave speed of the system'
+
+        dt = self.t[n+1] - tau
+        if speed > 0.0:
+            steps = max(1, int(np.ceil(dt * speed / (self.cfl * self.dx.min()))))
+            dt = dt / steps
+        else:
+            steps = 1
+
+        return dt, steps == 1
+
+
     ####################################################################
     # run
     #
@@ -213,12 +412,16 @@ class Solver(pyblaw.base.Base):
 
         q = self.q
         qn = self.qn
+        qg = self.qg
+        qng = self.qng
 
         if kwargs is None:
             kwargs = {}
 
         #### giv'r!
-        for n, t in enumerate(self.t[0:-1]):
+        n = 0
+        while n < len(self.t) - 1:
+            t = self.t[n]
 
             # debug: time step header
             if __debug__:
@@ -229,12 +432,17 @@ class Solver(pyblaw.base.Base):
                     print "n = %d, t = %11.5f, mass = %11.5f" % (n, t, self.system.mass(q))
 
             # dump solution if necessary
-            if t >= self.t_dump[0]:
+            if self.dumper is not None and len(self.t_dump) > 0 and t >= self.t_dump[0]:
                 print "data dump at   t = %11.5f, mass = %11.5f" % (t, self.system.mass(q))
                 self.dumper.dump(q)
-                while t >= self.t_dump[0]:
+                while len(self.t_dump) > 0 and t >= self.t_dump[0]:
                     self.t_dump = self.t_dump[1:]
 
+            # update reductions if necessary
+            if n % self.reduce_every == 0:
+                for reducer in self.reducers:
+                    reducer.reduce(q, n=n, t=t)
+
             # diagnose solution if necessary
             if (self.t_diag is not None) and (t >= self.t_diag[0]):
                 diag = self.system.diagnostics(q)
@@ -246,23 +454,62 @@ class Solver(pyblaw.base.Base):
                 while t >= self.t_diag[0]:
                     self.t_diag = self.t_diag[1:]
 
-            # evolve
-            kwargs.update({'n': n, 't': t})
+            # evolve (compiled)
+            if self.compiled:
+                m = self.next_stop(n)
+                pyblaw.cstep.run(q, self.t, n, m, *self.kernels)
+                n = m
+                continue
+
+            # evolve (in several steps if the time steps are adaptive)
+            tau  = t
+            last = False
+            while not last:
+                dt, last = self.time_step(q, tau, n)
+                kwargs.update({'n': n, 't': tau, 'dt': dt})
+
+                if self.source is not None:
+                    self.evolver.evolve(qg, qng, **kwargs)
+                else:
+                    self.evolver.evolve_homogeneous(qg, qng, **kwargs)
+                q[:,:] = qn[:,:]
 
-            if self.source is not None:
-                self.evolver.evolve(q, qn, **kwargs)
-            else:
-                self.evolver.evolve_homogeneous(q, qn, **kwargs)
-            q[:,:] = qn[:,:]
+                tau = tau + dt
 
             # debug: break?
             if __debug__:
                 if self.trace > 0 and n == self.trace:
                     raise ValueError, 'trace stop'
 
+            n += 1
+
 
         # last dump if necessary
-        if len(self.t_dump) > 0:
+        if self.dumper is not None and len(self.t_dump) > 0:
             print "data dump at t = %11.2f, mass = %11.5f" % (self.t[-1], self.system.mass(q))
             self.dumper.dump(q)
 
+        # final reductions
+        if self.reducers:
+            self.reductions = {}
+            for reducer in self.reducers:
+                reducer.reduce(q, n=len(self.t)-1, t=self.t[-1])
+                self.reductions[reducer.name] = reducer.result()
+
+            if self.dumper is not None:
+                self.dumper.dump_reductions(self.reductions)
+
+        # run post-run hooks
+        post_run_args = {'t': self.t[-1], 'q': q}
+        self.system.post_run(**post_run_args)
+        if self.boundary is not None:
+            self.boundary.post_run(**post_run_args)
+        self.reconstructor.post_run(**post_run_args)
+        self.flux.post_run(**post_run_args)
+        if self.source is not None:
+            self.source.post_run(**post_run_args)
+        self.evolver.post_run(**post_run_args)
+        for reducer in self.reducers:
+            reducer.post_run(**post_run_args)
+        self.post_run(**post_run_args)
+
@@ -1,4 +1,4 @@
-"""PyBLAW abstract Source and concrete LinearQuad3Source classes.
+"""PyBLAW abstract Source and concrete SimpleSource and QuadratureSource classes.
 
 """
 
@@ -66,10 +66,25 @@ class SimpleSource(Source):
        The source function is called as ``source(qm, qp, qq, dx, s,
        **kwargs)`` where:
 
-       * XXX
+       * ``qm[i,:]`` and ``qp[i,:]`` are the reconstructions of q at
+         the cell boundaries from the left (-) and right (+)
+         respectively (so that the reconstructions at the left and
+         right of cell i are ``qp[i]`` and ``qm[i+1]``);
+
+       * ``qq[i,l,:]`` is the reconstruction of q at Gauss point l of
+         cell i (see pyblaw.reconstructor.Reconstructor.n);
+
+       * ``dx`` are the cell sizes;
+
+       * ``s[i,:]`` is the (cell averaged) source of cell i, which
+         should be set by the source function;
+
+       * ``kwargs`` are the keyword arguments of the evolver (eg,
+         the time step ``n`` and the time ``t``).
 
        Implementing the source function in Cython (or similar) is
-       strongly recommended.
+       strongly recommended.  Pointwise sources are more easily
+       handled by QuadratureSource.
 
     """
 
@@ -84,3 +99,74 @@ class SimpleSource(Source):
 
         if __debug__:
             self.debug(qm=qm, qp=qp, qq=qq, s=s, **kwargs)
+
+
+######################################################################
+
+class QuadratureSource(Source):
+    """Quadrature (pointwise) source.
+
+       This source integrates a user supplied pointwise source over
+       each cell with the Gauss points of the reconstructor.
+
+       **Arguments**
+
+       * *source* - pointwise source function (callable)
+
+       The source function is called as ``source(q, x, t)`` where
+       ``q`` is an ``(M, p)`` array of states at the ``M`` points
+       ``x`` and ``t`` is the (stage) time, and should return an
+       ``(M, p)`` array.  It is called once per stage with the
+       reconstructions at every Gauss point of every cell, and the
+       cell averages of the source are computed with the
+       (precomputed) quadrature weights, so a source written with
+       NumPy operations is evaluated in one vectorised pass, eg::
+
+         def s(q, x, t):
+             return -q * np.sin(x)[:,np.newaxis]
+
+       The reconstructor must reconstruct q at the Gauss points of
+       each cell (ie, *n* must be non-zero and the Gauss points and
+       normalised quadrature weights must be stored in *xi* and *wq*,
+       eg, pyblaw.muscl.MUSCLReconstructor or
+       pyblaw.uniformweno.UniformWENOReconstructor with
+       *quadrature*).  The quadrature is exact for sources that are
+       polynomials of degree ``2n-1`` in x over each cell.
+
+       If the keyword argument ``cells`` is given (see
+       pyblaw.evolver.Evolver regarding *threshold*), *source* is
+       called once per (lo, hi) range of cells.
+
+    """
+
+    def __init__(self, source):
+        self.s = source
+
+    def pre_run(self, **kwargs):
+        n = self.reconstructor.n
+        if n == 0 or len(getattr(self.reconstructor, 'wq', [])) != n:
+            raise ValueError, 'QuadratureSource requires a reconstructor with Gauss points'
+
+        x  = self.grid.centers()
+        dx = self.grid.sizes()
+
+        self.xq = (x[:,np.newaxis] + dx[:,np.newaxis] * self.reconstructor.xi).ravel()
+        self.wq = self.reconstructor.wq
+
+    def source(self, qm, qp, qq, s, **kwargs):
+        N, n, p = qq.shape
+
+        cells = kwargs.get('cells')
+        if cells is None:
+            cells = [ (0, N) ]
+
+        t = kwargs.get('tau', kwargs.get('t', 0.0))
+        for lo, hi in cells:
+            M  = hi - lo
+            xq = self.xq[lo*n:hi*n]
+            sq = np.asarray(self.s(qq[lo:hi].reshape((M*n, p)), xq, t)).reshape((M, n, p))
+
+            s[lo:hi] = np.tensordot(self.wq, sq, axes=(0, 1))
+
+        if __debug__:
+            self.debug(qm=qm, qp=qp, qq=qq, s=s, **kwargs)
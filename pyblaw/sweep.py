@@ -0,0 +1,268 @@
+"""PyBLAW parameter sweeps.
+
+"""
+
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+
+import h5py
+import pyblaw.cache
+
+
+######################################################################
+
+def parameter_grid(**axes):
+    """Return the list of parameter dictionaries of the cartesian
+    product of *axes*.
+
+       For example, ``parameter_grid(a=[1, 2], b=[0.1, 0.2])`` returns
+       four parameter dictionaries.
+
+    """
+
+    names = sorted(axes)
+
+    return [ dict(zip(names, values))
+             for values in itertools.product(*[ axes[name] for name in names ]) ]
+
+
+def final_state(solver):
+    """Return the final cell averages and reductions of *solver*
+    (default sweep result)."""
+
+    result = { 'q': solver.q }
+    for name, reduction in solver.reductions.iteritems():
+        for key, value in reduction.iteritems():
+            result['%s/%s' % (name, key)] = value
+
+    return result
+
+
+######################################################################
+
+class Sweep(object):
+    """Parameter sweep runner.
+
+       **Arguments**
+
+       * *factory*     - solver factory (callable)
+       * *cases*       - list of parameter dictionaries (see
+         *parameter_grid*)
+       * *output*      - results file name (defaults to 'sweep.h5')
+       * *processes*   - number of processes (defaults to the number
+         of cores)
+       * *retries*     - number of times a failed case is retried
+         (defaults to 1)
+       * *result*      - result callable (defaults to *final_state*)
+       * *initializer* - worker initializer (callable or None)
+       * *initargs*    - arguments of the worker initializer
+
+       The solver factory is called as ``factory(parameters)`` and
+       should return a pyblaw.solver.Solver (whose system usually
+       carries *parameters*).  The solver is run, and the result
+       callable is called as ``result(solver)`` and should return a
+       dictionary of arrays.  Most sweeps do not need a dumper (see
+       pyblaw.solver.Solver regarding reducers).  The factory, result
+       and initializer callables must be picklable (eg, module level
+       functions).
+
+       The cases are run by a pool of worker processes that live for
+       the whole sweep.  Within each worker, WENO caches are loaded
+       once and are reused by subsequent cases (see
+       pyblaw.cache.load), also when the factory looks them up in a
+       pyblaw.cache.CacheStore for each case, and memory-mapped
+       caches (*mmap*) are exported once and shared by all workers.  The *initializer* may be used to warm
+       up the workers further (eg, to import Cython modules).
+
+       Failed cases (ie, cases for which the factory, the solver or
+       the result callable raise an exception) are retried up to
+       *retries* times.  Cases whose worker process dies (eg, it is
+       killed by a signal or by the out-of-memory killer) are marked
+       as failed, and are not retried.
+
+       The results are written to the HDF5 file *output* as they
+       come in.  The hierarchy within the file is:
+
+       * ``/index/X`` - value of parameter X of each case
+       * ``/index/status`` - status of each case (0 for success, 1
+         for failure, -1 if not run)
+       * ``/index/attempts`` - number of attempts of each case
+       * ``/index/setup_time`` - solver setup time of each case
+       * ``/index/run_time`` - solver run time of each case
+       * ``/cases/I/R`` - result R of case I (the parameters,
+         timings and the error of failed cases are stored in the
+         attributes of ``/cases/I``)
+
+    """
+
+    def __init__(self, factory, cases, output='sweep.h5', processes=None,
+                 retries=1, result=final_state, initializer=None, initargs=()):
+
+        self.factory     = factory
+        self.cases       = list(cases)
+        self.output      = output
+        self.processes   = processes or multiprocessing.cpu_count()
+        self.retries     = retries
+        self.result      = result
+        self.initializer = initializer
+        self.initargs    = initargs
+
+
+    def run(self):
+        """Run the sweep and return the list of case statuses."""
+
+        self.init_output()
+
+        tasks = [ (index, parameters, self.factory, self.result, self.retries)
+                  for index, parameters in enumerate(self.cases) ]
+
+        self.status = [ -1 ] * len(tasks)
+
+        # pid of the worker running each case
+        workers = multiprocessing.RawArray('l', len(tasks))
+
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (self.initializer, self.initargs, workers))
+        lost = False
+        try:
+            pending = dict([ (task[0], pool.apply_async(_run_case, (task,)))
+                             for task in tasks ])
+
+            while pending:
+                for index, job in pending.items():
+                    if job.ready():
+                        self.store(job.get())
+                        del pending[index]
+
+                # the pool replaces dead workers, but their cases never
+                # complete
+                alive = set([ worker.pid for worker in multiprocessing.active_children() ])
+                for index, job in pending.items():
+                    pid = workers[index]
+                    if pid and pid not in alive and not job.ready():
+                        self.store((index, 1, 1, 0.0, 0.0, {},
+                                    'worker process %d died' % pid))
+                        del pending[index]
+                        lost = True
+
+                if pending:
+                    pending.values()[0].wait(0.05)
+
+        finally:
+            # lost cases would keep the pool from shutting down
+            if lost:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        return self.status
+
+
+    def init_output(self):
+        """Create the results file and the case index."""
+
+        hdf = h5py.File(self.output, 'w')
+        n = len(self.cases)
+
+        sgrp = hdf.create_group('index')
+
+        names = sorted(set([ name for case in self.cases for name in case ]))
+        for name in names:
+            values = [ case.get(name) for case in self.cases ]
+            try:
+                data = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                data = np.array([ str(value) for value in values ])
+            sgrp.create_dataset(name, data=data)
+
+        sgrp.create_dataset('status', data=-np.ones(n, dtype=np.int8))
+        sgrp.create_dataset('attempts', data=np.zeros(n, dtype=np.int32))
+        sgrp.create_dataset('setup_time', data=np.zeros(n))
+        sgrp.create_dataset('run_time', data=np.zeros(n))
+
+        hdf.create_group('cases')
+        hdf.close()
+
+
+    def store(self, record):
+        """Store the result *record* of a case."""
+
+        index, status, attempts, setup_time, run_time, result, error = record
+
+        self.status[index] = status
+
+        hdf = h5py.File(self.output, 'a')
+
+        sgrp = hdf['index']
+        sgrp['status'][index]     = status
+        sgrp['attempts'][index]   = attempts
+        sgrp['setup_time'][index] = setup_time
+        sgrp['run_time'][index]   = run_time
+
+        cgrp = hdf['cases'].create_group(str(index))
+        for key, value in self.cases[index].iteritems():
+            try:
+                cgrp.attrs[key] = value
+            except (TypeError, ValueError):
+                cgrp.attrs[key] = str(value)
+
+        cgrp.attrs['status']     = status
+        cgrp.attrs['attempts']   = attempts
+        cgrp.attrs['setup_time'] = setup_time
+        cgrp.attrs['run_time']   = run_time
+        if error:
+            cgrp.attrs['error'] = error
+
+        for key, value in result.iteritems():
+            cgrp.create_dataset(key, data=value)
+
+        hdf.close()
+
+
+######################################################################
+
+_workers = None                         # pid of the worker running each case
+
+def _init_worker(initializer, initargs, workers):
+    """Initialise a sweep worker process."""
+
+    global _workers
+    _workers = workers
+
+    pyblaw.cache.memoize = True
+
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_case(task):
+    """Run one case of a sweep (with retries)."""
+
+    index, parameters, factory, result, retries = task
+
+    if _workers is not None:
+        _workers[index] = os.getpid()
+
+    error = ''
+    for attempt in range(1, retries+2):
+        try:
+            t0 = time.time()
+            solver = factory(parameters)
+            t1 = time.time()
+            solver.run()
+            t2 = time.time()
+
+            data = dict([ (key, np.asarray(value))
+                          for key, value in result(solver).iteritems() ])
+
+            return (index, 0, attempt, t1 - t0, t2 - t1, data, '')
+
+        except Exception:
+            error = traceback.format_exc()
+
+    return (index, 1, retries+1, 0.0, 0.0, {}, error)
@@ -17,6 +17,11 @@ class System(pyblaw.base.Base):
 
        * *p*          - number of unknowns
        * *parameters* - parameters (dictionary)
+       * *frozen*     - list of time-invariant components
+       * *members*    - number of ensemble members (see pyblaw.ensemble)
+
+       Frozen components (eg, bed topography) are reconstructed once
+       (before the run) and are not updated by the evolvers.
 
        **Instrance variables pulled from elsewhere**
 
@@ -27,6 +32,8 @@ class System(pyblaw.base.Base):
        * *allocate*           - allocate memory
        * *initial_conditions* - set initial condtions at time t
        * *mass*               - compute 'mass' of system
+       * *wave_speed*         - maximum wave speed (for adaptive time
+         steps, see pyblaw.solver.Solver)
        * *diagnostics*        - diagnose solution
 
        **Methods**
@@ -35,6 +42,8 @@ class System(pyblaw.base.Base):
 
     p = 0                               # number of unknowns
     parameters = {}                     # parameters
+    frozen = []                         # time-invariant components
+    members = 1                         # ensemble members
 
     def __init__(self, parameters={}, **kwargs):
         self.parameters = parameters
@@ -50,6 +59,10 @@ class System(pyblaw.base.Base):
         """Compute 'mass' of q."""
         pass
 
+    def wave_speed(self, q):
+        """Return the maximum wave speed of q (or None if unknown)."""
+        pass
+
     def diagnostics(self, q):
         """Display/perform diagnostics given q."""
         pass
@@ -67,23 +80,56 @@ class SimpleSystem(System):
 
        * *q0* - initial condition (callable)
        * *parameters* - parameters (dictionary)
+       * *vectorized* - *q0* is vectorized (see below)
+       * *quadrature* - number of Gauss points per cell used to
+         average a vectorized *q0* (defaults to 3)
+       * *frozen* - list of time-invariant components
 
        The initial condition function is called as ``q0(x, t)`` where
        *x* and *t* are real numbers, and should return a vector.  The
        number of components *p* is determined by calling *q0*.
 
+       If *vectorized* is True, *x* is an array of points and *q0*
+       should return an ``(len(x), p)`` array.  In this case *q0* is
+       called once with the Gauss points of every cell, and the cell
+       averages are computed with the (precomputed) Gauss weights.
+
        The first component of the solution is taken to be the 'mass'
        of the system.
 
     """
 
-    def __init__(self, q0, parameters={}):
+    def __init__(self, q0, parameters={}, vectorized=False, quadrature=3,
+                 frozen=[]):
         pyblaw.system.System.__init__(self, parameters)
 
         self.q0 = q0
-        self.p = len(q0(0.0, 0.0))
+        self.frozen = list(frozen)
+        self.vectorized = vectorized
+        self.quadrature = quadrature
+
+        if vectorized:
+            self.p = np.asarray(q0(np.zeros(1), 0.0)).shape[1]
+        else:
+            self.p = len(q0(0.0, 0.0))
+
+    def allocate(self):
+        if self.vectorized:
+            xi, w = np.polynomial.legendre.leggauss(self.quadrature)
+
+            x  = self.grid.centers()
+            dx = self.grid.sizes()
+
+            self.xq = (x[:,np.newaxis] + 0.5 * dx[:,np.newaxis] * xi).ravel()
+            self.wq = 0.5 * w
 
     def initial_conditions(self, t, q):
+        if self.vectorized:
+            N  = q.shape[0]
+            qq = np.asarray(self.q0(self.xq, t)).reshape((N, self.quadrature, self.p))
+            q[:,:] = np.tensordot(self.wq, qq, axes=(0, 1))
+            return
+
         for m in xrange(self.p):
             q[:,m] = self.grid.average(lambda x: self.q0(x, t)[m])
 
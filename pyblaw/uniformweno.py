@@ -0,0 +1,546 @@
+"""PyBLAW cache-free WENO reconstructors for uniform grids.
+
+"""
+
+import math
+import multiprocessing.pool
+import numpy as np
+
+import pyblaw.base
+import pyblaw.reconstructor
+
+
+######################################################################
+
+def _monomial_averages(k, offsets):
+    """Return the matrix A[j,m] of the cell averages of x**m (m <
+    k) over the unit cells centred at *offsets*."""
+
+    A = np.zeros((len(offsets), k))
+    for j, c in enumerate(offsets):
+        for m in range(k):
+            A[j,m] = ((c + 0.5)**(m+1) - (c - 0.5)**(m+1)) / (m+1)
+
+    return A
+
+
+def _monomials(k, xi, derivative=False):
+    """Return the vector of monomials xi**m (m < k), or of their
+    derivatives."""
+
+    if derivative:
+        return np.array([ m * xi**(m-1) if m > 0 else 0.0 for m in range(k) ])
+
+    return np.array([ xi**m for m in range(k) ])
+
+
+def stencil_coefficients(k, xi, derivative=False):
+    """Return the uniform grid reconstruction coefficients of each
+    stencil for reconstructing at *xi*.
+
+       Returns the array c where ``c[r,j]`` is the coefficient of
+       cell ``i-r+j`` of the reconstruction in cell ``i`` from stencil
+       ``r`` (see *coefficients*).  If *derivative* is True, the
+       coefficients reconstruct the derivative (in units of the cell
+       size) instead.
+
+    """
+
+    c = np.zeros((k, k))
+    for r in range(k):
+        A = _monomial_averages(k, [ j - r for j in range(k) ])
+        c[r,:] = np.linalg.solve(A.T, _monomials(k, xi, derivative))
+
+    return c
+
+
+def big_stencil_coefficients(k, xi, derivative=False):
+    """Return the uniform grid (linear) reconstruction coefficients
+    of cells ``i-k+1`` to ``i+k-1`` for reconstructing at *xi* in cell
+    ``i`` (or the derivative, see *stencil_coefficients*)."""
+
+    A = _monomial_averages(2*k-1, range(-(k-1), k))
+
+    return np.linalg.solve(A.T, _monomials(2*k-1, xi, derivative))
+
+
+def coefficients(k, xi):
+    """Return the uniform grid WENO reconstruction coefficients and
+    optimal weights for reconstructing at *xi*.
+
+       **Arguments**
+
+       * *k*  - WENO order (number of cells in each stencil)
+       * *xi* - reconstruction point relative to the cell centre, in
+         units of the cell size (-1/2 for the left boundary and +1/2
+         for the right boundary)
+
+       Returns the tuple (c, d) where ``c[r,j]`` is the coefficient of
+       cell ``i-r+j`` of the reconstruction in cell ``i`` from stencil
+       ``r``, and ``d[r]`` is the optimal (linear) weight of stencil
+       ``r``.
+
+    """
+
+    # reconstruction from each stencil
+    c = stencil_coefficients(k, xi)
+
+    # reconstruction from the big stencil
+    C = big_stencil_coefficients(k, xi)
+
+    # optimal weights: sum_r d[r] c[r] = C
+    M = np.zeros((2*k-1, k))
+    for r in range(k):
+        M[k-1-r:2*k-1-r,r] = c[r,:]
+
+    d = np.linalg.lstsq(M, C, rcond=-1)[0]
+    if abs(np.dot(M, d) - C).max() > 1e-10:
+        raise ValueError, 'optimal weights do not exist at xi = %g' % xi
+
+    return c, d
+
+
+def smoothness(k):
+    """Return the uniform grid WENO smoothness coefficients.
+
+       Returns the list L such that the smoothness indicator of
+       stencil ``r`` is ``sum_l (sum_j L[r][l,j] q[i-r+j])**2``, ie,
+       ``L[r].T L[r]`` is the (positive semi-definite) quadratic form
+       of the Jiang-Shu smoothness indicator.
+
+    """
+
+    def integral(a):
+        return (0.5**(a+1) - (-0.5)**(a+1)) / (a+1)
+
+    # S[m,n] = sum_l int D^l x^m D^l x^n
+    S = np.zeros((k, k))
+    for l in range(1, k):
+        for m in range(l, k):
+            for n in range(l, k):
+                dm = math.factorial(m) / math.factorial(m-l)
+                dn = math.factorial(n) / math.factorial(n-l)
+                S[m,n] += dm * dn * integral(m+n-2*l)
+
+    L = []
+    for r in range(k):
+        A = _monomial_averages(k, [ j - r for j in range(k) ])
+        Ainv = np.linalg.inv(A)
+        B = np.dot(Ainv.T, np.dot(S, Ainv))
+
+        lam, V = np.linalg.eigh(0.5 * (B + B.T))
+        keep = lam > 1e-12 * lam.max()
+        L.append(np.sqrt(lam[keep])[:,np.newaxis] * V[:,keep].T)
+
+    return L
+
+
+######################################################################
+
+class UniformWENOReconstructor(pyblaw.reconstructor.Reconstructor):
+    """Cache-free WENO reconstructor for uniform grids.
+
+       **Arguments**
+
+       * *order*   - WENO reconstruction order k (2, 3 or 4)
+       * *epsilon* - WENO epsilon (defaults to 1e-6)
+       * *indicator* - shared smoothness indicator (see
+         pyblaw.wenoclaw.WENOCLAWReconstructor)
+       * *hybrid*  - shock sensor threshold (defaults to None, ie, use
+         WENO in every cell)
+       * *threads* - number of threads (defaults to None, ie, serial)
+       * *quadrature* - number of Gauss points per cell (defaults to 0)
+
+       The WENO order k is the number of cells in each stencil (as
+       for WENOCLAWReconstructor), so that the reconstruction is
+       formally 3rd, 5th or 7th order accurate for k = 2, 3 or 4.
+
+       The reconstruction coefficients, optimal weights and
+       smoothness coefficients of a uniform grid do not depend on the
+       cell size, and are computed in closed form when the
+       reconstructor is created, so no cache is required.  The
+       reconstruction is vectorised across cells and components.
+
+       The cell averages are copied into an array with k-1 ghost
+       cells on either side.  The ghost cells are filled by the
+       boundary conditions (see pyblaw.boundary), or with the end
+       values if no boundary conditions are set, in which case the
+       reconstructions at the ends of the domain are taken to be
+       continuous.  If the solver uses ghost cell padded
+       arrays (see pyblaw.solver.Solver), the ghost cells are filled
+       in place instead.
+
+       If *quadrature* is non-zero, q is also reconstructed at the
+       *quadrature* Gauss-Legendre points of each cell and stored in
+       *qq* (for use by the source, see
+       pyblaw.source.QuadratureSource).  Optimal weights do not exist
+       at every Gauss point, so the stencils are combined with equal
+       linear weights there.  The Gauss points (relative to the cell
+       centres, in units of the cell size) and the quadrature weights
+       (normalised to sum to one) are stored in *xi* and *wq*.
+
+       If *hybrid* is given, a cheap shock sensor is evaluated first:
+       a cell is flagged if the magnitude of the second difference of
+       q (or of the indicator field) across it is larger than *hybrid*
+       times the range of q over the whole domain.  Cells with a
+       flagged cell in their WENO stencil are reconstructed with WENO,
+       and all other cells are reconstructed with the linear
+       (optimal weight) big stencil reconstruction, so that the
+       smoothness indicators and nonlinear weights are only computed
+       near discontinuities.  A threshold of about 0.05 works well in
+       practice; the number of cells that used WENO in the last
+       reconstruction is stored in *troubled*.
+
+       If *threads* is given, the cells are split into *threads*
+       contiguous blocks that are reconstructed concurrently by a
+       thread pool.  Each block writes to disjoint rows of qm and qp.
+       Since NumPy releases the GIL in its (element-wise) array
+       operations, this speeds up the reconstruction of large grids
+       (thousands of cells per thread) on many-core machines; for
+       small grids the threading overhead dominates.
+
+    """
+
+    def __init__(self, order=3, epsilon=1e-6, indicator=None, hybrid=None,
+                 threads=None, quadrature=0):
+        self.k = order
+        self.epsilon = epsilon
+        self.indicator = indicator
+        self.hybrid = hybrid
+        self.threads = threads
+        self.g = order - 1
+        self.ghosts = order - 1
+        self.width = order - 1
+        self.blocks = None
+        self.pool = None
+
+        self.c = {}
+        self.d = {}
+        self.C = {}
+        for point, xi in (('left', -0.5), ('right', 0.5)):
+            c, d = coefficients(order, xi)
+            self.c[point], self.d[point] = c, d
+
+            # linear (big stencil) coefficients of cells i-k+1 to i+k-1
+            self.C[point] = np.zeros(2*order-1)
+            for r in range(order):
+                self.C[point][order-1-r:2*order-1-r] += d[r] * c[r,:]
+
+        # gauss points (equal linear weights)
+        self.n  = quadrature
+        self.xi = np.zeros(0)
+        self.wq = np.zeros(0)
+        if quadrature > 0:
+            xi, w = np.polynomial.legendre.leggauss(quadrature)
+            self.xi = 0.5 * xi
+            self.wq = 0.5 * w
+
+        for l in range(quadrature):
+            self.c[l] = stencil_coefficients(order, self.xi[l])
+            self.d[l] = np.ones(order) / order
+            self.C[l] = big_stencil_coefficients(order, self.xi[l])
+
+        self.points = [ 'left', 'right' ] + range(quadrature)
+
+        self.L = smoothness(order)
+
+
+    def allocate(self):
+        N = self.grid.size
+        p = self.system.p
+
+        if not self.padded:
+            self.qg = np.zeros((N+2*self.g, p), order=self.layout)
+
+        if self.threads is not None and self.threads > 1:
+            threads = min(self.threads, N)
+            edges = [ N*b/threads for b in range(threads+1) ]
+            self.blocks = zip(edges[:-1], edges[1:])
+
+
+    def pre_run(self, **kwargs):
+        dx = self.grid.sizes()
+        if abs(dx - dx[0]).max() > 1e-10 * abs(dx[0]):
+            raise ValueError, 'UniformWENOReconstructor requires a uniform grid'
+
+
+    def post_run(self, **kwargs):
+        # release the worker threads (the pool is created again if the
+        # reconstructor is used after the run)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+    def kernel(self):
+        boundary = self.boundary_kernel()
+        if boundary is None or self.indicator is not None or self.hybrid is not None:
+            return None
+
+        k = self.k
+        L = np.zeros((k, k, k))
+        for r in range(k):
+            L[r,:len(self.L[r]),:] = self.L[r]
+
+        return ('weno', k, self.epsilon, self.c['left'], self.c['right'],
+                self.d['left'], self.d['right'], L, boundary)
+
+
+    def fill_ghosts(self, qg, **kwargs):
+        """Fill the ghost cells of *qg* (boundary conditions, or end
+        values)."""
+
+        g = self.g
+
+        if self.boundary is not None:
+            self.boundary.fill(qg, g, **kwargs)
+            return
+
+        qg[:g,:]  = qg[g,:]
+        qg[-g:,:] = qg[-g-1,:]
+
+
+    def close(self, qm, qp, **kwargs):
+        """Set the reconstructions at the ends of the domain."""
+
+        if self.boundary is not None:
+            self.boundary.close(qm, qp, **kwargs)
+            return
+
+        qm[0,:]  = qp[0,:]
+        qp[-1,:] = qm[-1,:]
+
+
+    def reconstruct_block(self, qg, qm, qp, qq, lo, hi):
+        """Reconstruct the cells lo to hi-1 given the ghost cell
+        padded cell averages *qg*.
+
+        The left and right reconstructions of cell i are stored in
+        ``qp[i]`` and ``qm[i+1]`` respectively, and the
+        reconstructions at its Gauss points in ``qq[i]``.  Returns the
+        number of troubled cells (see *hybrid*).
+
+        """
+
+        g = self.g
+        n = hi - lo
+
+        cols = pyblaw.base.columns(self.components)
+
+        # shifted views: s[o] are the cell averages of cells i+o
+        qb = qg[lo:hi+2*g]
+
+        s = {}
+        for o in range(-g, g+1):
+            s[o] = qb[g+o:g+o+n,cols]
+
+        if self.indicator is None:
+            si = s
+        else:
+            qi = pyblaw.reconstructor.indicator_field(qb, self.indicator)[:,np.newaxis]
+
+            si = {}
+            for o in range(-g, g+1):
+                si[o] = qi[g+o:g+o+n]
+
+        outs = [ qp[lo:hi], qm[lo+1:hi+1] ] + [ qq[lo:hi,l] for l in range(self.n) ]
+
+        if self.hybrid is None:
+            for out, v in zip(outs, self.weno(s, si)):
+                out[:,cols] = v
+            return 0
+
+        # linear reconstructions everywhere...
+        for point, out in zip(self.points, outs):
+            C = self.C[point]
+
+            v = C[0] * s[-g]
+            for o in range(-g+1, g+1):
+                v = v + C[g+o] * s[o]
+
+            out[:,cols] = v
+
+        # ... and WENO in troubled cells
+        if self.indicator is None:
+            qs = qb[:,cols]
+        else:
+            qs = qi
+
+        troubled = np.nonzero(self.sensor(qs, n))[0]
+
+        if len(troubled) == 0:
+            return 0
+
+        st  = dict([ (o, s[o][troubled]) for o in s ])
+        sit = dict([ (o, si[o][troubled]) for o in si ])
+
+        if isinstance(cols, slice):
+            idx = (troubled, cols)
+        else:
+            idx = np.ix_(troubled, cols)
+
+        for out, v in zip(outs, self.weno(st, sit)):
+            out[idx] = v
+
+        return len(troubled)
+
+
+    def sensor(self, qs, n):
+        """Return the troubled cell flags of the n cells of the ghost
+        cell padded block *qs*.
+
+        A cell is troubled if a cell in its WENO stencil has a second
+        difference that is larger than *hybrid* times the range of the
+        solution (see *reconstruct*).
+
+        """
+
+        g = self.g
+
+        dd = abs(qs[2:] - 2.0*qs[1:-1] + qs[:-2]) > self.hybrid * self.scale
+        dd = dd.any(axis=1)
+
+        # dilate by the stencil width: cell i (padded index i+g) is
+        # troubled if a flag in padded cells i to i+2g is set
+        flags = np.zeros(n+2*g+1, dtype=np.int)
+        flags[2:n+2*g] = np.cumsum(dd)
+        flags[n+2*g:] = flags[n+2*g-1]
+
+        return flags[2*g+1:2*g+1+n] > flags[0:n]
+
+
+    def weno(self, s, si):
+        """Return the WENO reconstructions at the left and right
+        boundaries and Gauss points given the shifted cell averages
+        *s* and smoothness indicator fields *si* (see
+        *reconstruct_block*)."""
+
+        beta = self.indicators(si)
+
+        return [ self.combine(s, beta, point) for point in self.points ]
+
+
+    def indicators(self, si):
+        """Return the smoothness indicators of each stencil given the
+        shifted smoothness indicator fields *si*."""
+
+        k = self.k
+
+        beta = []
+        for r in range(k):
+            b = 0.0
+            for row in self.L[r]:
+                t = row[0] * si[-r]
+                for j in range(1, k):
+                    t = t + row[j] * si[j-r]
+                b = b + t*t
+            beta.append(b)
+
+        return beta
+
+
+    def combine(self, s, beta, point):
+        """Return the WENO reconstruction at *point* (eg, 'left')
+        given the shifted cell averages *s* and smoothness indicators
+        *beta*."""
+
+        k = self.k
+        c = self.c[point]
+        d = self.d[point]
+
+        num = 0.0
+        den = 0.0
+        for r in range(k):
+            alpha = d[r] / (self.epsilon + beta[r])**2
+
+            v = c[r,0] * s[-r]
+            for j in range(1, k):
+                v = v + c[r,j] * s[j-r]
+
+            num = num + alpha * v
+            den = den + alpha
+
+        return num / den
+
+
+    def reconstruct(self, q, qm, qp, qq, **kwargs):
+
+        g = self.g
+
+        if self.padded:
+            N  = q.shape[0] - 2*g
+            qg = q
+            q  = qg[g:g+N]
+            qm = qm[g:g+N+1]
+            qp = qp[g:g+N+1]
+        else:
+            N  = q.shape[0]
+            qg = self.qg
+            qg[g:g+N,:] = q[:,:]
+
+        self.fill_ghosts(qg, **kwargs)
+
+        if self.hybrid is not None:
+            if self.indicator is None:
+                qs = q[:,pyblaw.base.columns(self.components)]
+            else:
+                qs = pyblaw.reconstructor.indicator_field(q, self.indicator)[:,np.newaxis]
+            self.scale = qs.max(axis=0) - qs.min(axis=0)
+
+        cells = kwargs.get('cells')
+        if cells is not None:
+            self.troubled = sum([ self.reconstruct_block(qg, qm, qp, qq, lo, hi)
+                                  for lo, hi in cells ])
+        elif self.blocks is None:
+            self.troubled = self.reconstruct_block(qg, qm, qp, qq, 0, N)
+        else:
+            if self.pool is None:
+                self.pool = multiprocessing.pool.ThreadPool(len(self.blocks))
+
+            def block(b):
+                return self.reconstruct_block(qg, qm, qp, qq, b[0], b[1])
+            self.troubled = sum(self.pool.map(block, self.blocks))
+
+        self.close(qm, qp, **kwargs)
+
+        if __debug__:
+            self.debug(q=q, qp=qp, qm=qm, qq=qq, **kwargs)
+
+
+######################################################################
+
+class PeriodicUniformWENOReconstructor(UniformWENOReconstructor):
+    """Periodic cache-free WENO reconstructor for uniform grids.
+
+       **Arguments**
+
+       * *order*   - WENO reconstruction order k (2, 3 or 4)
+       * *epsilon* - WENO epsilon (defaults to 1e-6)
+
+       As UniformWENOReconstructor, but the ghost cells are filled
+       periodically (so that, unlike PeriodicWENOCLAWReconstructor,
+       no ghost grid or cache is required).  This is equivalent to
+       using UniformWENOReconstructor with
+       pyblaw.boundary.PeriodicBoundary.
+
+    """
+
+    def boundary_kernel(self):
+        return ('periodic',)
+
+
+    def fill_ghosts(self, qg, **kwargs):
+        """Fill the ghost cells of *qg* (periodic)."""
+
+        g = self.g
+
+        qg[:g,:]  = qg[-2*g:-g,:]
+        qg[-g:,:] = qg[g:2*g,:]
+
+
+    def close(self, qm, qp, **kwargs):
+        """Set the reconstructions at the ends of the domain."""
+
+        qm[0,:]  = qm[-1,:]
+        qp[-1,:] = qp[0,:]
@@ -5,6 +5,8 @@
 import os
 import numpy as np
 
+import pyblaw.base
+import pyblaw.cache
 import pyblaw.flux
 import pyblaw.source
 import pyblaw.reconstructor
@@ -25,37 +27,166 @@ class WENOCLAWReconstructor(pyblaw.reconstructor.Reconstructor):
 
        * *order*  - WENO reconstruction order
        * *cache*  - cache file name
+       * *mmap*   - memory-map the cache (see pyblaw.cache.load_mapped)
+       * *indicator* - shared smoothness indicator (see below)
+       * *loaded* - dictionary of loaded WENO objects (see
+         pyblaw.cache.load)
+       * *hybrid* - shock sensor threshold (defaults to None, ie, use
+         WENO in every cell)
 
        The pyweno.weno.WENO object is loaded from the cache, which
        must be pre-built.
 
-       The WENO smoothness indicators and weights are computed for
-       each component.
+       By default, the WENO smoothness indicators and weights are
+       computed for each component.  If *indicator* is given, the
+       smoothness indicators and weights are computed once per stage
+       from the field given by *indicator* and are used for all
+       components (see pyblaw.reconstructor.indicator_field).
+
+       If *hybrid* is given, a cheap shock sensor is evaluated first,
+       as for pyblaw.uniformweno.UniformWENOReconstructor: a cell is
+       flagged if the magnitude of the second difference of q (or of
+       the indicator field) across it is larger than *hybrid* times
+       the range of q over the whole domain, and cells with a flagged
+       cell in their WENO stencil are troubled.  All cells are first
+       reconstructed linearly with the optimal weights and stencil
+       coefficients of the cache (the nonlinear weights of vanishing
+       smoothness indicators are the optimal weights, so these are
+       computed once per stage for all components), and the troubled
+       cells are then reconstructed again with WENO.  Components
+       without troubled cells skip the smoothness indicators and
+       nonlinear weights altogether.  The number of troubled cells
+       (summed over the components) in the last reconstruction is
+       stored in *troubled*.
+
+       The reconstructions at the ends of the domain are one-sided and
+       taken to be continuous, unless boundary conditions are set (see
+       pyblaw.boundary), in which case the exterior reconstructions
+       are set by the boundary conditions.  This reconstructor does
+       not use ghost cells, so the reconstructions of the cells near
+       the ends remain one-sided (see PeriodicWENOCLAWReconstructor).
 
     """
 
-    def __init__(self, order=3, cache='cache.h5'):
+    def __init__(self, order=3, cache='cache.h5', mmap=False, indicator=None, loaded=None,
+                 hybrid=None):
         self.k = order
         self.cache = cache
+        self.mmap = mmap
+        self.indicator = indicator
+        self.loaded = loaded
+        self.hybrid = hybrid
+        self.width = order - 1
 
 
     def pre_run(self, **kwargs):
 
-        self.weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+        self.weno = pyblaw.cache.load(self.cache, self.k, self.mmap, self.loaded)
 
+        if self.hybrid is not None:
+            self.zero = np.zeros(self.weno.grid.N)
 
-    def reconstruct(self, q, qm, qp, qq, **kwargs):
 
-        p = q.shape[1]
+    def sensor(self, qs):
+        """Return the troubled cell flags of the columns of *qs*.
+
+        A cell is troubled if a cell in its WENO stencil has a second
+        difference that is larger than *hybrid* times the range of the
+        column (see *hybrid*).
+
+        """
+
+        N = qs.shape[0]
+        g = self.k - 1
+
+        scale = qs.max(axis=0) - qs.min(axis=0)
+
+        dd = np.zeros(qs.shape, dtype=np.int)
+        dd[1:-1] = abs(qs[2:] - 2.0*qs[1:-1] + qs[:-2]) > self.hybrid * scale
+
+        # dilate by the stencil width: cell i is troubled if a flag in
+        # cells i-g to i+g is set
+        flags = np.zeros((N+2*g+1, qs.shape[1]), dtype=np.int)
+        flags[g+1:N+g+1] = np.cumsum(dd, axis=0)
+        flags[N+g+1:] = flags[N+g]
+
+        return flags[2*g+1:] > flags[:N]
+
+
+    def reconstruct_hybrid(self, q, qm, qp, a):
+        """Reconstruct the components *a* of q linearly, and with
+        WENO in the troubled cells (see *hybrid*)."""
+
+        # linear reconstructions everywhere...
+        self.weno.smoothness(self.zero)
+        for point, out in (('left', qp), ('right', qm)):
+            self.weno.weights(point)
+            for m in a:
+                self.weno.reconstruct(q[:,m], point, out[:,m], compute_weights=False)
+
+        # ... and WENO in troubled cells
+        if self.indicator is None:
+            flags = self.sensor(q[:,a])
+            self.troubled = flags.sum()
+
+            for j, m in enumerate(a):
+                runs = _runs(flags[:,j])
+                if not runs:
+                    continue
 
-        for m in range(p):
-            self.weno.smoothness(q[:,m])
-            self.weno.reconstruct(q[:,m], 'left', qp[:,m], compute_weights=True)
-            self.weno.reconstruct(q[:,m], 'right', qm[:,m], compute_weights=True)
+                self.weno.smoothness(q[:,m])
+                for point, out in (('left', qp), ('right', qm)):
+                    for imin, imax in runs:
+                        self.weno.reconstruct(q[:,m], point, out[:,m], imin=imin, imax=imax,
+                                              compute_weights=True)
+        else:
+            qs = pyblaw.reconstructor.indicator_field(q, self.indicator)
+            flags = self.sensor(qs[:,np.newaxis])[:,0]
+            self.troubled = flags.sum() * len(a)
 
-        qp[-1,:] = qm[-2,:]
-        qm[1:,:] = qm[:-1,:]
-        qm[0,:]  = qp[0,:]
+            runs = _runs(flags)
+            if not runs:
+                return
+
+            self.weno.smoothness(qs)
+            for point, out in (('left', qp), ('right', qm)):
+                self.weno.weights(point)
+                for m in a:
+                    for imin, imax in runs:
+                        self.weno.reconstruct(q[:,m], point, out[:,m], imin=imin, imax=imax,
+                                              compute_weights=False)
+
+
+    def reconstruct(self, q, qm, qp, qq, **kwargs):
+
+        p = q.shape[1]
+        a = self.active(p)
+        c = pyblaw.base.columns(self.components)
+
+        if self.hybrid is not None:
+            self.reconstruct_hybrid(q, qm, qp, a)
+        elif self.indicator is None:
+            for m in a:
+                self.weno.smoothness(q[:,m])
+                self.weno.reconstruct(q[:,m], 'left', qp[:,m], compute_weights=True)
+                self.weno.reconstruct(q[:,m], 'right', qm[:,m], compute_weights=True)
+        else:
+            self.weno.smoothness(pyblaw.reconstructor.indicator_field(q, self.indicator))
+
+            self.weno.weights('left')
+            for m in a:
+                self.weno.reconstruct(q[:,m], 'left', qp[:,m], compute_weights=False)
+
+            self.weno.weights('right')
+            for m in a:
+                self.weno.reconstruct(q[:,m], 'right', qm[:,m], compute_weights=False)
+
+        qp[-1,c] = qm[-2,c]
+        qm[1:,c] = qm[:-1,c]
+        qm[0,c]  = qp[0,c]
+
+        if self.boundary is not None:
+            self.boundary.close(qm, qp, **kwargs)
 
         if __debug__:
             self.debug(q=q, qp=qp, qm=qm, qq=qq, **kwargs)
@@ -75,27 +206,44 @@ class WENOCLAWLFSolver(pyblaw.solver.Solver):
        * *dumper*  - dumper or None (defaults to pyblaw.dumper.MATDumper)
        * *times*   - times
        * *cache*   - cache file name (defaults to 'cache.h5')
+       * *store*   - cache store or None (see pyblaw.cache.CacheStore)
+       * *mmap*    - memory-map the cache (see pyblaw.cache.load_mapped)
+       * *indicator* - shared smoothness indicator (see
+         WENOCLAWReconstructor)
        * *output*  - output file name (defaults to 'output.h5')
        * *format*  - output file format
+       * *loaded*  - dictionary of loaded WENO objects (see
+         pyblaw.cache.load)
+       * *hybrid*  - shock sensor threshold (see WENOCLAWReconstructor)
 
        The entries of the *flux* dictionary are:
 
        * *flux*    - a callable (see pyblaw.flux.LFFlux)
        * *alpha*   - maximum wave speed for the LF flux
 
+       If a cache *store* is given, the cache file name is determined
+       by the store from the grid boundaries passed to *load_cache*
+       and *build_cache*, and cached entries are validated on load.
+
     """
 
+    points = ('left', 'right')          # reconstruction points
+    ghosts = 0                          # number of ghost cells
+
     def __init__(self,
                  flux={},
                  order=3,
                  system=None, evolver=None, dumper=None,
-                 cache='cache.h5',
+                 cache='cache.h5', store=None, mmap=False,
+                 indicator=None,
                  output='output.h5', format = 'h5py',
+                 loaded=None, hybrid=None,
                  **kwargs):
 
         self.f       = flux
         self.k       = order
         self.cache   = cache
+        self.store   = store
         self.output  = output
         self.format  = format
 
@@ -109,7 +257,11 @@ class WENOCLAWLFSolver(pyblaw.solver.Solver):
                 dumper = pyblaw.h5dumper.H5PYDumper(output)
 
         reconstructor = WENOCLAWReconstructor(order=self.k,
-                                              cache=self.cache)
+                                              cache=self.cache,
+                                              mmap=mmap,
+                                              indicator=indicator,
+                                              loaded=loaded,
+                                              hybrid=hybrid)
 
         flux = pyblaw.flux.LFFlux(self.f['flux'], self.f['alpha'])
 
@@ -126,27 +278,70 @@ class WENOCLAWLFSolver(pyblaw.solver.Solver):
     # cache related
     #
 
-    def load_cache(self):
+    def set_cache(self, cache):
+        """Set the cache file name (of the solver and reconstructor)."""
+
+        self.cache = cache
+        self.reconstructor.cache = cache
+
+    def load_cache(self, x=None):
+        if self.store is not None:
+            if x is None:
+                return False
+
+            cache = self.store.lookup(x, self.k, self.points, self.ghosts)
+            if cache is None:
+                return False
+
+            self.set_cache(cache)
+
         if not os.access(self.cache, os.F_OK):
             return False
 
         self.grid = pyweno.grid.Grid(cache=self.cache)
-        self.weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+        self.weno = pyblaw.cache.load(self.cache, self.k, self.reconstructor.mmap,
+                                      self.reconstructor.loaded)
 
         return True
 
-    def build_cache(self, x=None):
+    def build_cache(self, x=None, processes=1):
+        """Build the WENO cache for the grid boundaries *x*.
+
+           If *processes* is not 1, the cache is built in parallel
+           using *processes* processes (see pyblaw.cache.build).
+
+        """
+
+        if self.store is not None:
+            self.set_cache(self.store.reserve(x, self.k, self.points, self.ghosts))
+
         grid = pyweno.grid.Grid(x)
 
-        weno = pyweno.weno.WENO(grid=grid, order=self.k)
-        weno.precompute_reconstruction('left')
-        weno.precompute_reconstruction('right')
-        weno.cache(self.cache)
+        if processes == 1:
+            weno = pyweno.weno.WENO(grid=grid, order=self.k)
+            for point in self.points:
+                weno.precompute_reconstruction(point)
+            weno.cache(self.cache)
+        else:
+            pyblaw.cache.build(x, self.k, self.points, self.cache,
+                               processes=processes)
+            weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+
+        if self.store is not None:
+            self.store.commit(x, self.k, self.points, self.ghosts)
 
         self.grid = grid
         self.weno = weno
 
 
+def _runs(flags):
+    """Return the (first, last) cells of the runs of set *flags*."""
+
+    d = np.diff(np.concatenate(([0], flags.astype(np.int), [0])))
+
+    return zip(np.nonzero(d == 1)[0], np.nonzero(d == -1)[0] - 1)
+
+
 ######################################################################
 
 class PeriodicWENOCLAWReconstructor(pyblaw.reconstructor.Reconstructor):
@@ -156,31 +351,56 @@ class PeriodicWENOCLAWReconstructor(pyblaw.reconstructor.Reconstructor):
 
        * *order*  - WENO reconstruction order
        * *cache*  - cache file name
+       * *mmap*   - memory-map the cache (see pyblaw.cache.load_mapped)
+       * *indicator* - shared smoothness indicator (see below)
+       * *loaded* - dictionary of loaded WENO objects (see
+         pyblaw.cache.load)
 
        The pyweno.weno.WENO object is loaded from the cache, which
        must be pre-built.
 
-       The WENO smoothness indicators and weights are computed for
-       each component.
+       By default, the WENO smoothness indicators and weights are
+       computed for each component.  If *indicator* is given, the
+       smoothness indicators and weights are computed once per stage
+       from the field given by *indicator* and are used for all
+       components (see pyblaw.reconstructor.indicator_field).
+
+       The reconstructor requires *order* ghost cells on either side,
+       which are filled periodically by default.  If boundary
+       conditions are set (see pyblaw.boundary), the ghost cells are
+       filled by the boundary conditions instead, so that this
+       reconstructor can be used with any boundary conditions.
+
+       If the solver uses ghost cell padded arrays (see
+       pyblaw.solver.Solver), the ghost cells are filled in place and
+       the reconstructions are stored directly in qm and qp.
+       Otherwise q is copied into a padded array at every stage, and
+       the reconstructions are copied back.
 
     """
 
-    def __init__(self, order=3, cache='cache.h5'):
+    def __init__(self, order=3, cache='cache.h5', mmap=False, indicator=None, loaded=None):
         self.k = order
         self.cache = cache
+        self.mmap = mmap
+        self.indicator = indicator
+        self.loaded = loaded
+        self.ghosts = order
+        self.width = order - 1
 
 
     def pre_run(self, **kwargs):
 
-        self.weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+        self.weno = pyblaw.cache.load(self.cache, self.k, self.mmap, self.loaded)
         self.grid = self.weno.grid      # set our grid to the ghost grid
 
         N = self.grid.N
         p = self.system.p
 
-        self.wqm = np.zeros((N+1, p))
-        self.wqp = np.zeros((N+1, p))
-        self.wq  = np.zeros((N, p))
+        if not self.padded:
+            self.wqm = np.zeros((N+1, p), order=self.layout)
+            self.wqp = np.zeros((N+1, p), order=self.layout)
+            self.wq  = np.zeros((N, p), order=self.layout)
 
 
     def reconstruct(self, q, qm, qp, qq, **kwargs):
@@ -188,25 +408,50 @@ class PeriodicWENOCLAWReconstructor(pyblaw.reconstructor.Reconstructor):
         p = q.shape[1]
         k = self.k
         N = self.grid.N
-
-        wqm = self.wqm
-        wqp = self.wqp
-        wq  = self.wq
-
-        # copy and set ghost cells
-        wq[k:-k,:] = q[:,:]
-        wq[:k,:]   = q[-k:,:]
-        wq[-k:,:]  = q[:k,:]
-
-         # reconstruct using ghost cells
-        for m in range(p):
-            self.weno.smoothness(wq[:,m])
-            self.weno.reconstruct(wq[:,m], 'left', wqp[:,m], imin=k-1, imax=N-k, compute_weights=True)
-            self.weno.reconstruct(wq[:,m], 'right', wqm[:,m], imin=k-1, imax=N-k, compute_weights=True)
-
-        qm[:,:] = wqm[k-1:N-k,:]
-        qp[:,:]  = wqp[k:N-k+1,:]
-
+        a = self.active(p)
+        c = pyblaw.base.columns(self.components)
+
+        if self.padded:
+            # reconstruct directly into qm and qp (the right
+            # reconstruction of cell i is stored in wqm[i], ie, qm[i+1])
+            wq  = q
+            wqm = qm[1:]
+            wqp = qp
+
+        else:
+            wqm = self.wqm
+            wqp = self.wqp
+            wq  = self.wq
+
+            wq[k:-k,:] = q[:,:]
+
+        # set ghost cells
+        if self.boundary is not None:
+            self.boundary.fill(wq, k, **kwargs)
+        else:
+            wq[:k,:]  = wq[-2*k:-k,:]
+            wq[-k:,:] = wq[k:2*k,:]
+
+        # reconstruct using ghost cells
+        if self.indicator is None:
+            for m in a:
+                self.weno.smoothness(wq[:,m])
+                self.weno.reconstruct(wq[:,m], 'left', wqp[:,m], imin=k-1, imax=N-k, compute_weights=True)
+                self.weno.reconstruct(wq[:,m], 'right', wqm[:,m], imin=k-1, imax=N-k, compute_weights=True)
+        else:
+            self.weno.smoothness(pyblaw.reconstructor.indicator_field(wq, self.indicator))
+
+            self.weno.weights('left')
+            for m in a:
+                self.weno.reconstruct(wq[:,m], 'left', wqp[:,m], imin=k-1, imax=N-k, compute_weights=False)
+
+            self.weno.weights('right')
+            for m in a:
+                self.weno.reconstruct(wq[:,m], 'right', wqm[:,m], imin=k-1, imax=N-k, compute_weights=False)
+
+        if not self.padded:
+            qm[:,c] = wqm[k-1:N-k,c]
+            qp[:,c] = wqp[k:N-k+1,c]
 
         if __debug__:
             self.debug(q=q, qp=qp, qm=qm, qq=qq, **kwargs)
@@ -227,27 +472,41 @@ class PeriodicWENOCLAWLFSolver(pyblaw.solver.Solver):
        * *dumper*  - dumper or None (defaults to pyblaw.dumper.MATDumper)
        * *times*   - times
        * *cache*   - cache file name (defaults to 'cache.h5')
+       * *store*   - cache store or None (see pyblaw.cache.CacheStore)
+       * *mmap*    - memory-map the cache (see pyblaw.cache.load_mapped)
+       * *indicator* - shared smoothness indicator (see
+         WENOCLAWReconstructor)
        * *output*  - output file name (defaults to 'output.h5')
        * *format*  - cache file format (defaults to 'h5py')
+       * *loaded*  - dictionary of loaded WENO objects (see
+         pyblaw.cache.load)
 
        The entries of the *flux* dictionary are:
 
        * *flux*    - a callable (see pyblaw.flux.LFFlux)
        * *alpha*   - maximum wave speed for the LF flux
 
+       See WENOCLAWLFSolver regarding the cache *store*.
+
     """
 
+    points = ('left', 'right')          # reconstruction points
+
     def __init__(self,
                  flux={},
                  order=3,
                  system=None, evolver=None, dumper=None,
-                 cache='cache.h5', format='h5py',
+                 cache='cache.h5', store=None, mmap=False, format='h5py',
+                 indicator=None,
                  output='output.h5',
+                 loaded=None,
                  **kwargs):
 
         self.f       = flux
         self.k       = order
+        self.ghosts  = order
         self.cache   = cache
+        self.store   = store
         self.output  = output
         self.format  = format
 
@@ -261,7 +520,10 @@ class PeriodicWENOCLAWLFSolver(pyblaw.solver.Solver):
                 dumper = pyblaw.h5dumper.H5PYDumper(output)
 
         reconstructor = PeriodicWENOCLAWReconstructor(order=self.k,
-                                                      cache=self.cache)
+                                                      cache=self.cache,
+                                                      mmap=mmap,
+                                                      indicator=indicator,
+                                                      loaded=loaded)
 
         flux = pyblaw.flux.LFFlux(self.f['flux'], self.f['alpha'])
 
@@ -278,12 +540,29 @@ class PeriodicWENOCLAWLFSolver(pyblaw.solver.Solver):
     # cache related
     #
 
-    def load_cache(self):
+    def set_cache(self, cache):
+        """Set the cache file name (of the solver and reconstructor)."""
+
+        self.cache = cache
+        self.reconstructor.cache = cache
+
+    def load_cache(self, x=None):
+        if self.store is not None:
+            if x is None:
+                return False
+
+            cache = self.store.lookup(x, self.k, self.points, self.ghosts)
+            if cache is None:
+                return False
+
+            self.set_cache(cache)
+
         if not os.access(self.cache, os.F_OK):
             return False
 
         self.ghost_grid = pyweno.grid.Grid(cache=self.cache)
-        self.weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+        self.weno = pyblaw.cache.load(self.cache, self.k, self.reconstructor.mmap,
+                                      self.reconstructor.loaded)
 
         # remove ghost cells and create new grid
         k = self.k
@@ -293,7 +572,17 @@ class PeriodicWENOCLAWLFSolver(pyblaw.solver.Solver):
 
         return True
 
-    def build_cache(self, x=None):
+    def build_cache(self, x=None, processes=1):
+        """Build the WENO cache for the grid boundaries *x* (without
+           ghost cells).
+
+           If *processes* is not 1, the cache is built in parallel
+           using *processes* processes (see pyblaw.cache.build).
+
+        """
+
+        if self.store is not None:
+            self.set_cache(self.store.reserve(x, self.k, self.points, self.ghosts))
 
         k = self.k
 
@@ -309,10 +598,18 @@ class PeriodicWENOCLAWLFSolver(pyblaw.solver.Solver):
         # create grid for weno (includes ghost cells)
         ghost_grid = pyweno.grid.Grid(y)
 
-        weno = pyweno.weno.WENO(grid=ghost_grid, order=self.k)
-        weno.precompute_reconstruction('left')
-        weno.precompute_reconstruction('right')
-        weno.cache(self.cache)
+        if processes == 1:
+            weno = pyweno.weno.WENO(grid=ghost_grid, order=self.k)
+            for point in self.points:
+                weno.precompute_reconstruction(point)
+            weno.cache(self.cache)
+        else:
+            pyblaw.cache.build(y, self.k, self.points, self.cache,
+                               processes=processes)
+            weno = pyweno.weno.WENO(order=self.k, cache=self.cache)
+
+        if self.store is not None:
+            self.store.commit(x, self.k, self.points, self.ghosts)
 
         self.ghost_grid = ghost_grid
         self.grid = pyblaw.grid.Grid(x)
@@ -63,6 +63,20 @@ setuptools.setup(
         setuptools.Extension('pyblaw.clfflux',
                              sources = ['src/clfflux.c'],
                              include_dirs=[np.get_include()]
+                             ),
+        setuptools.Extension('pyblaw.cmuscl',
+                             sources = ['src/cmuscl.c'],
+                             depends = ['src/limiters.h'],
+                             include_dirs=[np.get_include()]
+                             ),
+        setuptools.Extension('pyblaw.cstep',
+                             sources = ['src/cstep.c'],
+                             depends = ['src/limiters.h'],
+                             include_dirs=[np.get_include()]
+                             ),
+        setuptools.Extension('pyblaw.cshallowwater',
+                             sources = ['src/cshallowwater.c'],
+                             include_dirs=[np.get_include()]
                              )],
 
     package_data = {'': ['__version__.py', '__git_version__.py']},
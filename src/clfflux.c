@@ -64,60 +64,85 @@ init_lf_flux(PyObject *self, PyObject *args)
 
 /************************************************************************/
 
-void
-nflux_lf(double *qm, double *qp, double *fm, double *fp, double *f)
+/* strided element access */
+#define Q2(a, s, i, j) (*(double *) ((char *) (a) + (i)*(s)[0] + (j)*(s)[1]))
+
+static int
+check(PyObject *a_py, const char *name)
+{
+  char msg[128];
+
+  if (! PyArray_Check(a_py) || PyArray_TYPE(a_py) != NPY_DOUBLE || PyArray_NDIM(a_py) != 2) {
+    snprintf(msg, 128, "%s is not a 2-dimensional double array", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  if ((PyArray_FLAGS(a_py) & NPY_ALIGNED) != NPY_ALIGNED) {
+    snprintf(msg, 128, "%s is not aligned", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  return 1;
+}
+
+/* numerical flux at boundary i */
+static void
+nflux_lf(long int i, double a,
+         double *qm, npy_intp *qms, double *qp, npy_intp *qps,
+         double *fm, npy_intp *fms, double *fp, npy_intp *fps,
+         double *f)
 {
   int j;
 
   for (j=0; j<p; j++)
-    f[j] = 0.5 * (fm[j] + fp[j] - alpha * (qp[j] - qm[j]) );
+    f[j] = 0.5 * ( Q2(fm, fms, i, j) + Q2(fp, fps, i, j)
+                   - a * ( Q2(qp, qps, i, j) - Q2(qm, qms, i, j) ) );
 }
 
 PyObject *
 lf_flux(PyObject *self, PyObject *args)
 {
-  long int i;
-  PyObject *qm_py, *qp_py, *fm_py, *fp_py, *f_py;
-  double *qm, *qp, *fm, *fp, *f;
+  long int i, offset = 0;
+  PyObject *qm_py, *qp_py, *fm_py, *fp_py, *f_py, *dx_py = NULL;
+  double *qm, *qp, *fm, *fp, *f, *h, a = alpha;
+  npy_intp *qms, *qps, *fms, *fps, *fs;
 
   int j;
 
   /*
-   * parse options
+   * parse options: the maximum wave speed and cell sizes default to
+   * those set by init_lf_flux
    */
 
-  if (! PyArg_ParseTuple(args, "OOOOO", &qm_py, &qp_py, &fm_py, &fp_py, &f_py))
+  if (! PyArg_ParseTuple(args, "OOOOO|ldO", &qm_py, &qp_py, &fm_py, &fp_py, &f_py,
+                         &offset, &a, &dx_py))
     return NULL;
 
-  if ((PyArray_FLAGS(qm_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
-    PyErr_SetString(PyExc_TypeError, "qm is not contiguous and/or aligned");
+  if (! (check(qm_py, "qm") && check(qp_py, "qp") && check(fm_py, "fm")
+         && check(fp_py, "fp") && check(f_py, "f")))
     return NULL;
-  }
-  qm = (double *) PyArray_DATA(qm_py);
 
-  if ((PyArray_FLAGS(qp_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
-    PyErr_SetString(PyExc_TypeError, "qp is not contiguous and/or aligned");
-    return NULL;
+  h = dx;
+  if (dx_py != NULL) {
+    if (! PyArray_Check(dx_py) || PyArray_TYPE(dx_py) != NPY_DOUBLE
+        || (PyArray_FLAGS(dx_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
+      PyErr_SetString(PyExc_TypeError, "dx is not a contiguous and/or aligned double array");
+      return NULL;
+    }
+    if (PyArray_SIZE(dx_py) < offset + PyArray_DIM(f_py, 0)) {
+      PyErr_SetString(PyExc_ValueError, "dx is too short");
+      return NULL;
+    }
+    h = (double *) PyArray_DATA(dx_py);
   }
-  qp = (double *) PyArray_DATA(qp_py);
 
-  if ((PyArray_FLAGS(fm_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
-    PyErr_SetString(PyExc_TypeError, "fm is not contiguous and/or aligned");
-    return NULL;
-  }
-  fm = (double *) PyArray_DATA(fm_py);
-
-  if ((PyArray_FLAGS(fp_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
-    PyErr_SetString(PyExc_TypeError, "fp is not contiguous and/or aligned");
-    return NULL;
-  }
-  fp = (double *) PyArray_DATA(fp_py);
-
-  if ((PyArray_FLAGS(f_py) & NPY_IN_ARRAY) != NPY_IN_ARRAY) {
-    PyErr_SetString(PyExc_TypeError, "f is not contiguous and/or aligned");
-    return NULL;
-  }
-  f = (double *) PyArray_DATA(f_py);
+  qm = (double *) PyArray_DATA(qm_py);  qms = PyArray_STRIDES(qm_py);
+  qp = (double *) PyArray_DATA(qp_py);  qps = PyArray_STRIDES(qp_py);
+  fm = (double *) PyArray_DATA(fm_py);  fms = PyArray_STRIDES(fm_py);
+  fp = (double *) PyArray_DATA(fp_py);  fps = PyArray_STRIDES(fp_py);
+  f  = (double *) PyArray_DATA(f_py);   fs  = PyArray_STRIDES(f_py);
 
   /*
    * compute net flux
@@ -126,20 +151,26 @@ lf_flux(PyObject *self, PyObject *args)
   N = PyArray_DIM(f_py, 0);
   p = PyArray_DIM(f_py, 1);
 
+  if (PyArray_DIM(qm_py, 0) != N+1 || PyArray_DIM(qp_py, 0) != N+1
+      || PyArray_DIM(fm_py, 0) != N+1 || PyArray_DIM(fp_py, 0) != N+1
+      || PyArray_DIM(qm_py, 1) != p || PyArray_DIM(qp_py, 1) != p
+      || PyArray_DIM(fm_py, 1) != p || PyArray_DIM(fp_py, 1) != p) {
+    PyErr_SetString(PyExc_ValueError, "array dimensions do not match");
+    return NULL;
+  }
+
   /* init right flux */
-  nflux_lf(qm, qp, fm, fp, fr);
+  nflux_lf(0, a, qm, qms, qp, qps, fm, fms, fp, fps, fr);
 
   /* compute net flux in all cells */
   for (i=0; i<N; i++) {
     for (j=0; j<p; j++)
       fl[j] = fr[j];
 
-    nflux_lf(qm + (i+1)*p, qp + (i+1)*p,
-             fm + (i+1)*p, fp + (i+1)*p,
-             fr);
+    nflux_lf(i+1, a, qm, qms, qp, qps, fm, fms, fp, fps, fr);
 
     for (j=0; j<p; j++)
-      f[i*p+j] = - ( fr[j] - fl[j] ) / dx[i];
+      Q2(f, fs, i, j) = - ( fr[j] - fl[j] ) / h[offset+i];
   }
 
   /*
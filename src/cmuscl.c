@@ -0,0 +1,163 @@
+/*
+ * cmuscl - MUSCL reconstruction extension module
+ */
+
+#define PY_ARRAY_UNIQUE_SYMBOL PYBLAW_CMUSCL_ARRAY_API
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <math.h>
+
+#include <Python.h>
+#include <numpy/ndarrayobject.h>
+
+#include "limiters.h"
+
+/*********************************************************************/
+
+/* strided element access */
+#define Q1(a, s, i)       (*(double *) ((char *) (a) + (i)*(s)[0]))
+#define Q2(a, s, i, j)    (*(double *) ((char *) (a) + (i)*(s)[0] + (j)*(s)[1]))
+#define Q3(a, s, i, l, j) (*(double *) ((char *) (a) + (i)*(s)[0] + (l)*(s)[1] + (j)*(s)[2]))
+
+/*********************************************************************/
+
+static int
+check(PyObject *a_py, int nd, const char *name)
+{
+  char msg[128];
+
+  if (! PyArray_Check(a_py) || PyArray_TYPE(a_py) != NPY_DOUBLE || PyArray_NDIM(a_py) != nd) {
+    snprintf(msg, 128, "%s is not a %d-dimensional double array", name, nd);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  if ((PyArray_FLAGS(a_py) & NPY_ALIGNED) != NPY_ALIGNED) {
+    snprintf(msg, 128, "%s is not aligned", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  return 1;
+}
+
+PyObject *
+reconstruct(PyObject *self, PyObject *args)
+{
+  PyObject *q_py, *qm_py, *qp_py, *qq_py, *x_py, *dx_py, *xi_py;
+  double *q, *qm, *qp, *qq, *x, *dx, *xi;
+  npy_intp *qs, *qms, *qps, *qqs, *xs, *dxs, *xis;
+
+  long int i, N;
+  int j, l, p, n, g, limiter;
+  double a, b, sigma, h, hl, hr;
+
+  /*
+   * parse options
+   */
+
+  if (! PyArg_ParseTuple(args, "OOOOOOOii",
+                         &q_py, &qm_py, &qp_py, &qq_py,
+                         &x_py, &dx_py, &xi_py, &limiter, &g))
+    return NULL;
+
+  if (g != 0 && g != 1) {
+    PyErr_SetString(PyExc_ValueError, "g must be 0 or 1");
+    return NULL;
+  }
+
+  if (! (check(q_py, 2, "q") && check(qm_py, 2, "qm") && check(qp_py, 2, "qp")
+         && check(qq_py, 3, "qq") && check(x_py, 1, "x") && check(dx_py, 1, "dx")
+         && check(xi_py, 1, "xi")))
+    return NULL;
+
+  N = PyArray_DIM(q_py, 0) - 2*g;
+  p = PyArray_DIM(q_py, 1);
+  n = PyArray_DIM(xi_py, 0);
+
+  if (PyArray_DIM(qm_py, 0) != N+1 || PyArray_DIM(qp_py, 0) != N+1
+      || PyArray_DIM(qm_py, 1) != p || PyArray_DIM(qp_py, 1) != p
+      || PyArray_DIM(x_py, 0) != N || PyArray_DIM(dx_py, 0) != N) {
+    PyErr_SetString(PyExc_ValueError, "array dimensions do not match");
+    return NULL;
+  }
+
+  if (n > 0 && (PyArray_DIM(qq_py, 0) != N || PyArray_DIM(qq_py, 1) < n
+                || PyArray_DIM(qq_py, 2) != p)) {
+    PyErr_SetString(PyExc_ValueError, "qq dimensions do not match");
+    return NULL;
+  }
+
+  q  = (double *) PyArray_DATA(q_py);   qs  = PyArray_STRIDES(q_py);
+  q  = (double *) ((char *) q + g*qs[0]);   /* first interior cell */
+  qm = (double *) PyArray_DATA(qm_py);  qms = PyArray_STRIDES(qm_py);
+  qp = (double *) PyArray_DATA(qp_py);  qps = PyArray_STRIDES(qp_py);
+  qq = (double *) PyArray_DATA(qq_py);  qqs = PyArray_STRIDES(qq_py);
+  x  = (double *) PyArray_DATA(x_py);   xs  = PyArray_STRIDES(x_py);
+  dx = (double *) PyArray_DATA(dx_py);  dxs = PyArray_STRIDES(dx_py);
+  xi = (double *) PyArray_DATA(xi_py);  xis = PyArray_STRIDES(xi_py);
+
+  /*
+   * reconstruct
+   */
+
+  Py_BEGIN_ALLOW_THREADS
+
+  for (i=0; i<N; i++) {
+    h = Q1(dx, dxs, i);
+
+    /* distances to the neighbouring cell centres (the ghost cells
+       are taken to be as wide as the end cells) */
+    hl = (i > 0)   ? Q1(x, xs, i) - Q1(x, xs, i-1) : h;
+    hr = (i < N-1) ? Q1(x, xs, i+1) - Q1(x, xs, i) : h;
+
+    for (j=0; j<p; j++) {
+
+      /* limited slope (first and last cells are flat without ghost
+         cells) */
+      if (g == 0 && (i == 0 || i == N-1))
+        sigma = 0.0;
+      else {
+        a = (Q2(q, qs, i, j) - Q2(q, qs, i-1, j)) / hl;
+        b = (Q2(q, qs, i+1, j) - Q2(q, qs, i, j)) / hr;
+        sigma = limit(limiter, a, b);
+      }
+
+      Q2(qp, qps, i, j)   = Q2(q, qs, i, j) - 0.5 * sigma * h;
+      Q2(qm, qms, i+1, j) = Q2(q, qs, i, j) + 0.5 * sigma * h;
+
+      for (l=0; l<n; l++)
+        Q3(qq, qqs, i, l, j) = Q2(q, qs, i, j) + sigma * h * Q1(xi, xis, l);
+    }
+  }
+
+  /* ends */
+  for (j=0; j<p; j++) {
+    Q2(qm, qms, 0, j) = Q2(qp, qps, 0, j);
+    Q2(qp, qps, N, j) = Q2(qm, qms, N, j);
+  }
+
+  Py_END_ALLOW_THREADS
+
+  /*
+   * done
+   */
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+/*********************************************************************/
+
+static PyMethodDef cmusclmethods[] = {
+    {"reconstruct", reconstruct, METH_VARARGS,
+     "reconstruct(q, qm, qp, qq, x, dx, xi, limiter, g): MUSCL reconstruction"},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+initcmuscl(void)
+{
+  (void) Py_InitModule("cmuscl", cmusclmethods);
+  import_array();
+}
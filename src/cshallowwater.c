@@ -0,0 +1,253 @@
+/*
+ * cshallowwater - well-balanced shallow-water flux and source extension module
+ *
+ * The unknowns are (h, hu, b) where b is the (frozen) bed.  The
+ * interface states are modified by the hydrostatic reconstruction,
+ * and the cell source is integrated so that still water (including
+ * dry regions) is preserved exactly (see pyblaw.shallowwater).
+ */
+
+#define PY_ARRAY_UNIQUE_SYMBOL PYBLAW_CSHALLOWWATER_ARRAY_API
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <math.h>
+
+#include <Python.h>
+#include <numpy/ndarrayobject.h>
+
+/*********************************************************************/
+
+/* strided element access */
+#define Q1(a, s, i)       (*(double *) ((char *) (a) + (i)*(s)[0]))
+#define Q2(a, s, i, j)    (*(double *) ((char *) (a) + (i)*(s)[0] + (j)*(s)[1]))
+#define Q3(a, s, i, l, j) (*(double *) ((char *) (a) + (i)*(s)[0] + (l)*(s)[1] + (j)*(s)[2]))
+
+/*********************************************************************/
+
+static int
+check(PyObject *a_py, int nd, const char *name)
+{
+  char msg[128];
+
+  if (! PyArray_Check(a_py) || PyArray_TYPE(a_py) != NPY_DOUBLE || PyArray_NDIM(a_py) != nd) {
+    snprintf(msg, 128, "%s is not a %d-dimensional double array", name, nd);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  if ((PyArray_FLAGS(a_py) & NPY_ALIGNED) != NPY_ALIGNED) {
+    snprintf(msg, 128, "%s is not aligned", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  return 1;
+}
+
+/* desingularised velocity */
+static double
+velocity(double h, double hu, double dry)
+{
+  if (h <= dry)
+    return 0.0;
+
+  return hu / h;
+}
+
+/*
+ * hydrostatic reconstruction and Rusanov flux at an interface given
+ * the states (hm, um, bm) and (hp, up, bp) on either side.  The
+ * numerical flux is stored in F, the pressure corrections of the
+ * cells on the left and right in Pm and Pp.  Returns the local wave
+ * speed.
+ */
+static double
+nflux(double hm, double um, double bm, double hp, double up, double bp,
+      double g, double *F, double *Pm, double *Pp)
+{
+  double bs, hms, hps, a, ap;
+
+  bs  = bm > bp ? bm : bp;
+  hms = hm + bm - bs;  if (hms < 0.0) hms = 0.0;
+  hps = hp + bp - bs;  if (hps < 0.0) hps = 0.0;
+
+  a  = fabs(um) + sqrt(g * hms);
+  ap = fabs(up) + sqrt(g * hps);
+  if (ap > a) a = ap;
+
+  F[0] = 0.5 * ( hms * um + hps * up - a * ( hps - hms ) );
+  F[1] = 0.5 * ( hms * um * um + 0.5 * g * hms * hms
+                 + hps * up * up + 0.5 * g * hps * hps
+                 - a * ( hps * up - hms * um ) );
+
+  *Pm = 0.5 * g * ( hm * hm - hms * hms );
+  *Pp = 0.5 * g * ( hp * hp - hps * hps );
+
+  return a;
+}
+
+PyObject *
+flux(PyObject *self, PyObject *args)
+{
+  PyObject *qm_py, *qp_py, *dx_py, *f_py;
+  double *qm, *qp, *dx, *f;
+  npy_intp *qms, *qps, *dxs, *fs;
+
+  long int i, N;
+  double g, dry, hm, hp, a, amax, Fl[2], Fr[2], Pl, Pr, Pm;
+
+  /*
+   * parse options
+   */
+
+  if (! PyArg_ParseTuple(args, "OOOOdd", &qm_py, &qp_py, &dx_py, &f_py, &g, &dry))
+    return NULL;
+
+  if (! (check(qm_py, 2, "qm") && check(qp_py, 2, "qp")
+         && check(dx_py, 1, "dx") && check(f_py, 2, "f")))
+    return NULL;
+
+  N = PyArray_DIM(f_py, 0);
+
+  if (PyArray_DIM(qm_py, 0) != N+1 || PyArray_DIM(qp_py, 0) != N+1
+      || PyArray_DIM(dx_py, 0) != N || PyArray_DIM(f_py, 1) != 3
+      || PyArray_DIM(qm_py, 1) != 3 || PyArray_DIM(qp_py, 1) != 3) {
+    PyErr_SetString(PyExc_ValueError, "array dimensions do not match");
+    return NULL;
+  }
+
+  qm = (double *) PyArray_DATA(qm_py);  qms = PyArray_STRIDES(qm_py);
+  qp = (double *) PyArray_DATA(qp_py);  qps = PyArray_STRIDES(qp_py);
+  dx = (double *) PyArray_DATA(dx_py);  dxs = PyArray_STRIDES(dx_py);
+  f  = (double *) PyArray_DATA(f_py);   fs  = PyArray_STRIDES(f_py);
+
+  /*
+   * compute net flux
+   */
+
+#define STATE(q, s, i, h) \
+  h = Q2(q, s, i, 0); if (h < 0.0) h = 0.0
+
+  amax = 0.0;
+  for (i=0; i<=N; i++) {
+    STATE(qm, qms, i, hm);
+    STATE(qp, qps, i, hp);
+
+    a = nflux(hm, velocity(hm, Q2(qm, qms, i, 1), dry), Q2(qm, qms, i, 2),
+              hp, velocity(hp, Q2(qp, qps, i, 1), dry), Q2(qp, qps, i, 2),
+              g, Fr, &Pm, &Pr);
+    if (a > amax) amax = a;
+
+    if (i > 0) {
+      Q2(f, fs, i-1, 0) = - ( Fr[0] - Fl[0] ) / Q1(dx, dxs, i-1);
+      Q2(f, fs, i-1, 1) = - ( Fr[1] + Pm - Fl[1] - Pl ) / Q1(dx, dxs, i-1);
+      Q2(f, fs, i-1, 2) = 0.0;
+    }
+
+    Fl[0] = Fr[0];  Fl[1] = Fr[1];  Pl = Pr;
+  }
+
+#undef STATE
+
+  /*
+   * done
+   */
+  return PyFloat_FromDouble(amax);
+}
+
+/*********************************************************************/
+
+PyObject *
+source(PyObject *self, PyObject *args)
+{
+  PyObject *qm_py, *qp_py, *qq_py, *bx_py, *w_py, *dx_py, *s_py;
+  double *qm, *qp, *qq, *bx, *w, *dx, *s;
+  npy_intp *qms, *qps, *qqs, *bxs, *ws, *dxs, *ss;
+
+  long int i, N;
+  int l, n;
+  double g, bl, br, etal, etar, eta, sum;
+
+  /*
+   * parse options
+   */
+
+  if (! PyArg_ParseTuple(args, "OOOOOOOd",
+                         &qm_py, &qp_py, &qq_py, &bx_py, &w_py, &dx_py, &s_py, &g))
+    return NULL;
+
+  if (! (check(qm_py, 2, "qm") && check(qp_py, 2, "qp") && check(qq_py, 3, "qq")
+         && check(bx_py, 2, "bx") && check(w_py, 1, "w")
+         && check(dx_py, 1, "dx") && check(s_py, 2, "s")))
+    return NULL;
+
+  N = PyArray_DIM(s_py, 0);
+  n = PyArray_DIM(w_py, 0);
+
+  if (PyArray_DIM(qm_py, 0) != N+1 || PyArray_DIM(qp_py, 0) != N+1
+      || PyArray_DIM(qq_py, 0) != N || PyArray_DIM(qq_py, 1) != n
+      || PyArray_DIM(bx_py, 0) != N || PyArray_DIM(bx_py, 1) != n
+      || PyArray_DIM(dx_py, 0) != N || PyArray_DIM(s_py, 1) != 3
+      || PyArray_DIM(qm_py, 1) != 3 || PyArray_DIM(qp_py, 1) != 3
+      || PyArray_DIM(qq_py, 2) != 3) {
+    PyErr_SetString(PyExc_ValueError, "array dimensions do not match");
+    return NULL;
+  }
+
+  qm = (double *) PyArray_DATA(qm_py);  qms = PyArray_STRIDES(qm_py);
+  qp = (double *) PyArray_DATA(qp_py);  qps = PyArray_STRIDES(qp_py);
+  qq = (double *) PyArray_DATA(qq_py);  qqs = PyArray_STRIDES(qq_py);
+  bx = (double *) PyArray_DATA(bx_py);  bxs = PyArray_STRIDES(bx_py);
+  w  = (double *) PyArray_DATA(w_py);   ws  = PyArray_STRIDES(w_py);
+  dx = (double *) PyArray_DATA(dx_py);  dxs = PyArray_STRIDES(dx_py);
+  s  = (double *) PyArray_DATA(s_py);   ss  = PyArray_STRIDES(s_py);
+
+  /*
+   * compute source: -g h b_x integrated over each cell, split into
+   * the exact integral of -g eta b_x + g b b_x for a constant free
+   * surface eta (the mean of the end values) and the quadrature of
+   * the deviation of the free surface from eta
+   */
+
+  for (i=0; i<N; i++) {
+    bl   = Q2(qp, qps, i, 2);
+    br   = Q2(qm, qms, i+1, 2);
+    etal = Q2(qp, qps, i, 0) + bl;
+    etar = Q2(qm, qms, i+1, 0) + br;
+    eta  = 0.5 * ( etal + etar );
+
+    sum = 0.0;
+    for (l=0; l<n; l++)
+      sum += Q1(w, ws, l) * ( Q3(qq, qqs, i, l, 0) + Q3(qq, qqs, i, l, 2) - eta )
+        * Q2(bx, bxs, i, l);
+
+    Q2(s, ss, i, 0) = 0.0;
+    Q2(s, ss, i, 1) = g * ( ( - eta * ( br - bl ) + 0.5 * ( br * br - bl * bl ) )
+                            / Q1(dx, dxs, i) - sum );
+    Q2(s, ss, i, 2) = 0.0;
+  }
+
+  /*
+   * done
+   */
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+/*********************************************************************/
+
+static PyMethodDef cshallowwatermethods[] = {
+    {"flux", flux, METH_VARARGS,
+     "flux(qm, qp, dx, f, g, dry): well-balanced net flux, returns the maximum wave speed"},
+    {"source", source, METH_VARARGS,
+     "source(qm, qp, qq, bx, w, dx, s, g): well-balanced bed source"},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+initcshallowwater(void)
+{
+  (void) Py_InitModule("cshallowwater", cshallowwatermethods);
+  import_array();
+}
@@ -0,0 +1,759 @@
+/*
+ * cstep - compiled (fused) time stepping extension module
+ *
+ * The reconstructor, flux and evolver of a solver describe their
+ * C-level kernels with tuples (see the *kernel* methods of the PyBLAW
+ * classes), which are parsed here.
+ *
+ * Each stage of an evolver is computed in a single sweep over the
+ * cells (see *sweep*): the reconstructions of each cell, the
+ * numerical flux through each cell boundary and the stage update of
+ * each cell are computed in turn, so that the reconstructions and
+ * fluxes are never stored in arrays.
+ */
+
+#define PY_ARRAY_UNIQUE_SYMBOL PYBLAW_CSTEP_ARRAY_API
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+
+#include <Python.h>
+#include <numpy/ndarrayobject.h>
+
+#include "limiters.h"
+
+/*********************************************************************/
+
+/* strided array view */
+typedef struct {
+  double *data;
+  npy_intp s0, s1;
+} view;
+
+#define V(v, i, j) (*(double *) ((char *) (v).data + (i)*(v).s0 + (j)*(v).s1))
+
+#define MAXK 8
+#define MAXREFS 8
+
+enum { MUSCL, WENO };
+enum { OUTFLOW, PERIODIC, REFLECTIVE };
+enum { LINEAR, BURGERS, TRAFFIC, SHALLOWWATER };
+enum { FE, SSPERK3 };
+
+typedef struct {
+  long int N;
+  int p, g;
+
+  /* reconstruction */
+  int reconstructor, limiter, k;
+  double *x, *dx, epsilon;
+  double cl[MAXK*MAXK], cr[MAXK*MAXK], dl[MAXK], dr[MAXK], L[MAXK*MAXK*MAXK];
+
+  /* boundary conditions */
+  int boundary;
+  double *sign;
+
+  /* flux */
+  int flux;
+  double alpha, *params, *fdx;
+
+  /* evolver */
+  int evolver;
+  int *active;
+
+  /* scratch space of the sweep (allocated for p components) */
+  double *work;
+
+  /* arrays referenced while stepping */
+  PyObject *refs[MAXREFS];
+  int nrefs;
+} stepper;
+
+/*********************************************************************/
+
+static int
+check(PyObject *a_py, const char *name)
+{
+  char msg[128];
+
+  if (! PyArray_Check(a_py) || PyArray_TYPE(a_py) != NPY_DOUBLE || PyArray_NDIM(a_py) != 2) {
+    snprintf(msg, 128, "%s is not a 2-dimensional double array", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  if ((PyArray_FLAGS(a_py) & NPY_ALIGNED) != NPY_ALIGNED) {
+    snprintf(msg, 128, "%s is not aligned", name);
+    PyErr_SetString(PyExc_TypeError, msg);
+    return 0;
+  }
+
+  return 1;
+}
+
+static view
+as_view(PyObject *a_py)
+{
+  view v;
+
+  v.data = (double *) PyArray_DATA(a_py);
+  v.s0   = PyArray_STRIDES(a_py)[0];
+  v.s1   = PyArray_STRIDES(a_py)[1];
+
+  return v;
+}
+
+/* convert o to a contiguous double array of n elements */
+static PyArrayObject *
+contiguous(PyObject *o, npy_intp n, const char *name)
+{
+  PyArrayObject *a;
+  char msg[128];
+
+  a = (PyArrayObject *) PyArray_FROM_OTF(o, NPY_DOUBLE, NPY_IN_ARRAY);
+  if (a == NULL)
+    return NULL;
+
+  if (PyArray_SIZE(a) != n) {
+    snprintf(msg, 128, "%s has the wrong size", name);
+    PyErr_SetString(PyExc_ValueError, msg);
+    Py_DECREF(a);
+    return NULL;
+  }
+
+  return a;
+}
+
+/* copy the n doubles of o into buf */
+static int
+doubles(PyObject *o, double *buf, npy_intp n, const char *name)
+{
+  PyArrayObject *a;
+
+  if ((a = contiguous(o, n, name)) == NULL)
+    return 0;
+
+  memcpy(buf, PyArray_DATA(a), n*sizeof(double));
+  Py_DECREF(a);
+
+  return 1;
+}
+
+/* point *buf to the n doubles of o (referenced until release) */
+static int
+reference(stepper *st, PyObject *o, double **buf, npy_intp n, const char *name)
+{
+  PyArrayObject *a;
+
+  if ((a = contiguous(o, n, name)) == NULL)
+    return 0;
+
+  st->refs[st->nrefs++] = (PyObject *) a;
+  *buf = (double *) PyArray_DATA(a);
+
+  return 1;
+}
+
+static void
+release(stepper *st)
+{
+  int r;
+
+  for (r=0; r<st->nrefs; r++)
+    Py_DECREF(st->refs[r]);
+  st->nrefs = 0;
+
+  free(st->sign);
+  free(st->active);
+  st->sign = st->params = st->work = NULL;
+  st->active = NULL;
+}
+
+static const char *
+kind(PyObject *desc)
+{
+  if (! PyTuple_Check(desc) || PyTuple_Size(desc) < 1
+      || ! PyString_Check(PyTuple_GetItem(desc, 0))) {
+    PyErr_SetString(PyExc_TypeError, "kernel descriptions must be tuples");
+    return NULL;
+  }
+
+  return PyString_AsString(PyTuple_GetItem(desc, 0));
+}
+
+/*********************************************************************/
+
+static int
+parse_boundary(stepper *st, PyObject *desc)
+{
+  const char *name;
+  PyObject *sign_py;
+
+  if ((name = kind(desc)) == NULL)
+    return 0;
+
+  if (strcmp(name, "outflow") == 0) {
+    st->boundary = OUTFLOW;
+    return 1;
+  }
+
+  if (strcmp(name, "periodic") == 0) {
+    st->boundary = PERIODIC;
+    return 1;
+  }
+
+  if (strcmp(name, "reflective") == 0) {
+    st->boundary = REFLECTIVE;
+    if (! PyArg_ParseTuple(desc, "sO", &name, &sign_py))
+      return 0;
+    return doubles(sign_py, st->sign, st->p, "sign");
+  }
+
+  PyErr_SetString(PyExc_ValueError, "unknown boundary kernel");
+  return 0;
+}
+
+static int
+parse_reconstructor(stepper *st, PyObject *desc)
+{
+  const char *name;
+  PyObject *x_py, *dx_py, *b_py, *cl_py, *cr_py, *dl_py, *dr_py, *L_py;
+  int k;
+
+  if ((name = kind(desc)) == NULL)
+    return 0;
+
+  if (strcmp(name, "muscl") == 0) {
+    st->reconstructor = MUSCL;
+    st->g = 1;
+    if (! PyArg_ParseTuple(desc, "siOOO", &name, &st->limiter, &x_py, &dx_py, &b_py))
+      return 0;
+    return reference(st, x_py, &st->x, st->N, "x") && reference(st, dx_py, &st->dx, st->N, "dx")
+      && parse_boundary(st, b_py);
+  }
+
+  if (strcmp(name, "weno") == 0) {
+    st->reconstructor = WENO;
+    if (! PyArg_ParseTuple(desc, "sidOOOOOO", &name, &k, &st->epsilon,
+                           &cl_py, &cr_py, &dl_py, &dr_py, &L_py, &b_py))
+      return 0;
+    if (k < 1 || k > MAXK || st->N < k) {
+      PyErr_SetString(PyExc_ValueError, "unsupported WENO order");
+      return 0;
+    }
+    st->k = k;
+    st->g = k - 1;
+    return doubles(cl_py, st->cl, k*k, "cl") && doubles(cr_py, st->cr, k*k, "cr")
+      && doubles(dl_py, st->dl, k, "dl") && doubles(dr_py, st->dr, k, "dr")
+      && doubles(L_py, st->L, k*k*k, "L") && parse_boundary(st, b_py);
+  }
+
+  PyErr_SetString(PyExc_ValueError, "unknown reconstructor kernel");
+  return 0;
+}
+
+static int
+parse_flux(stepper *st, PyObject *desc)
+{
+  const char *name, *fname;
+  PyObject *params_py, *dx_py;
+
+  if ((name = kind(desc)) == NULL)
+    return 0;
+
+  if (strcmp(name, "lf") != 0) {
+    PyErr_SetString(PyExc_ValueError, "unknown flux kernel");
+    return 0;
+  }
+
+  if (! PyArg_ParseTuple(desc, "sdsOO", &name, &st->alpha, &fname, &params_py, &dx_py))
+    return 0;
+
+  if (strcmp(fname, "linear") == 0) {
+    st->flux = LINEAR;
+    if (! doubles(params_py, st->params, st->p, "params"))
+      return 0;
+  } else if (strcmp(fname, "burgers") == 0) {
+    st->flux = BURGERS;
+  } else if (strcmp(fname, "traffic") == 0) {
+    st->flux = TRAFFIC;
+    if (! doubles(params_py, st->params, 2, "params"))
+      return 0;
+  } else if (strcmp(fname, "shallowwater") == 0) {
+    st->flux = SHALLOWWATER;
+    if (st->p % 2 != 0) {
+      PyErr_SetString(PyExc_ValueError, "shallow water flux requires (h, hu) pairs");
+      return 0;
+    }
+    if (! doubles(params_py, st->params, 1, "params"))
+      return 0;
+  } else {
+    PyErr_SetString(PyExc_ValueError, "unknown pointwise flux kernel");
+    return 0;
+  }
+
+  return reference(st, dx_py, &st->fdx, st->N, "dx");
+}
+
+static int
+parse_active(stepper *st, PyObject *active_py)
+{
+  PyArrayObject *a;
+  int j;
+
+  a = (PyArrayObject *) PyArray_FROM_OTF(active_py, NPY_LONG, NPY_IN_ARRAY);
+  if (a == NULL)
+    return 0;
+
+  if (PyArray_SIZE(a) != st->p) {
+    PyErr_SetString(PyExc_ValueError, "active has the wrong size");
+    Py_DECREF(a);
+    return 0;
+  }
+
+  for (j=0; j<st->p; j++)
+    st->active[j] = (int) ((long *) PyArray_DATA(a))[j];
+  Py_DECREF(a);
+
+  return 1;
+}
+
+static int
+parse_evolver(stepper *st, PyObject *desc)
+{
+  const char *name;
+  PyObject *active_py;
+
+  if ((name = kind(desc)) == NULL)
+    return 0;
+
+  if (strcmp(name, "fe") == 0)
+    st->evolver = FE;
+  else if (strcmp(name, "ssperk3") == 0)
+    st->evolver = SSPERK3;
+  else {
+    PyErr_SetString(PyExc_ValueError, "unknown evolver kernel");
+    return 0;
+  }
+
+  if (! PyArg_ParseTuple(desc, "sO", &name, &active_py))
+    return 0;
+
+  return parse_active(st, active_py);
+}
+
+static int
+init(stepper *st, long int N, int p)
+{
+  memset(st, 0, sizeof(stepper));
+  st->N = N;
+  st->p = p;
+
+  /* sign, params (at least two for the traffic flux) and the scratch
+     space of sweep and nflux share one block */
+  st->sign = (double *) calloc(13*p + 2, sizeof(double));
+  st->active = (int *) calloc(p, sizeof(int));
+  if (st->sign == NULL || st->active == NULL) {
+    PyErr_NoMemory();
+    return 0;
+  }
+  st->params = st->sign + p;
+  st->work = st->params + p + 2;
+
+  return 1;
+}
+
+/*********************************************************************/
+
+/* cell average of (ghost) cell i, component m */
+static double
+cell(stepper *st, view q, long int i, int m)
+{
+  long int N = st->N;
+
+  if (i < 0) {
+    switch (st->boundary) {
+    case PERIODIC:   return V(q, i+N, m);
+    case REFLECTIVE: return st->sign[m] * V(q, -1-i, m);
+    default:         return V(q, 0, m);
+    }
+  }
+
+  if (i >= N) {
+    switch (st->boundary) {
+    case PERIODIC:   return V(q, i-N, m);
+    case REFLECTIVE: return st->sign[m] * V(q, 2*N-1-i, m);
+    default:         return V(q, N-1, m);
+    }
+  }
+
+  return V(q, i, m);
+}
+
+/* left and right reconstructions of cell i */
+static void
+reconstruct(stepper *st, view q, long int i, double *left, double *right)
+{
+  long int N = st->N;
+  int p = st->p, g = st->g, k = st->k, m, o, r, l, j;
+  double s[2*MAXK+1], *c, beta[MAXK], a, b, t, v, w, sigma, h, num, den;
+
+  for (m=0; m<p; m++) {
+
+    if (st->reconstructor == MUSCL) {
+
+      /* limited slope (the neighbours of the end cells are ghost
+         cells, which are taken to be as wide as the end cells) */
+      h = st->dx[i];
+      a = (V(q, i, m) - cell(st, q, i-1, m)) / (i > 0 ? st->x[i] - st->x[i-1] : h);
+      b = (cell(st, q, i+1, m) - V(q, i, m)) / (i < N-1 ? st->x[i+1] - st->x[i] : h);
+      sigma = limit(st->limiter, a, b);
+
+      left[m]  = V(q, i, m) - 0.5 * sigma * h;
+      right[m] = V(q, i, m) + 0.5 * sigma * h;
+      continue;
+    }
+
+    /* stencil: c[o] is the cell average of cell i+o */
+    if (i >= g && i < N-g)
+      for (o=-g; o<=g; o++)
+        s[g+o] = V(q, i+o, m);
+    else
+      for (o=-g; o<=g; o++)
+        s[g+o] = cell(st, q, i+o, m);
+    c = s + g;
+
+    /* smoothness indicators */
+    for (r=0; r<k; r++) {
+      b = 0.0;
+      for (l=0; l<k; l++) {
+        t = st->L[(r*k+l)*k] * c[-r];
+        for (j=1; j<k; j++)
+          t = t + st->L[(r*k+l)*k+j] * c[j-r];
+        b = b + t*t;
+      }
+      beta[r] = b;
+    }
+
+    /* left reconstruction */
+    num = 0.0;
+    den = 0.0;
+    for (r=0; r<k; r++) {
+      w = st->dl[r] / ((st->epsilon + beta[r]) * (st->epsilon + beta[r]));
+
+      v = st->cl[r*k] * c[-r];
+      for (j=1; j<k; j++)
+        v = v + st->cl[r*k+j] * c[j-r];
+
+      num = num + w * v;
+      den = den + w;
+    }
+    left[m] = num / den;
+
+    /* right reconstruction */
+    num = 0.0;
+    den = 0.0;
+    for (r=0; r<k; r++) {
+      w = st->dr[r] / ((st->epsilon + beta[r]) * (st->epsilon + beta[r]));
+
+      v = st->cr[r*k] * c[-r];
+      for (j=1; j<k; j++)
+        v = v + st->cr[r*k+j] * c[j-r];
+
+      num = num + w * v;
+      den = den + w;
+    }
+    right[m] = num / den;
+  }
+}
+
+/* pointwise flux f(q) of the state q */
+static void
+pointwise(stepper *st, double *q, double *f)
+{
+  int p = st->p, j;
+  double h, hu, g;
+
+  switch (st->flux) {
+
+  case LINEAR:
+    for (j=0; j<p; j++)
+      f[j] = st->params[j] * q[j];
+    break;
+
+  case BURGERS:
+    for (j=0; j<p; j++)
+      f[j] = 0.5 * q[j] * q[j];
+    break;
+
+  case TRAFFIC:
+    for (j=0; j<p; j++)
+      f[j] = st->params[0] * q[j] * (1.0 - q[j] / st->params[1]);
+    break;
+
+  case SHALLOWWATER:
+    g = st->params[0];
+    for (j=0; j<p; j+=2) {
+      h  = q[j];
+      hu = q[j+1];
+      f[j]   = hu;
+      f[j+1] = (hu*hu) / h + 0.5 * g * (h*h);
+    }
+    break;
+
+  }
+}
+
+/* Lax-Friedrichs numerical flux given the reconstructions qm and qp */
+static void
+nflux(stepper *st, double *qm, double *qp, double *f)
+{
+  int p = st->p, j;
+  double *fm = st->work + 9*p, *fp = st->work + 10*p;
+
+  pointwise(st, qm, fm);
+  pointwise(st, qp, fp);
+
+  for (j=0; j<p; j++)
+    f[j] = 0.5 * ( fm[j] + fp[j] - st->alpha * ( qp[j] - qm[j] ) );
+}
+
+/*
+ * Compute the stage
+ *
+ *   qout = a q0 + b qin + c dt L(qin)
+ *
+ * in a single sweep over the cells, where L(qin) is the net flux.
+ * The inactive (frozen) components of qout are set to those of qin.
+ * qout must not overlap qin (but may be q0).
+ */
+static void
+sweep(stepper *st, view qin, view q0, view qout, double dt, double a, double b, double c)
+{
+  long int i, N = st->N;
+  int p = st->p, j;
+  double *l0 = st->work, *rN = l0 + p, *lN = rN + p, *right = lN + p;
+  double *next = right + p, *carry = next + p, *qm = carry + p, *fl = qm + p, *fr = fl + p;
+  double *tmp, *pl = fl, *pr = fr, L, cdt = c * dt;
+
+  /* reconstructions of the first and last cells (for the ends) */
+  reconstruct(st, qin, 0, l0, right);
+  reconstruct(st, qin, N-1, lN, rN);
+
+  /* exterior reconstruction at the left end */
+  for (j=0; j<p; j++) {
+    switch (st->boundary) {
+    case PERIODIC:   qm[j] = rN[j]; break;
+    case REFLECTIVE: qm[j] = st->sign[j] * l0[j]; break;
+    default:         qm[j] = l0[j];
+    }
+  }
+
+  nflux(st, qm, l0, pl);
+  for (j=0; j<p; j++)
+    carry[j] = right[j];
+
+  for (i=0; i<N; i++) {
+
+    /* reconstruction from the right of boundary i+1 */
+    if (i < N-1)
+      reconstruct(st, qin, i+1, next, right);
+    else {
+      for (j=0; j<p; j++) {
+        switch (st->boundary) {
+        case PERIODIC:   next[j] = l0[j]; break;
+        case REFLECTIVE: next[j] = st->sign[j] * carry[j]; break;
+        default:         next[j] = carry[j];
+        }
+      }
+    }
+
+    nflux(st, carry, next, pr);
+
+    /* update cell i */
+    for (j=0; j<p; j++) {
+      if (st->active[j]) {
+        L = - ( pr[j] - pl[j] ) / st->fdx[i];
+        V(qout, i, j) = a * V(q0, i, j) + b * V(qin, i, j) + cdt * L;
+      } else
+        V(qout, i, j) = V(qin, i, j);
+    }
+
+    tmp = pl; pl = pr; pr = tmp;
+    for (j=0; j<p; j++)
+      carry[j] = right[j];
+  }
+}
+
+/*********************************************************************/
+
+PyObject *
+stage(PyObject *self, PyObject *args)
+{
+  PyObject *qin_py, *q0_py, *qout_py, *r_py, *f_py, *active_py;
+  double dt, a, b, c;
+  long int N;
+  stepper st;
+
+  /*
+   * parse options
+   */
+
+  if (! PyArg_ParseTuple(args, "OOOddddOOO", &qin_py, &q0_py, &qout_py, &dt, &a, &b, &c,
+                         &r_py, &f_py, &active_py))
+    return NULL;
+
+  if (! (check(qin_py, "qin") && check(q0_py, "q0") && check(qout_py, "qout")))
+    return NULL;
+
+  N = PyArray_DIM(qin_py, 0);
+  if (PyArray_DIM(q0_py, 0) != N || PyArray_DIM(qout_py, 0) != N
+      || PyArray_DIM(q0_py, 1) != PyArray_DIM(qin_py, 1)
+      || PyArray_DIM(qout_py, 1) != PyArray_DIM(qin_py, 1)) {
+    PyErr_SetString(PyExc_ValueError, "array dimensions do not match");
+    return NULL;
+  }
+
+  if (PyArray_DATA(qin_py) == PyArray_DATA(qout_py)) {
+    PyErr_SetString(PyExc_ValueError, "qout must not overlap qin");
+    return NULL;
+  }
+
+  if (! (init(&st, N, PyArray_DIM(qin_py, 1)) && parse_reconstructor(&st, r_py)
+         && parse_flux(&st, f_py) && parse_active(&st, active_py))) {
+    release(&st);
+    return NULL;
+  }
+
+  /*
+   * sweep
+   */
+
+  Py_BEGIN_ALLOW_THREADS
+  sweep(&st, as_view(qin_py), as_view(q0_py), as_view(qout_py), dt, a, b, c);
+  Py_END_ALLOW_THREADS
+
+  /*
+   * done
+   */
+
+  release(&st);
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+PyObject *
+run(PyObject *self, PyObject *args)
+{
+  PyObject *q_py, *t_py, *r_py, *f_py, *e_py;
+  PyArrayObject *t_arr;
+  double *t, *w, dt;
+  view q, u, v, tmp;
+  long int n, n0, n1, i, N;
+  int j, p;
+  stepper st;
+
+  /*
+   * parse options
+   */
+
+  if (! PyArg_ParseTuple(args, "OOllOOO", &q_py, &t_py, &n0, &n1, &r_py, &f_py, &e_py))
+    return NULL;
+
+  if (! check(q_py, "q"))
+    return NULL;
+
+  N = PyArray_DIM(q_py, 0);
+  p = PyArray_DIM(q_py, 1);
+
+  t_arr = (PyArrayObject *) PyArray_FROM_OTF(t_py, NPY_DOUBLE, NPY_IN_ARRAY);
+  if (t_arr == NULL)
+    return NULL;
+
+  if (n0 < 0 || n1 < n0 || n1 >= PyArray_SIZE(t_arr)) {
+    PyErr_SetString(PyExc_ValueError, "invalid step range");
+    Py_DECREF(t_arr);
+    return NULL;
+  }
+
+  if (! (init(&st, N, p) && parse_reconstructor(&st, r_py)
+         && parse_flux(&st, f_py) && parse_evolver(&st, e_py))) {
+    release(&st);
+    Py_DECREF(t_arr);
+    return NULL;
+  }
+
+  t = (double *) PyArray_DATA(t_arr);
+
+  /* contiguous work arrays: q and two stage arrays */
+  w = (double *) malloc(3*N*p*sizeof(double));
+  if (w == NULL) {
+    release(&st);
+    Py_DECREF(t_arr);
+    return PyErr_NoMemory();
+  }
+
+  q.data = w;       q.s0 = p*sizeof(double);  q.s1 = sizeof(double);
+  u = q;  u.data = w + N*p;
+  v = q;  v.data = w + 2*N*p;
+
+  /*
+   * step
+   */
+
+  Py_BEGIN_ALLOW_THREADS
+
+  for (i=0; i<N; i++)
+    for (j=0; j<p; j++)
+      V(q, i, j) = V(as_view(q_py), i, j);
+
+  for (n=n0; n<n1; n++) {
+    dt = t[n+1] - t[n];
+
+    if (st.evolver == FE) {
+      sweep(&st, q, q, u, dt, 0.0, 1.0, 1.0);
+      tmp = q; q = u; u = tmp;
+    } else {
+      sweep(&st, q, q, u, dt, 0.0, 1.0, 1.0);
+      sweep(&st, u, q, v, dt, 3.0/4.0, 1.0/4.0, 1.0/4.0);
+      sweep(&st, v, q, q, dt, 1.0/3.0, 2.0/3.0, 2.0/3.0);
+    }
+  }
+
+  for (i=0; i<N; i++)
+    for (j=0; j<p; j++)
+      V(as_view(q_py), i, j) = V(q, i, j);
+
+  Py_END_ALLOW_THREADS
+
+  /*
+   * done
+   */
+
+  free(w);
+  release(&st);
+  Py_DECREF(t_arr);
+
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+/*********************************************************************/
+
+static PyMethodDef cstepmethods[] = {
+    {"run", run, METH_VARARGS,
+     "run(q, t, n0, n1, reconstructor, flux, evolver): evolve q from t[n0] to t[n1]"},
+    {"stage", stage, METH_VARARGS,
+     "stage(qin, q0, qout, dt, a, b, c, reconstructor, flux, active): fused stage"},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+initcstep(void)
+{
+  (void) Py_InitModule("cstep", cstepmethods);
+  import_array();
+}
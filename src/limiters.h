@@ -0,0 +1,53 @@
+/*
+ * limiters - MUSCL slope limiters
+ */
+
+#ifndef PYBLAW_LIMITERS_H
+#define PYBLAW_LIMITERS_H
+
+#define MINMOD   0
+#define VANLEER  1
+#define MC       2
+#define SUPERBEE 3
+
+static double
+minmod(double a, double b)
+{
+  if (a*b <= 0.0)
+    return 0.0;
+
+  return (fabs(a) < fabs(b)) ? a : b;
+}
+
+static double
+maxmod(double a, double b)
+{
+  if (a*b <= 0.0)
+    return 0.0;
+
+  return (fabs(a) > fabs(b)) ? a : b;
+}
+
+static double
+limit(int limiter, double a, double b)
+{
+  switch (limiter) {
+
+  case VANLEER:
+    if (a*b <= 0.0)
+      return 0.0;
+    return 2.0*a*b / (a + b);
+
+  case MC:
+    return minmod(0.5*(a + b), minmod(2.0*a, 2.0*b));
+
+  case SUPERBEE:
+    return maxmod(minmod(2.0*a, b), minmod(a, 2.0*b));
+
+  default:
+    return minmod(a, b);
+
+  }
+}
+
+#endif